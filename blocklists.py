@@ -0,0 +1,102 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from prefix_set import PrefixSet
+
+
+class BlockList:
+    # a file with one address or network per line, as published by most threat feeds; anything after the
+    # first word of a line and lines starting with # or ; are left out
+    RELOAD_INTERVAL: float = 10
+
+    def __init__(self, path: str) -> None:
+        self._path: str = path
+        self._prefixes: PrefixSet = PrefixSet()
+        self._version: Optional[Tuple[int, int, int, int]] = None
+        self._checked: float = 0
+        self._reload_lock = threading.Lock()
+        self._reload()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def __len__(self) -> int:
+        return len(self._prefixes)
+
+    def _file_version(self) -> Optional[Tuple[int, int, int, int]]:
+        try:
+            st = os.stat(self._path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_dev, st.st_size, st.st_mtime_ns
+
+    def _load(self) -> PrefixSet:
+        networks: List[str] = []
+        with open(self._path, 'r', encoding='utf-8', errors='replace') as infile:
+            for line in infile:
+                words = line.split(None, 1)
+                if words and words[0][0] not in '#;':
+                    networks.append(words[0].rstrip(';,'))
+        prefixes = PrefixSet(networks, strict=False)
+        if prefixes.skipped:
+            logging.info("Skipped {} invalid entries in {}".format(prefixes.skipped, self._path))
+        return prefixes
+
+    def _reload(self) -> None:
+        # the file is only read again when it was replaced or written to, the old list is used until then
+        self._checked = time.monotonic()
+        version = self._file_version()
+        if version == self._version:
+            return
+        if version is None:
+            logging.warning("Cannot find block list {}".format(self._path))
+            self._prefixes = PrefixSet()
+            self._version = None
+            return
+        try:
+            self._prefixes = self._load()
+            self._version = version
+            logging.info("Loaded {} ranges from {}".format(len(self._prefixes), self._path))
+        except OSError as e:
+            logging.warning("Cannot read block list {}: {}".format(self._path, e))
+
+    def _reload_in_background(self) -> None:
+        try:
+            self._reload()
+        finally:
+            self._reload_lock.release()
+
+    def __contains__(self, address: str) -> bool:
+        if time.monotonic() - self._checked > self.RELOAD_INTERVAL and self._reload_lock.acquire(blocking=False):
+            # the file is checked by a thread of its own, lookups go on with the list they have meanwhile
+            self._checked = time.monotonic()
+            reloader = threading.Thread(target=self._reload_in_background, name="block-list")
+            reloader.daemon = True
+            reloader.start()
+        try:
+            return address.strip() in self._prefixes
+        except (ValueError, AttributeError):
+            # only addresses can be on the list
+            return False
+
+
+class BlockListRegistry:
+    # every parser that refers to the same file shares one list
+    _lists: Dict[str, BlockList] = {}
+    _files: Dict[str, BlockList] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, path: str) -> BlockList:
+        block_list = cls._lists.get(path, None)
+        if block_list is None:
+            with cls._lock:
+                key = os.path.abspath(path)
+                if key not in cls._files:
+                    cls._files[key] = BlockList(key)
+                block_list = cls._lists[path] = cls._files[key]
+        return block_list
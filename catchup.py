@@ -0,0 +1,103 @@
+import logging
+import multiprocessing
+import os
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from multi_matcher import MultiMatcher
+from parsers import RegexParser
+
+SEGMENT_SIZE: int = 16 * 1024 * 1024
+# the collector runs threads of its own and of pymongo by now, a forked worker could inherit one of their locks held
+START_METHOD: str = 'spawn'
+_SCAN_SIZE: int = 64 * 1024
+
+_matcher: Optional[MultiMatcher] = None
+_parser_index: Dict[RegexParser, int] = {}
+_name: str = ''
+
+
+def _init_worker(specs: List[Tuple], name: str) -> None:
+    global _matcher, _parser_index, _name
+    _matcher = MultiMatcher([RegexParser(regex, emit, transform, notify, None, None, name, enrich)
+                             for regex, emit, transform, notify, enrich in specs])
+    _parser_index = {p: idx for idx, p in enumerate(_matcher.parsers)}
+    _name = name
+
+
+def _parse_segment(segment: Tuple[str, int, int, int, int]) -> List[Tuple[int, Dict[str, Any]]]:
+    path, inode, dev, start, end = segment
+    with open(path, 'rb') as f:
+        stat_info = os.fstat(f.fileno())
+        if stat_info.st_ino != inode or stat_info.st_dev != dev:
+            raise ValueError("File {} was replaced".format(path))
+        f.seek(start)
+        data = f.read(end - start)
+    res: List[Tuple[int, Dict[str, Any]]] = []
+    pos: int = 0
+    while pos < len(data):
+        line_end: int = data.find(b'\n', pos)
+        if line_end < 0:
+            line_end = len(data)
+        line_start: int = pos
+        pos = line_end + 1
+        if not _matcher.prefilter_bytes(data, line_start, line_end):
+            continue
+        if line_end > line_start and data[line_end - 1] == 13:
+            line_end -= 1
+        for p, m in _matcher.match(data[line_start:line_end].decode('utf-8', 'replace') + '\n'):
+            res.append((_parser_index[p], p.emit(m, _name)))
+    return res
+
+
+def _next_line_start(f, pos: int, end: int) -> int:
+    f.seek(pos)
+    while pos < end:
+        block = f.read(min(_SCAN_SIZE, end - pos))
+        if not block:
+            break
+        idx = block.find(b'\n')
+        if idx >= 0:
+            return pos + idx + 1
+        pos += len(block)
+    return end
+
+
+def _last_line_end(f, start: int, end: int) -> int:
+    pos: int = end
+    while pos > start:
+        block_start: int = max(start, pos - _SCAN_SIZE)
+        f.seek(block_start)
+        idx = f.read(pos - block_start).rfind(b'\n')
+        if idx >= 0:
+            return block_start + idx + 1
+        pos = block_start
+    return start
+
+
+def _segments(path: str, inode: int, dev: int, start: int, end: int) -> Iterator[Tuple[str, int, int, int, int]]:
+    # line aligned pieces of the file, the incomplete last line is left for the normal reader
+    with open(path, 'rb') as f:
+        end = _last_line_end(f, start, end)
+        while start < end:
+            boundary: int = _next_line_start(f, min(start + SEGMENT_SIZE, end) - 1, end)
+            yield path, inode, dev, start, boundary
+            start = boundary
+
+
+def catch_up(path: str, inode: int, dev: int, start: int, end: int, parsers: MultiMatcher, name: str,
+             workers: int) -> Iterator[Tuple[int, List[Tuple[RegexParser, Dict[str, Any]]]]]:
+    # yields the end offset and the emitted output of each segment, in file order
+    specs = [p.spec for p in parsers.parsers]
+    pending: Deque[Tuple[int, Any]] = deque()
+    with multiprocessing.get_context(START_METHOD).Pool(workers, _init_worker, (specs, name)) as pool:
+        for segment in _segments(path, inode, dev, start, end):
+            pending.append((segment[4], pool.apply_async(_parse_segment, (segment,))))
+            # a couple of segments per worker in flight keeps them busy without piling up results
+            if len(pending) >= 2 * workers:
+                segment_end, result = pending.popleft()
+                yield segment_end, [(parsers.parsers[idx], output) for idx, output in result.get()]
+        while pending:
+            segment_end, result = pending.popleft()
+            yield segment_end, [(parsers.parsers[idx], output) for idx, output in result.get()]
+    logging.debug("Caught up on {} up to {}".format(path, end))
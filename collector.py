@@ -6,14 +6,17 @@ import traceback
 
 from output import Outputs
 from config import Config
+from enrichment import Enricher
 from state import State
 from notify import Notify
 from parsers import RegexParser
+from multi_matcher import MultiMatcher
 from util import pid_running, write_pidfile
 from log_analyser_version import get_prog_name, get_copyright
 from log_observer import LogObserver
+from importer import Importer
 from filenames import config_file_name, state_file_name, output_file_name, notify_file_name, ip_range_file_name, \
-    pid_file_name
+    pid_file_name, imported_file_name
 
 
 def main() -> None:
@@ -21,6 +24,7 @@ def main() -> None:
     CLEANUP_INTERVAL: int = 60 * 60  # 1 hour
     pid_path: str = '/tmp/'
     config_path: str = ''
+    workers: int = 1
     try:
         state_dump_timeout: int = LogObserver.STATE_DUMP_TIMEOUT
         parser = argparse.ArgumentParser(description=get_prog_name('collector') + "\n" + get_copyright())
@@ -30,6 +34,14 @@ def main() -> None:
         parser.add_argument("-p", '--pid', help="PID File Directory", default="", metavar="FILE")
         parser.add_argument("-d", '--dump_state_timeout', help="Timeout between periods dumping state", type=int,
                             default=LogObserver.STATE_DUMP_TIMEOUT, metavar="SECONDS")
+        parser.add_argument("-w", '--workers', help="Number of processes used to catch up on large backlogs",
+                            type=int, default=1, metavar="NUMBER")
+        parser.add_argument("-s", '--source', help="Configured log file whose filters are used for imported files",
+                            default=None, metavar="FILE")
+        parser.add_argument("command", help="run: follow the configured log files (default), "
+                                            "import: read the given (rotated, gzip or bz2 compressed) log files once",
+                            nargs='?', choices=['run', 'import'], default='run')
+        parser.add_argument("files", help="Files to import", nargs='*', metavar="FILE")
         args = parser.parse_args()
         if args.version:
             print(get_prog_name('collector'))
@@ -43,6 +55,8 @@ def main() -> None:
             LOG_LEVEL = logging.DEBUG
         if args.pid:
             pid_path = args.pid
+        if args.workers:
+            workers = args.workers
 
         logging.basicConfig(level=LOG_LEVEL)
         logging.info(get_prog_name('collector') + "  --  " + get_copyright())
@@ -64,6 +78,11 @@ def main() -> None:
         output.parse_outputs(output_file)
         local_ip.load_local_address(local_ip_file)
 
+        if args.command == 'import':
+            importer = Importer(config, output, os.path.join(config_path, imported_file_name), workers)
+            importer.import_files(args.files, args.source)
+            return
+
         observer = LogObserver(state_file, CLEANUP_INTERVAL, state_dump_timeout, notify.cleanup)
 
         if os.path.isfile(pid_file):
@@ -81,13 +100,18 @@ def main() -> None:
                 retention_time: int = config.get_retention(fl)
                 output_type = output.get_output(config.get_output(fl))
 
+                enricher = Enricher.from_config(config.get_enrich(fl))
+                enrich = enricher.lookups if enricher is not None else None
+
                 output_conn = output.connect(output_type)
+                output_conn.start_builds()
                 res = []
                 for x in filters:
                     res.append(
-                        RegexParser(x['regex'], x['emit'], x['transform'], x['notify'], notify, output_conn, log_name))
+                        RegexParser(x['regex'], x['emit'], x['transform'], x['notify'], notify, output_conn, log_name,
+                                    enrich))
 
-                observer.add(fl, pos, res, inode, dev, output_conn, log_name, retention_time)
+                observer.add(fl, pos, MultiMatcher(res), inode, dev, output_conn, log_name, retention_time, workers)
 
             write_pidfile(pid_file)
             observer.start()
@@ -0,0 +1,166 @@
+import logging
+import operator
+import re
+from typing import Any, Callable, Dict, List, Set, Tuple, Union
+
+from blocklists import BlockListRegistry
+from local_ip import is_local_address
+from prefix_set import address_in_prefix, address_key, prefix_set
+
+# predicate(value, source) -> bool, for the value of one field of a document
+Predicate = Callable[[Any, str], bool]
+# per condition the predicates that all have to hold, cheapest first; the document matches if any condition does
+Compiled = List[List[Tuple[str, Predicate]]]
+
+# rough relative costs, a lookup in the database or the seen values comes last
+COST_COMPARE: int = 1
+COST_MEMBER: int = 1
+COST_REGEX: int = 2
+COST_PREFIX: int = 2
+COST_BLOCK_LIST: int = 3
+COST_NEW: int = 10
+
+_OPERATORS: List[Tuple[str, Callable[[Any, Any], bool]]] = [
+    ('<=', operator.le), ('>=', operator.ge), ('>', operator.gt), ('<', operator.lt), ('=', operator.eq),
+    ('!', operator.ne),
+]
+
+
+def get_operator(element: str) -> Tuple[str, Callable[[Any, Any], bool]]:
+    for prefix, op in _OPERATORS:
+        if element.startswith(prefix):
+            return element[len(prefix):], op
+    raise ValueError("Unknown operator: {}".format(element))
+
+
+def _never(value: Any, source: str) -> bool:
+    return False
+
+
+def _compile_compare(element: str) -> Predicate:
+    val, op = get_operator(element)
+    val = val.strip()
+    equal = op == operator.eq
+    is_address = False
+    if op in (operator.eq, operator.ne):
+        try:
+            address_key(val)
+            is_address = True
+        except ValueError:
+            pass
+    number = int(val) if val.isnumeric() else None
+
+    def compare(value: Any, source: str) -> bool:
+        if is_address and type(value) == str:
+            try:
+                # the value may be a network the address is in
+                return (val in prefix_set(value.strip())) == equal
+            except ValueError:
+                # not an IP address
+                pass
+        try:
+            if number is not None and (type(value) == int or (type(value) == str and value.isnumeric())):
+                return op(int(value), number)
+            return op(value, val)
+        except TypeError:
+            return False
+
+    return compare
+
+
+def _compile_regex(element: str) -> Predicate:
+    try:
+        pattern = re.compile(element[1:])
+    except re.error as e:
+        logging.warning("Invalid regular expression {}: {}".format(element[1:], e))
+        return _never
+
+    def match(value: Any, source: str) -> bool:
+        return pattern.match(str(value)) is not None
+
+    return match
+
+
+def _compile_local(local: bool) -> Predicate:
+    def check(value: Any, source: str) -> bool:
+        try:
+            return is_local_address(value) == local
+        except ValueError:
+            # only for IP addresses
+            return False
+
+    return check
+
+
+def _compile_operators(element: Dict[str, Any]) -> List[Tuple[int, Predicate]]:
+    predicates: List[Tuple[int, Predicate]] = []
+    for key, arg in element.items():
+        if key.lower() == 'in':
+            if type(arg) == list:
+                members = frozenset(str(x) for x in arg)
+                predicates.append((COST_MEMBER, lambda value, source, members=members: value in members))
+            else:
+                predicates.append((COST_PREFIX,
+                                   lambda value, source, prefix=arg: address_in_prefix(value, prefix)))
+        elif key.lower() == 'in_file':
+            # a list of addresses and networks in a file, shared and reloaded when it changes
+            predicates.append((COST_BLOCK_LIST,
+                               lambda value, source, path=arg: value in BlockListRegistry.get(path)))
+        else:
+            logging.info("Unknown operator {}".format(key))
+    return predicates
+
+
+def compile_element(element: Any, field: str, is_new: Callable[[str, str, Any], bool]) \
+        -> List[Tuple[int, Predicate]]:
+    # the predicates for one element of a field, with their cost; all and any don't need one
+    if type(element) == dict:
+        return _compile_operators(element)
+    if element == 'new':
+        return [(COST_NEW, lambda value, source: is_new(source, field, value))]
+    if element == 'all' or element == 'any':
+        return []
+    if element == 'local' or element == 'nonlocal':
+        return [(COST_PREFIX, _compile_local(element == 'local'))]
+    if type(element) != str or element == '':
+        return [(COST_COMPARE, _never)]
+    if element[0] in "=!<>":
+        return [(COST_COMPARE, _compile_compare(element))]
+    if element[0] == '~':
+        return [(COST_REGEX, _compile_regex(element))]
+    return [(COST_COMPARE, _never)]
+
+
+def compile_conditions(conditions: List[Dict[str, Union[Any, List[Any]]]],
+                       is_new: Callable[[str, str, Any], bool]) -> Compiled:
+    compiled: Compiled = []
+    for condition in conditions:
+        # an empty condition never matches
+        if len(condition) == 0:
+            continue
+        predicates: List[Tuple[int, int, str, Predicate]] = []
+        for field, elements in condition.items():
+            for element in (elements if type(elements) == list else [elements]):
+                for cost, predicate in compile_element(element, field, is_new):
+                    predicates.append((cost, len(predicates), field, predicate))
+        predicates.sort(key=lambda x: x[:2])
+        compiled.append([(field, predicate) for _cost, _order, field, predicate in predicates])
+    return compiled
+
+
+def new_fields(conditions: List[Dict[str, Union[Any, List[Any]]]]) -> Set[str]:
+    # the fields the new condition is used on
+    return {field for condition in conditions for field, elements in condition.items()
+            if 'new' in (elements if type(elements) == list else [elements])}
+
+
+def match_conditions(compiled: Compiled, doc: Dict[str, Any]) -> bool:
+    source = doc.get('name', None)
+    for condition in compiled:
+        for field, predicate in condition:
+            # a field the document doesn't have is not checked
+            if field in doc and not predicate(doc[field], source):
+                break
+        else:
+            return True
+    return False
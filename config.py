@@ -27,6 +27,7 @@ class Config:
         'name': Config_Checker.MANDATORY,
         'output': Config_Checker.MANDATORY,
         'retention': Config_Checker.OPTIONAL,
+        'enrich': Config_Checker.OPTIONAL,
         'filter': {
             "regex": Config_Checker.MANDATORY,
             "emit": Config_Checker.MANDATORY,
@@ -55,6 +56,7 @@ class Config:
                 'name': config_element['name'],
                 'output': config_element['output'],
                 'retention': config_element.get('retention', None),
+                'enrich': config_element.get('enrich', None),
                 'filter': []
             }
             for t in config_element['filter']:
@@ -90,6 +92,12 @@ class Config:
                 return str(i['name'])
         return None
 
+    def get_enrich(self, filename: str) -> Any:
+        for i in self._config:
+            if i['path'] == filename:
+                return i['enrich']
+        return None
+
     def get_filter(self, filename: str) -> Optional[List[Dict[str, Any]]]:
         for i in self._config:
             if i['path'] == filename:
@@ -0,0 +1,168 @@
+import logging
+import re
+import string
+import time
+import dateutil.parser
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from time_parsers import datetime_parsers
+from util import DataSet
+
+data_conversion = DataSet()
+_var_regex = re.compile(r"([$]\w+)")
+_field_base_regex = re.compile(r"[^.\[]*")
+_formatter = string.Formatter()
+
+
+def _to_bool(value: str) -> bool:
+    if value.lower() == 'true':
+        return True
+    elif value.lower() == 'false':
+        return False
+    else:
+        raise ValueError("Unknown value {}".format(value))
+
+
+transforms: Dict[str, Callable[[str], Any]] = {
+    'date': dateutil.parser.isoparse,
+    'int': int,
+    'str': str,
+    'float': float,
+    'bool': _to_bool,
+}
+
+
+class EmitPlan:
+    CONST = 0
+    CAPTURE = 1
+    FORMAT = 2
+    REFRESH_INTERVAL: int = 300
+
+    def __init__(self, format_str: Optional[Dict[str, str]], transform: Optional[Dict[str, str]],
+                 filters: Dict[str, Tuple[int, Callable]], keep_hidden: bool) -> None:
+        self._format_str: Dict[str, str] = format_str if format_str is not None else {}
+        self._transform: Dict[str, str] = transform if transform is not None else {}
+        self._filters: Dict[str, Tuple[int, Callable]] = filters
+        self._keep_hidden: bool = keep_hidden
+        self._expires: float = 0
+        self._steps: List[Tuple[str, int, Any]] = []
+        self.compile()
+
+    @property
+    def keep_hidden(self) -> bool:
+        return self._keep_hidden
+
+    @staticmethod
+    def _expand(val: str, dynamic: bool) -> str:
+        def replace(m) -> str:
+            if not dynamic and data_conversion.is_dynamic(m.group(1)):
+                return m.group(1)
+            return data_conversion.get(m.group(1), '-')
+
+        return _var_regex.sub(replace, val)
+
+    def _get_transform(self, key: str) -> Optional[Callable[[str], Any]]:
+        if key not in self._transform:
+            return None
+        try:
+            return transforms[self._transform[key]]
+        except KeyError:
+            raise ValueError("Unknown transform {}".format(self._transform[key]))
+
+    @staticmethod
+    def _fast_converter(tp: Callable, transform: Optional[Callable]) -> Optional[Callable]:
+        # skips the round trip through a string where the result is the same; None means the match is used as is
+        if tp is str:
+            return None if transform is None or transform is str else transform
+        if transform is transforms['date'] and tp in datetime_parsers:
+            return datetime_parsers[tp]
+        if tp is transform and tp in (int, float):
+            return tp
+        if transform is None:
+            return lambda v: format(tp(v))
+        return lambda v: transform(format(tp(v)))
+
+    @staticmethod
+    def _full_converter(tp: Callable, transform: Optional[Callable]) -> Callable:
+        if transform is None:
+            return lambda v: format(tp(v))
+        return lambda v: transform(format(tp(v)))
+
+    def compile(self) -> None:
+        steps: List[Tuple[str, int, Any]] = []
+        has_static_vars: bool = False
+        for key, val in self._format_str.items():
+            if key.startswith('!') and not self._keep_hidden:
+                continue
+            transform = self._get_transform(key)
+            variables: List[str] = _var_regex.findall(val)
+            dynamic: bool = any(data_conversion.is_dynamic(x) for x in variables)
+            has_static_vars = has_static_vars or any(not data_conversion.is_dynamic(x) for x in variables)
+            template: str = self._expand(val, False)
+            try:
+                fields = [x for x in _formatter.parse(template) if x[1] is not None]
+            except ValueError as e:
+                raise ValueError("Invalid emit template {}: {}".format(val, e))
+            names: List[str] = [_field_base_regex.match(x[1]).group() for x in fields]
+            if any(x == '' or x.isdigit() for x in names):
+                # positional fields fail when formatting, same as they always did
+                steps.append((key, self.FORMAT, (template, [], transform, dynamic)))
+                continue
+            if any(x not in self._filters for x in names):
+                # refers to something the regex never captures, so there is nothing to emit
+                continue
+            if not fields and not dynamic:
+                try:
+                    value = template.format()
+                    steps.append((key, self.CONST, transform(value) if transform is not None else value))
+                    continue
+                except ValueError:
+                    pass
+            if len(fields) == 1 and not dynamic and template == '{' + fields[0][1] + '}':
+                index, tp = self._filters[names[0]]
+                steps.append((key, self.CAPTURE, (index, tp, self._fast_converter(tp, transform),
+                                                  self._full_converter(tp, transform))))
+                continue
+            captures = [(x, self._filters[x][0], self._filters[x][1]) for x in set(names)]
+            steps.append((key, self.FORMAT, (template, captures, transform, dynamic)))
+        self._steps = steps
+        self._expires = time.monotonic() + self.REFRESH_INTERVAL if has_static_vars else float('inf')
+
+    def emit(self, matches: List[str], name: str) -> Dict[str, Union[datetime, int, str, float, bool]]:
+        if time.monotonic() >= self._expires:
+            self.compile()
+        res = {}
+        for key, kind, data in self._steps:
+            if kind == self.CONST:
+                res[key] = data
+            elif kind == self.CAPTURE:
+                index, tp, fast, full = data
+                m = matches[index]
+                if m is not None:
+                    try:
+                        res[key] = m if fast is None else fast(m)
+                    except ValueError as e:
+                        logging.info('Error: invalid value {} for {}: {}'.format(m, key, e))
+                    continue
+                try:
+                    res[key] = full(m)
+                except TypeError:
+                    logging.info('Error: {} is not a {}'.format(m, tp))
+            else:
+                template, captures, transform, dynamic = data
+                values = {}
+                for capture_name, index, tp in captures:
+                    try:
+                        values[capture_name] = tp(matches[index])
+                    except TypeError:
+                        logging.info('Error: {} is not a {}'.format(matches[index], tp))
+                if dynamic:
+                    template = self._expand(template, True)
+                try:
+                    rv = template.format(**values)
+                except KeyError:
+                    continue
+                res[key] = transform(rv) if transform is not None else rv
+        res['name'] = name
+        return res
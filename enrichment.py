@@ -0,0 +1,82 @@
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+from util import get_asn_info, get_flag, get_prefix
+
+# the lookups an input file can ask for, and the fields each of them adds to a document
+ENRICH_FIELDS: Dict[str, Tuple[str, ...]] = {
+    'country': ('country_code', 'country_name'),
+    'asn': ('asn', 'as_organisation'),
+    'prefix': ('prefix',),
+}
+SOURCE_FIELD: str = 'ip_address'
+CACHE_SIZE: int = 65536
+
+
+# the same addresses come back over and over, so one cache is shared by every file, parser and the web pages
+@lru_cache(maxsize=CACHE_SIZE)
+def country(ip_address: str) -> Tuple[str, str]:
+    return get_flag(ip_address)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def asn(ip_address: str) -> Dict[str, Any]:
+    return get_asn_info(ip_address)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def prefix(ip_address: str) -> Optional[str]:
+    return get_prefix(ip_address)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def lookup(ip_address: str, lookups: Tuple[str, ...]) -> Tuple[Tuple[str, Any], ...]:
+    fields = []
+    if 'country' in lookups:
+        iso_code, name = country(ip_address)
+        if iso_code:
+            fields += [('country_code', iso_code), ('country_name', name)]
+    if 'asn' in lookups:
+        info = asn(ip_address)
+        if info:
+            fields += [('asn', info['AS Number']), ('as_organisation', info['AS Organisation'])]
+    if 'prefix' in lookups:
+        network = prefix(ip_address)
+        if network is not None:
+            fields.append(('prefix', network))
+    return tuple(fields)
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    return {x.__name__: x.cache_info()._asdict() for x in (lookup, country, asn, prefix)}
+
+
+class Enricher:
+    def __init__(self, lookups: Iterable[str]) -> None:
+        self._lookups: Tuple[str, ...] = tuple(x for x in ENRICH_FIELDS if x in lookups)
+        unknown = set(lookups) - set(ENRICH_FIELDS)
+        if unknown:
+            raise ValueError("Unknown enrichment: {}".format(", ".join(sorted(unknown))))
+
+    @property
+    def lookups(self) -> Tuple[str, ...]:
+        return self._lookups
+
+    @staticmethod
+    def from_config(value: Union[None, bool, str, Iterable[str]]) -> Optional['Enricher']:
+        # "enrich": true adds everything, otherwise a list of lookups
+        if value is None or value is False:
+            return None
+        if value is True:
+            return Enricher(ENRICH_FIELDS)
+        if type(value) == str:
+            value = [value]
+        return Enricher(value)
+
+    def enrich(self, doc: Dict[str, Any]) -> None:
+        ip_address = doc.get(SOURCE_FIELD, None)
+        if type(ip_address) != str or ip_address == '':
+            return
+        for key, value in lookup(ip_address.strip(), self._lookups):
+            if key not in doc:
+                doc[key] = value
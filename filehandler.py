@@ -1,18 +1,27 @@
 import logging
+import mmap
 import os
 import threading
 # import traceback
 
 from watchdog.events import FileModifiedEvent
 from outputters.output_abstract import AbstractOutput
-from parsers import LogParser
+from multi_matcher import MultiMatcher
+from catchup import catch_up
 from typing import Any, Optional, Dict, List
 
 
 class FileHandler:
-    def __init__(self, filename: str, pos: int, parsers: List, inode: int, dev: int, output_conn: AbstractOutput,
-                 name: str, retention: int) -> None:
+    CHUNK_SIZE: int = 1024 * 1024
+    MMAP_BACKFILL_THRESHOLD: int = 64 * 1024 * 1024
+    CATCHUP_THRESHOLD: int = 64 * 1024 * 1024
+    TAIL_SIZE: int = 256
+    _compressed_suffixes = ('.gz', '.bz2', '.xz', '.zst')
+
+    def __init__(self, filename: str, pos: int, parsers: MultiMatcher, inode: int, dev: int, output_conn: AbstractOutput,
+                 name: str, retention: int, workers: int = 1) -> None:
         self._pos: int = pos
+        self._workers: int = workers
         self._lock = threading.Lock()
         self._path: str = filename
         self._name: str = name
@@ -21,9 +30,21 @@ class FileHandler:
         self._inode: int = -1
         self._dev: int = -1
         self._output_engine: AbstractOutput = output_conn
-        self._line: str = ''
-        self._parsers: List[LogParser] = parsers
+        # raw data read from the file that is not processed yet, starting at file offset _buffer_offset
+        self._buffer: bytearray = bytearray(self.CHUNK_SIZE)
+        self._fill: int = 0
+        self._buffer_offset: int = pos
+        self._scanned: int = 0
+        # the last bytes before _pos, to recognise the copy of the file after a copytruncate
+        self._tail: bytes = b''
+        # after a rotation the old file is kept open until the new one is written to
+        self._rotated: bool = False
+        self._rotated_path: Optional[str] = None
+        self._parsers: MultiMatcher = parsers
+        # the pool only catches up while the collector starts, rotations later on are read by the watchdog thread
+        self._starting: bool = True
         self._open_file(inode, dev)
+        self._starting = False
 
     def __str__(self) -> str:
         return "path: {}, pos: {},  output: {}, name: {}".format(
@@ -31,22 +52,32 @@ class FileHandler:
 
     def flush_output(self) -> None:
         if self._output_engine is not None:
-            self._output_engine.commit()
+            self._output_engine.flush()
+            logging.debug("Output {}: {}".format(self._output_engine.name, self._output_engine.stats()))
 
     def _open_file(self, inode: Optional[int] = None, dev: Optional[int] = None) -> None:
         logging.debug("Opening file: {} as {}".format(self._path, self._name))
-        self._line = ''
+        self._fill = 0
         try:
             stat_info = os.stat(self._path)
             self._inode = stat_info.st_ino
             self._dev = stat_info.st_dev
-            self._file = open(self._path, "r")
             if inode != self._inode or dev != self._dev:
                 # we got the same file as before
                 # otherwise we start reading at 0, file may have been truncated or rotated
+                rotated_path = self._find_rotated(inode, dev)
+                if rotated_path is not None:
+                    self._drain(rotated_path, inode, dev)
+                    self._inode = stat_info.st_ino
+                    self._dev = stat_info.st_dev
                 self._pos = 0
+                self._tail = b''
+            self._file = open(self._path, "rb", buffering=0)
             logging.debug("Starting at {}".format(self._pos))
             self._file.seek(self._pos)
+            self._buffer_offset = self._pos
+            self._catch_up(self._path)
+            self._backfill()
             self._read_contents()
         except (OSError, PermissionError):
             logging.info('Cannot open file: {}'.format(self._path))
@@ -62,69 +93,288 @@ class FileHandler:
     def dump_state(self) -> Dict[str, Any]:
         with self._lock:
             _pos = self._pos
-        return {"pos": _pos, "path": self._path, 'inode': self._inode, 'device': self._dev}
-
-    @staticmethod
-    def _filter_output(output_dict):
-        return {key: val for key, val in output_dict.items() if not key.startswith('!')}
+            inode, dev = self._inode, self._dev
+        # whatever the output has not committed yet has to be read again after a restart
+        unacked = self._output_engine.checkpoint(self) if self._output_engine is not None else None
+        if unacked is not None:
+            inode, dev, _pos = unacked
+        return {"pos": _pos, "path": self._path, 'inode': inode, 'device': dev}
 
-    def _match_line(self, line: str) -> None:
+    def _match_line(self, line: str, offset: int) -> None:
         if self._output_engine is None:
             raise ValueError("output engine not initialised")
-        for p in self._parsers:
-            m = p.match(line)
-            if m:
-                output = p.emit(m, self._name)
-                self._output_engine.write(self._filter_output(output))
-                p.notify(output, self._name)
-
-    def _process_line(self, line: str) -> bool:
-        logging.debug(line)
-        self._line += line
-        if line[-1:] != "\n":
-            return False
-        line = self._line
-        self._line = ''
-        self._match_line(line)
-        return True
+        for p, m in self._parsers.match(line):
+            output = p.emit(m, self._name)
+            data = p.filter_output(output)
+            # notified first, so the new condition doesn't see the values of this very line
+            p.notify(output, self._name)
+            # the output acknowledges the line once it is committed, until then the state points at it
+            self._output_engine.write(data, (self, (self._inode, self._dev, offset)))
+
+    def _scan_lines(self, data, start: int, end: int, base: int) -> None:
+        # hands the complete lines in data[start:end] to the parsers, _scanned ends up after the last one
+        pos: int = start
+        try:
+            while True:
+                line_end: int = data.find(b'\n', pos, end)
+                if line_end < 0:
+                    break
+                line_start: int = pos
+                pos = line_end + 1
+                if not self._parsers.prefilter_bytes(data, line_start, line_end):
+                    continue
+                if line_end > line_start and data[line_end - 1] == 13:
+                    line_end -= 1
+                self._match_line(data[line_start:line_end].decode('utf-8', 'replace') + '\n', base + line_start)
+        finally:
+            self._scanned = pos
+
+    def _process_buffer(self) -> None:
+        try:
+            self._scan_lines(self._buffer, 0, self._fill, self._buffer_offset)
+        finally:
+            if self._scanned > 0:
+                self._tail = bytes(self._buffer[max(0, self._scanned - self.TAIL_SIZE):self._scanned])
+                # keep the incomplete last line at the front of the buffer
+                remaining: int = self._fill - self._scanned
+                self._buffer[:remaining] = self._buffer[self._scanned:self._fill]
+                self._fill = remaining
+                self._buffer_offset += self._scanned
+                with self._lock:
+                    self._pos = self._buffer_offset
+
+    def _catch_up(self, path: str) -> None:
+        # a large backlog is parsed by a pool of processes, the output is written here in file order
+        if self._workers <= 1 or not self._starting:
+            return
+        size: int = os.fstat(self._file.fileno()).st_size
+        if size - self._pos < self.CATCHUP_THRESHOLD:
+            return
+        logging.info("Catching up on {} from {} to {} with {} workers".format(path, self._pos, size, self._workers))
+        try:
+            for end, results in catch_up(path, self._inode, self._dev, self._pos, size, self._parsers,
+                                         self._name, self._workers):
+                for p, output in results:
+                    data = p.filter_output(output)
+                    p.notify(output, self._name)
+                    self._output_engine.write(data, (self, (self._inode, self._dev, self._pos)))
+                # only move past the segment once everything in it is committed
+                self._output_engine.flush()
+                with self._lock:
+                    self._pos = end
+        except (OSError, ValueError) as e:
+            logging.warning("Catching up on {} stopped: {}".format(path, e))
+        self._buffer_offset = self._pos
+        self._file.seek(self._pos)
+
+    def _backfill(self) -> None:
+        # a large backlog is scanned straight from the page cache, after that the file is tailed as usual
+        size: int = os.fstat(self._file.fileno()).st_size
+        if size - self._pos < self.MMAP_BACKFILL_THRESHOLD:
+            return
+        try:
+            data = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            logging.info("Cannot map file {}: {}".format(self._path, e))
+            return
+        logging.debug("Backfilling {} from {} to {}".format(self._path, self._pos, size))
+        with data:
+            try:
+                self._scan_lines(data, self._pos, size, 0)
+            finally:
+                if self._scanned > 0:
+                    self._tail = data[max(0, self._scanned - self.TAIL_SIZE):self._scanned]
+                self._buffer_offset = self._scanned
+                self._file.seek(self._scanned)
+                with self._lock:
+                    self._pos = self._scanned
+
+    def _process_partial_line(self) -> None:
+        # the file will not grow anymore, so the incomplete last line is all there will be
+        if self._fill == 0:
+            return
+        self._buffer[self._fill:self._fill + 1] = b'\n'
+        self._fill += 1
+        self._process_buffer()
+        self._buffer_offset -= 1
+        with self._lock:
+            self._pos = self._buffer_offset
+
+    def _rotated_files(self) -> List[str]:
+        directory, base_name = os.path.split(self._path)
+        try:
+            names = os.listdir(directory or '.')
+        except OSError:
+            return []
+        return [os.path.join(directory, x) for x in names if x.startswith(base_name) and x != base_name and
+                not x.endswith(self._compressed_suffixes)]
+
+    def _find_rotated(self, inode: Optional[int], dev: Optional[int]) -> Optional[str]:
+        if inode is None or dev is None or inode < 0:
+            return None
+        for path in self._rotated_files():
+            try:
+                stat_info = os.stat(path)
+            except OSError:
+                continue
+            if stat_info.st_ino == inode and stat_info.st_dev == dev:
+                return path
+        return None
+
+    def _find_copy(self) -> Optional[str]:
+        # copytruncate leaves no trace but the content, the copy has what we read so far at the same offset
+        if not self._tail:
+            return None
+        candidates = []
+        for path in self._rotated_files():
+            try:
+                stat_info = os.stat(path)
+                if stat_info.st_size < self._pos:
+                    continue
+                with open(path, 'rb') as f:
+                    f.seek(self._pos - len(self._tail))
+                    if f.read(len(self._tail)) == self._tail:
+                        candidates.append((stat_info.st_mtime, path))
+            except OSError:
+                continue
+        return max(candidates)[1] if candidates else None
+
+    def _drain(self, path: str, inode: int, dev: int) -> None:
+        # reads the rest of a rotated file from where we were, state keeps pointing at it until it is done
+        logging.info("Reading rotated file {} from {}".format(path, self._pos))
+        self._inode = inode
+        self._dev = dev
+        self._fill = 0
+        try:
+            with open(path, "rb", buffering=0) as f:
+                self._file = f
+                f.seek(self._pos)
+                self._buffer_offset = self._pos
+                self._catch_up(path)
+                self._backfill()
+                self._read_contents()
+                self._process_partial_line()
+        except OSError as e:
+            logging.warning("Cannot read rotated file {}: {}".format(path, e))
+        finally:
+            self._file = None
+            self._fill = 0
+
+    def _check_truncated(self) -> None:
+        try:
+            size: int = os.fstat(self._file.fileno()).st_size
+        except (OSError, ValueError):
+            return
+        if size >= self._buffer_offset + self._fill:
+            return
+        logging.info("File {} was truncated".format(self._path))
+        current_file = self._file
+        copy_path = self._find_copy()
+        if copy_path is not None:
+            stat_info = os.stat(copy_path)
+            self._drain(copy_path, stat_info.st_ino, stat_info.st_dev)
+        self._file = current_file
+        stat_info = os.fstat(self._file.fileno())
+        self._inode = stat_info.st_ino
+        self._dev = stat_info.st_dev
+        self._fill = 0
+        self._buffer_offset = 0
+        self._tail = b''
+        self._file.seek(0)
+        with self._lock:
+            self._pos = 0
 
     def _read_contents(self) -> None:
         if self._file is None:
             raise ValueError("File not initialised")
+        if not self._rotated:
+            self._check_truncated()
         while True:
+            if len(self._buffer) - self._fill < self.CHUNK_SIZE:
+                # the incomplete line is long, make room for a full chunk after it
+                self._buffer.extend(bytes(self.CHUNK_SIZE))
             try:
-                line = self._file.readline()
+                with memoryview(self._buffer) as view:
+                    length = self._file.readinto(view[self._fill:])
             except ValueError:
-                line = ''
-            if not line:
+                length = 0
+            if not length:
                 break
-            if self._process_line(line):
-                with self._lock:
-                    self._pos = self._file.tell()
+            self._fill += length
+            self._process_buffer()
+
+    def _switch_file(self) -> None:
+        # the new file is being written to, so nothing more will end up in the rotated one
+        if self._file is not None:
+            self._read_contents()
+            self._process_partial_line()
+            self._file.close()
+            self._file = None
+        logging.info("Switching to new file {}".format(self._path))
+        self._rotated = False
+        self._rotated_path = None
+        self._open_file(None, None)
+
+    def _rotate(self, rotated_path: Optional[str]) -> None:
+        if self._file is None:
+            return
+        self._read_contents()
+        self._rotated = True
+        self._rotated_path = rotated_path
+        try:
+            if os.path.getsize(self._path) > 0:
+                self._switch_file()
+        except OSError:
+            pass
+
+    def handles(self, event: FileModifiedEvent) -> bool:
+        paths = [x for x in (self._path, self._rotated_path) if x]
+        return not event.is_directory and (event.src_path in paths or getattr(event, 'dest_path', None) in paths)
 
     def on_modified(self, event: FileModifiedEvent) -> None:
-        if not event.is_directory and self._path == event.src_path:
+        if event.is_directory:
+            return
+        if self._path == event.src_path:
+            if self._rotated:
+                self._switch_file()
+            elif self._file is not None:
+                self._read_contents()
+        elif self._rotated and self._rotated_path == event.src_path:
             self._read_contents()
 
     def on_deleted(self, event: FileModifiedEvent) -> None:
-        if not event.is_directory and self._path == event.src_path:
-            self._read_contents()
-            if self._file is not None:
-                self._file.close()
-            self._open_file(self._inode, self._dev)
+        if not event.is_directory and self._path == event.src_path and not self._rotated:
+            # the open file can still be read until we switch to a new one
+            self._rotate(None)
 
     def on_moved(self, event: FileModifiedEvent) -> None:
-        if not event.is_directory and self._path == event.src_path:
-            self._read_contents()
-            if self._file is not None:
-                self._file.close()
-            self._open_file(self._inode, self._dev)
+        if event.is_directory:
+            return
+        if self._path == event.src_path and not self._rotated:
+            self._rotate(event.dest_path)
+        elif self._rotated and self._rotated_path == event.src_path:
+            # rotated once more before we were done with it
+            self._rotated_path = event.dest_path
+        elif self._path == event.dest_path:
+            if not self._rotated and self._file is not None:
+                # another file took its place
+                self._rotate(None)
+            else:
+                self.on_created(event)
 
     def on_created(self, event: FileModifiedEvent) -> None:
-        if not event.is_directory and self._path == event.src_path:
+        if event.is_directory:
+            return
+        if self._rotated:
+            try:
+                if os.path.getsize(self._path) > 0:
+                    self._switch_file()
+            except OSError:
+                pass
+        elif self._file is None:
             self._open_file(self._inode, self._dev)
-            self._read_contents()
 
     def on_closed(self, event: FileModifiedEvent) -> None:
-        if not event.is_directory and self._path == event.src_path:
+        if not event.is_directory and self._file is not None and \
+                (self._path == event.src_path or (self._rotated and self._rotated_path == event.src_path)):
             self._read_contents()
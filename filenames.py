@@ -8,3 +8,4 @@ ip_range_file_name: str = "loganalyser.ip_ranges"
 # internally used files
 pid_file_name: str = "loganalyser.pid"
 state_file_name: str = "loganalyser.state"
+imported_file_name: str = "loganalyser.imported"
@@ -1,11 +1,14 @@
 import json
 import logging
-from typing import Optional, Dict
+from typing import Any, Optional, Dict
+
+from prefix_set import PrefixMap
 
 
 class Hostnames:
     def __init__(self, filename: str) -> None:
         self._hostnames: Dict[str, str] = {}
+        self._prefixes: PrefixMap = PrefixMap()
         self.load_hostnames(filename)
 
     def load_hostnames(self, filename: str) -> None:
@@ -17,9 +20,17 @@ class Hostnames:
             self._hostnames = {}
         except (FileNotFoundError, PermissionError):
             logging.warning("Cannot find open file: {}".format(filename))
+        # names given to a network are found with the prefixes, compiled once per load
+        self._prefixes = PrefixMap(self._hostnames.items())
 
     def get_hostnames(self) -> Dict[str, str]:
         return self._hostnames
 
     def translate(self, ip_address: str) -> Optional[str]:
         return self._hostnames.get(ip_address.strip())
+
+    def match_prefix(self, ip_address: str, default: Any = None) -> Any:
+        try:
+            return self._prefixes.get(ip_address.strip(), default)
+        except ValueError:
+            return default
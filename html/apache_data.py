@@ -2,12 +2,11 @@ import datetime
 import json
 import os
 import re
-import pymongo
 import pytz
 import tzlocal
 
 from typing import List, Dict, Any, Optional, Tuple, Union
-from functions import match_ip_address, get_mongo_connection, format_time, get_period_mask
+from functions import match_ip_address, aggregate, format_time, get_first_seen, get_period_mask
 from data_set import Data_set
 
 
@@ -36,8 +35,7 @@ def get_search_mask_apache(search: str) -> Dict[str, Any]:
 
 def get_apache_methods_data(mask: Dict[str, Any], search: str) -> Data_set:
     search_q = get_search_mask_apache(search)
-    col = get_mongo_connection()
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "apache_access"}, mask, search_q]}},
          {"$group": {
              "_id": "$http_command",
@@ -63,8 +61,7 @@ def get_apache_codes_data(mask: Dict[str, Any], search: str) -> Data_set:
     search_q = get_search_mask_apache(search)
     http_codes_list = http_codes()
 
-    col = get_mongo_connection()
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "apache_access"}, mask, search_q]}},
          {"$group": {
              "_id": "$code",
@@ -89,8 +86,7 @@ def get_apache_codes_data(mask: Dict[str, Any], search: str) -> Data_set:
 
 def get_apache_protocols_data(mask: Dict[str, Any], search: str) -> Data_set:
     search_q = get_search_mask_apache(search)
-    col = get_mongo_connection()
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "apache_access"}, mask, search_q]}},
          {"$group": {"_id": {"protocol": "$protocol", "protocol_version": "$protocol_version"},
                      'hosts': {"$addToSet": "$hostname"},
@@ -112,15 +108,17 @@ def get_apache_protocols_data(mask: Dict[str, Any], search: str) -> Data_set:
 
 def get_apache_ips_data(mask: Dict[str, Any], search: str, name: str) -> Data_set:
     search_q = get_search_mask_apache(search)
-    col = get_mongo_connection()
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "apache_access"}, mask, search_q]}},
          {"$group": {
              "_id": "$ip_address",
              "total": {"$sum": 1},
              'usernames': {"$addToSet": "$username"},
              'hosts': {"$addToSet": "$hostname"},
-             "codes": {"$addToSet": "$code"}
+             "codes": {"$addToSet": "$code"},
+             "prefix": {"$max": "$prefix"},
+             "country_code": {"$max": "$country_code"},
+             "country_name": {"$max": "$country_name"}
          }},
          {"$sort": {"total": -1}}
          ])
@@ -140,7 +138,10 @@ def get_apache_ips_data(mask: Dict[str, Any], search: str, name: str) -> Data_se
             'users': ", ".join(sorted(x['usernames'])),
             'codes': ", ".join(codes),
             '_code_descriptions': ", ".join(code_names),
-            'hosts': ", ".join(sorted(x['hosts']))
+            'hosts': ", ".join(sorted(x['hosts'])),
+            '_prefix': x['prefix'],
+            '_country_code': x['country_code'],
+            '_country_name': x['country_name']
         }
         data.add_data_row(row)
     if name == 'ip_prefixes':
@@ -150,23 +151,7 @@ def get_apache_ips_data(mask: Dict[str, Any], search: str, name: str) -> Data_se
 
 def get_apache_new_ips_data(mask: Dict[str, Any], search: str, start_time: datetime.datetime) -> Data_set:
     search_q = get_search_mask_apache(search)
-    col = get_mongo_connection()
-    ips: Dict[str, Tuple[int, datetime.date]] = {}
-    res = col.aggregate(
-        [{"$match": {"$and": [{"name": "apache_access"}]}},
-         {"$group": {
-             "_id": {"ip_address": "$ip_address"},
-             "total": {"$sum": 1},
-             "oldest": {"$min": "$timestamp"}}},
-         {"$sort": {"total": -1}}
-         ])
-    for x in res:
-        ip: str = x['_id']['ip_address']
-        t: int = x['total']
-        o = pytz.UTC.localize(x['oldest'])
-        if ip not in ips:
-            ips[ip] = (t, o)
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "apache_access"}, mask, search_q]}},
          {"$group": {
              "_id": {"ip_address": "$ip_address"},
@@ -175,8 +160,11 @@ def get_apache_new_ips_data(mask: Dict[str, Any], search: str, start_time: datet
              'users': {"$addToSet": "$username"}}},
          {"$sort": {"total": -1}}
          ])
+    rows = list(res)
+    ips = {k[0]: v for k, v in get_first_seen('apache_access', ('ip_address',),
+                                               [(x['_id'].get('ip_address', None),) for x in rows]).items()}
     new_ips: Dict[str, Tuple[int, str, str]] = {}
-    for x in res:
+    for x in rows:
         ip1: str = x['_id']['ip_address']
         ts: int = x['total']
         ty: str = ", ".join(sorted(x['users']))
@@ -199,8 +187,7 @@ def get_apache_new_ips_data(mask: Dict[str, Any], search: str, start_time: datet
 
 def get_apache_urls_data(mask: Dict[str, Any], search: str) -> Data_set:
     search_q = get_search_mask_apache(search)
-    col = get_mongo_connection()
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "apache_access"}, mask, search_q]}},
          {"$group": {
              "_id": {"path": "$path", "code": "$code"},
@@ -227,11 +214,10 @@ def get_apache_time_ips_data(mask: Dict[str, Any], search: str, raw: bool,
                              intervals: List[Union[int, str, Tuple[int, int]]], time_mask: str, name: str) -> Data_set:
     local_tz = str(tzlocal.get_localzone())
     search_q = get_search_mask_apache(search)
-    col: pymongo.collection.Collection = get_mongo_connection()
     orig_time_mask = time_mask.capitalize()
     if time_mask == 'day':
         time_mask = 'dayOfMonth'
-    res = col.aggregate([
+    res = aggregate([
         {"$match": {"$and": [{"name": "apache_access"}, mask, search_q]}},
         {"$group": {
             "_id": {
@@ -279,11 +265,10 @@ def get_apache_time_urls_data(mask: Dict[str, Any], search: str, raw: bool,
                               intervals: List[Union[int, str, Tuple[int, int]]], time_mask: str) -> Data_set:
     local_tz = str(tzlocal.get_localzone())
     search_q = get_search_mask_apache(search)
-    col = get_mongo_connection()
     orig_time_mask = time_mask.capitalize()
     if time_mask == 'day':
         time_mask = 'dayOfMonth'
-    res = col.aggregate([
+    res = aggregate([
         {"$match": {"$and": [{"name": "apache_access"}, mask, search_q]}},
         {"$group": {
             "_id": {"time": {"$" + time_mask: {"date": "$timestamp", "timezone": local_tz}},
@@ -315,13 +300,15 @@ def get_apache_time_urls_data(mask: Dict[str, Any], search: str, raw: bool,
 
 def get_apache_size_ip_data(mask: Dict[str, Any], search: str, name: str, raw: bool) -> Data_set:
     search_q = get_search_mask_apache(search)
-    col = get_mongo_connection()
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "apache_access"}, mask, search_q]}},
          {"$group": {
              "_id": {"ip_address": "$ip_address"},
              'hosts': {"$addToSet": "$hostname"},
-             "total": {"$sum": "$size"}}},
+             "total": {"$sum": "$size"},
+             "prefix": {"$max": "$prefix"},
+             "country_code": {"$max": "$country_code"},
+             "country_name": {"$max": "$country_name"}}},
          {"$sort": {"total": -1}}
          ])
     data = Data_set('prefix' if name == 'size_prefix' else 'ip_address', None, 'size')
@@ -329,7 +316,10 @@ def get_apache_size_ip_data(mask: Dict[str, Any], search: str, name: str, raw: b
         row = {
             'ip_address': x['_id']['ip_address'],
             'size': x['total'],
-            'hosts': ", ".join(sorted(x['hosts']))
+            'hosts': ", ".join(sorted(x['hosts'])),
+            '_prefix': x['prefix'],
+            '_country_code': x['country_code'],
+            '_country_name': x['country_name']
         }
         data.add_data_row(row)
     if name == 'size_prefix':
@@ -344,8 +334,7 @@ def get_apache_size_ip_data(mask: Dict[str, Any], search: str, name: str, raw: b
 
 def get_apache_size_user_data(mask: Dict[str, Any], search: str, raw: bool) -> Data_set:
     search_q = get_search_mask_apache(search)
-    col = get_mongo_connection()
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "apache_access"}, mask, search_q]}},
          {"$group": {
              "_id": {"username": "$username"},
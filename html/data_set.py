@@ -11,7 +11,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
 from hostnames import Hostnames
 from filenames import hostnames_file_name
-from util import get_prefix, get_flag
+import enrichment
 from functions import join_str_list
 
 
@@ -60,7 +60,11 @@ class Data_set:
                        sort_by=None) -> None:
         rv2: Dict[str, Dict[str, Union[str, int]]] = {}
         for x in self._data:
-            iso_code, country = get_flag(str(x['ip_address']))
+            # stored by the collector when the file is enriched, looked up otherwise
+            if x.get('_country_code', None):
+                iso_code, country = x['_country_code'], x.get('_country_name', '')
+            else:
+                iso_code, country = enrichment.country(str(x['ip_address']))
             key = iso_code
             if country is None or country == '':
                 key = country = 'Unknown'
@@ -85,7 +89,7 @@ class Data_set:
         rv2: Dict[str, Dict[str, Union[str, int]]] = {}
 
         for x in self._data:
-            prefix: Optional[str] = get_prefix(str(x['ip_address']))
+            prefix: Optional[str] = x.get('_prefix', None) or enrichment.prefix(str(x['ip_address']))
             if prefix is None:
                 prefix = str(x['ip_address'])
             key = prefix
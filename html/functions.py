@@ -4,13 +4,17 @@ import os.path
 import dateutil.parser
 import pymongo
 import pytz
+import tzlocal
 import dns.resolver
 import whois
 
 from typing import List, Dict, Any, Optional, Tuple, Union
 from filenames import output_file_name
 from output import Outputs
-from outputters.output_mongo import MongoConnector
+from outputters.first_seen import FIRST_SEEN_VIEWS, first_seen_id, first_seen_name, is_built
+from outputters.output_mongo import MongoConnector, watermark_name
+from outputters.partitions import time_range
+from outputters.rollups import GRANULARITIES, bucket, rewrite, rollup_name, rollup_since
 
 
 def get_period_mask(period: str, to_time: Optional[str] = None, from_time: Optional[str] = None,
@@ -124,18 +128,99 @@ def get_hosts_mongo() -> List[str]:
     return list(set([x.lower() for x in res]))
 
 
-def get_mongo_connection() -> pymongo.collection.Collection:
-    config_path: str = os.path.dirname(__file__)
+_mongo_connection: Optional[Tuple[float, MongoConnector, Dict[str, Any]]] = None
+
+
+def _get_mongo_connector() -> Tuple[MongoConnector, Dict[str, Any]]:
+    # the outputs file is only parsed again when it changed, the client behind it is shared
+    global _mongo_connection
+    output_file: str = os.path.join(os.path.dirname(__file__), '..', output_file_name)
+    mtime: float = os.path.getmtime(output_file)
+    if _mongo_connection is not None and _mongo_connection[0] == mtime:
+        return _mongo_connection[1], _mongo_connection[2]
     output = Outputs()
-    output.parse_outputs(os.path.join(config_path, '..', output_file_name))
+    output.parse_outputs(output_file)
     config = output.get_output('mongo')
     if config is None:
         raise ValueError("Configuration error: No Mongo configured")
     mc = MongoConnector(config)
-    col: pymongo.collection.Collection = mc.get_collection()
+    _mongo_connection = (mtime, mc, config)
+    return mc, config
+
+
+def get_mongo_connection() -> pymongo.collection.Collection:
+    col: pymongo.collection.Collection = _get_mongo_connector()[0].get_collection()
     return col
 
 
+def get_write_watermarks() -> Dict[str, datetime.datetime]:
+    mc, config = _get_mongo_connector()
+    col = mc.get_database()[watermark_name(config['collection'])]
+    return {x['_id']: x['timestamp'] for x in col.find()}
+
+
+def _match_source(match: Dict[str, Any]) -> Optional[str]:
+    if type(match.get('name', None)) == str:
+        return match['name']
+    for sub in match.get('$and', []):
+        source = _match_source(sub)
+        if source is not None:
+            return source
+    return None
+
+
+def _rollup_granularity(candidates: List[str], start: datetime.datetime, end: datetime.datetime) -> Optional[str]:
+    # a rollup only gives the same result when the period consists of whole buckets,
+    # the end may be the last second of a bucket or still to come
+    now = datetime.datetime.utcnow()
+    local_offset = datetime.datetime.now(tzlocal.get_localzone()).utcoffset()
+    for candidate in candidates:
+        seconds: int = GRANULARITIES[candidate]
+        if candidate == 'hour' and local_offset is not None and local_offset.total_seconds() % 3600 != 0:
+            continue
+        if bucket(start, seconds) != start:
+            continue
+        if end >= now or bucket(end, seconds) + datetime.timedelta(seconds=seconds - 1) <= end:
+            return candidate
+    return None
+
+
+def aggregate(pipeline: List[Dict[str, Any]]):
+    # panels over a period are answered from the rollups of the collector when they give the same result
+    mc, config = _get_mongo_connector()
+    if config.get('rollups', False) and pipeline and '$match' in pipeline[0]:
+        source = _match_source(pipeline[0]['$match'])
+        start, end = time_range(pipeline[0]['$match'])
+        rewritten = rewrite(pipeline, source) if source is not None and start is not None and end is not None \
+            else None
+        if rewritten is not None:
+            granularity = _rollup_granularity(rewritten[1], start, end)
+            since = rollup_since(mc.get_database(), config['collection'], source)
+            if granularity is not None and since is not None and start >= since:
+                return mc.get_database()[rollup_name(config['collection'], granularity)].aggregate(rewritten[0])
+    return mc.get_collection().aggregate(pipeline)
+
+
+def get_first_seen(source: str, fields: Tuple[str, ...], keys: List[Tuple]) \
+        -> Dict[Tuple, Tuple[int, datetime.datetime]]:
+    # total and first time of the given values over the whole history, looked up in the first seen index
+    # of the collector when it is complete, counted from the events otherwise
+    mc, config = _get_mongo_connector()
+    if config.get('first_seen', False) and is_built(mc.get_database(), config['collection'], source, fields):
+        col = mc.get_database()[first_seen_name(config['collection'])]
+        res = col.find({'_id': {'$in': [first_seen_id(source, fields, x) for x in keys]}})
+        # counted by the build and as the events were written
+        return {tuple(x['_id'][f] for f in fields): (x.get('total', 0) + x.get('built_total', 0),
+                                                     pytz.UTC.localize(x['first_seen'])) for x in res}
+    condition = dict(next(x[1] for x in FIRST_SEEN_VIEWS[source] if x[0] == fields))
+    res = mc.get_collection().aggregate(
+        [{"$match": {"$and": [{"name": source}] + [{k: v} for k, v in condition.items()]}},
+         {"$group": {"_id": {f: "$" + f for f in fields}, "total": {"$sum": 1}, "oldest": {"$min": "$timestamp"}}}],
+        allowDiskUse=True)
+    return {tuple(x['_id'].get(f, None) for f in fields): (x['total'], pytz.UTC.localize(x['oldest']))
+            for x in res}
+
+
 def join_str_list(list1: str, list2: str) -> str:
     a: List[str] = list1.split(',')
     b: List[str] = list2.split(',')
@@ -1,10 +1,10 @@
 #!/usr/bin/python3
 import argparse
-import ipaddress
 import json
 import logging
 import os.path
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 import pymongo
@@ -15,14 +15,19 @@ import tzlocal
 from typing import List, Dict, Any, Tuple
 from flask import Flask, render_template, request, make_response, Response
 from data_set import Data_set
-from functions import get_period_mask, get_mongo_connection, get_dns_data, get_whois_data, get_hosts_mongo
-from util import get_flag, get_asn_info, get_prefix, get_location_info
+from functions import get_period_mask, get_mongo_connection, get_dns_data, get_whois_data, get_hosts_mongo, \
+    get_write_watermarks
+from query_cache import QueryCache
+from util import get_asn_info, get_prefix, get_location_info
 from ssh_data import get_ssh_data
 from apache_data import get_apache_data
 from nntp_proxy_data import get_nntp_proxy_data
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import enrichment
+from prefix_set import PrefixMap
 from outputters.output_mongo import MongoConnector
+from outputters.mongo_clients import MongoClientRegistry
 from notify import Notify
 from hostnames import Hostnames
 from log_analyser_version import get_prog_name
@@ -31,6 +36,12 @@ from filenames import notify_file_name, hostnames_file_name
 config_path: str = os.path.dirname(__file__)
 app = Flask(__name__)
 hostnames = Hostnames(os.path.join(config_path, '..', hostnames_file_name))
+query_cache = QueryCache(get_write_watermarks)
+# the panels of a batch request run side by side, on the shared mongo client
+PANEL_WORKERS: int = 8
+panel_executor = ThreadPoolExecutor(PANEL_WORKERS, thread_name_prefix='panel')
+# the source the panels of each type read
+data_sources: Dict[str, str] = {'ssh': 'auth_ssh', 'apache': 'apache_access', 'nntp_proxy': 'nntp_proxy'}
 
 
 class Dashboard_data_types:
@@ -142,17 +153,23 @@ def get_mongo_notifications() -> pymongo.collection.Collection:
     return col
 
 
-@app.route('/data/', methods=['POST'])
-def load_data() -> Tuple[str, int, Dict[str, str]]:
+def panel_data(spec: Dict[str, Any]) -> str:
     hostnames_list = hostnames.get_hostnames()
-    name: str = request.json.get('name', '').strip()
-    rtype: str = request.json.get('type', '').strip()
-    period: str = request.json.get('period', '').strip()
-    search: str = request.json.get('search', '').strip()
-    to_time: str = request.json.get("to", '')
-    from_time: str = request.json.get("from", '')
-    host: str = request.json.get("host", '').strip()
-    raw: bool = request.json.get('raw', False)
+    name: str = spec.get('name', '').strip()
+    rtype: str = spec.get('type', '').strip()
+    period: str = spec.get('period', '').strip()
+    search: str = spec.get('search', '').strip()
+    to_time: str = spec.get("to", '')
+    from_time: str = spec.get("from", '')
+    host: str = spec.get("host", '').strip()
+    raw: bool = spec.get('raw', False)
+    key = (rtype, name, period, search, host, from_time, to_time, raw)
+    source = data_sources.get(rtype, None)
+    # read before the query, so whatever is written while it runs makes the result outdated
+    watermark = query_cache.watermark(source)
+    cached = query_cache.get(key, source)
+    if cached is not None:
+        return cached
     if rtype == 'ssh':
         data: Data_set = get_ssh_data(name, period, search, raw, to_time, from_time, host)
     elif rtype == 'apache':
@@ -169,8 +186,8 @@ def load_data() -> Tuple[str, int, Dict[str, str]]:
         else:
             fields = keys
             res2 = [[x for x in res1.values()]]
-        return json.dumps({'success': True, "data": res2, "labels": keys, "fields": fields,
-                           "hostnames": hostnames_list}), 200, {'ContentType': 'application/json'}
+        result = json.dumps({'success': True, "data": res2, "labels": keys, "fields": fields,
+                             "hostnames": hostnames_list})
     else:
         res3: List[Dict[str, str]] = []
         keys = data.keys
@@ -179,22 +196,54 @@ def load_data() -> Tuple[str, int, Dict[str, str]]:
             # Force every thing to string, so we can truncate stuff in the template
             res3.append({k: str(v) for k, v in x.items()})
         rhtml = render_template("data_table.html", data=res3, keys=keys, hostnames=hostnames_list)
-        return json.dumps({'success': True, 'rhtml': rhtml}), 200, {'ContentType': 'application/json'}
+        result = json.dumps({'success': True, 'rhtml': rhtml})
+    period_end = get_period_mask(period, to_time, from_time, pytz.timezone(str(tzlocal.get_localzone())))[1]
+    query_cache.put(key, result, period, source, period_end, watermark)
+    return result
+
+
+@app.route('/data/', methods=['POST'])
+def load_data() -> Tuple[str, int, Dict[str, str]]:
+    return panel_data(request.json), 200, {'ContentType': 'application/json'}
+
+
+def _batch_panel(spec: Dict[str, Any]) -> str:
+    # the worker threads have no request, templates only need the application
+    with app.app_context():
+        return panel_data(spec)
+
+
+@app.route('/data_batch/', methods=['POST'])
+def load_data_batch() -> Response:
+    # all panels of the dashboard in one request, every panel is sent as soon as its query is done
+    specs: List[Dict[str, Any]] = request.json.get('panels', [])
+    futures = {panel_executor.submit(_batch_panel, spec): i for i, spec in enumerate(specs)}
+
+    def generate():
+        for future in as_completed(futures):
+            index: int = futures[future]
+            try:
+                yield '{{"index": {}, "result": {}}}\n'.format(index, future.result())
+            except Exception as e:
+                logging.warning("Panel {} failed: {}".format(specs[index], e))
+                yield json.dumps({'index': index, 'result': {'success': False, 'error': str(e)}}) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson')
 
 
 @app.context_processor
 def utility_processor():
     def match_prefix(ip: str, prefixes: Dict[str, str]) -> str:
+        # the hostnames are compiled when they are loaded, any other prefixes for this call
+        if prefixes is hostnames.get_hostnames():
+            return hostnames.match_prefix(ip, "")
         try:
-            for x in prefixes:
-                if ipaddress.ip_address(ip.strip()) in ipaddress.ip_network(x.strip()):
-                    return prefixes[x]
-        except Exception:
-            pass
-        return ""
+            return PrefixMap(prefixes.items()).get(ip.strip(), "")
+        except ValueError:
+            return ""
 
     def get_flag_by_ip(ip_address: str):
-        return get_flag(ip_address)
+        return enrichment.country(ip_address)
 
     def get_hostname(ip_address: str):
         hostname = hostnames.translate(ip_address)
@@ -208,6 +257,16 @@ def utility_processor():
     return dict(match_prefix=match_prefix, get_flag_by_ip=get_flag_by_ip, get_hostname=get_hostname)
 
 
+@app.route('/pool_stats/', methods=['GET'])
+def pool_stats() -> Tuple[str, int, Dict[str, str]]:
+    return json.dumps(MongoClientRegistry.stats()), 200, {'ContentType': 'application/json'}
+
+
+@app.route('/cache_stats/', methods=['GET'])
+def cache_stats() -> Tuple[str, int, Dict[str, str]]:
+    return json.dumps(dict(query_cache.stats(), lookups=enrichment.cache_stats())), 200, {'ContentType': 'application/json'}
+
+
 @app.route('/hosts/', methods=['POST'])
 def hosts() -> Tuple[str, int, Dict[str, str]]:
     try:
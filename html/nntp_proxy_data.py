@@ -2,13 +2,12 @@ import datetime
 import os.path
 import re
 import sys
-import pymongo
 import pytz
 import tzlocal
 
 from data_set import Data_set
 from typing import List, Dict, Any, Optional, Tuple, Union
-from functions import match_ip_address, get_mongo_connection, format_time, get_period_mask
+from functions import match_ip_address, aggregate, format_time, get_first_seen, get_period_mask
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
@@ -22,23 +21,7 @@ def get_search_mask_nntp(search: str) -> Optional[Dict[str, Any]]:
 
 def get_nntp_proxy_new_ips_data(mask: Dict[str, Any], search: str, start_time: datetime.datetime) -> Data_set:
     search_q = get_search_mask_nntp(search)
-    col = get_mongo_connection()
-    ips: Dict[str, Tuple[int, datetime.date]] = {}
-    res = col.aggregate(
-        [{"$match": {"$and": [{"name": "nntp_proxy"}]}},
-         {"$group": {
-             "_id": {"ip_address": "$ip_address"},
-             "total": {"$sum": 1},
-             "oldest": {"$min": "$timestamp"}}},
-         {"$sort": {"total": -1}}
-         ])
-    for x in res:
-        ip: str = x['_id']['ip_address']
-        t: int = x['total']
-        o = pytz.UTC.localize(x['oldest'])
-        if ip not in ips:
-            ips[ip] = (t, o)
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "nntp_proxy"}, mask, search_q]}},
          {"$group": {
              "_id": {"ip_address": "$ip_address"},
@@ -47,8 +30,11 @@ def get_nntp_proxy_new_ips_data(mask: Dict[str, Any], search: str, start_time: d
          }},
          {"$sort": {"total": -1}}
          ])
+    rows = list(res)
+    ips = {k[0]: v for k, v in get_first_seen('nntp_proxy', ('ip_address',),
+                                               [(x['_id'].get('ip_address', None),) for x in rows]).items()}
     new_ips: Dict[str, Tuple[int, str, str]] = {}
-    for x in res:
+    for x in rows:
         ip1: str = x['_id']['ip_address']
         ts: int = x['total']
         th: str = ", ".join(sorted(x['hosts']))
@@ -72,11 +58,10 @@ def get_nntp_proxy_time_ips_data(mask: Dict[str, Any], search: str, raw: bool,
                                  intervals: List[Union[int, str, Tuple[int, int]]], time_mask: str, name:str) -> Data_set:
     local_tz = str(tzlocal.get_localzone())
     search_q = get_search_mask_nntp(search)
-    col: pymongo.collection.Collection = get_mongo_connection()
     orig_time_mask = time_mask.capitalize()
     if time_mask == 'day':
         time_mask = 'dayOfMonth'
-    res = col.aggregate([
+    res = aggregate([
         {"$match": {"$and": [{"name": "nntp_proxy"}, mask, search_q]}},
         {"$group": {
             "_id": {
@@ -127,14 +112,16 @@ def get_nntp_proxy_time_ips_data(mask: Dict[str, Any], search: str, raw: bool,
 
 def get_nntp_proxy_ips_data(mask: Dict[str, Any], search: str, name: str) -> Data_set:
     search_q = get_search_mask_nntp(search)
-    col = get_mongo_connection()
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "nntp_proxy"}, mask, search_q]}},
          {"$group": {"_id": "$ip_address",
                      "total": {"$sum": 1},
                      'hosts': {"$addToSet": "$hostname"},
                      'ports': {"$addToSet": "$port"},
                      'dest_ports': {"$addToSet": "$dest_port"},
+                     "prefix": {"$max": "$prefix"},
+                     "country_code": {"$max": "$country_code"},
+                     "country_name": {"$max": "$country_name"},
                      }},
          {"$sort": {"total": -1}}
          ])
@@ -150,7 +137,10 @@ def get_nntp_proxy_ips_data(mask: Dict[str, Any], search: str, name: str) -> Dat
             'count': x['total'],
             'hosts': ", ".join(sorted(x['hosts'])),
             'ports': ", ".join(sorted([str(y) for y in x['ports']])),
-            'dest_ports': ", ".join((sorted([str(y) for y in x['dest_ports']])))
+            'dest_ports': ", ".join((sorted([str(y) for y in x['dest_ports']]))),
+            '_prefix': x['prefix'],
+            '_country_code': x['country_code'],
+            '_country_name': x['country_name']
         }
         data.add_data_row(row)
     if name == 'ip_prefixes':
@@ -160,14 +150,16 @@ def get_nntp_proxy_ips_data(mask: Dict[str, Any], search: str, name: str) -> Dat
 
 def get_nntp_proxy_size_ip_data(mask: Dict[str, Any], search: str, name: str, raw: bool) -> Data_set:
     search_q = get_search_mask_nntp(search)
-    col = get_mongo_connection()
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "nntp_proxy"}, mask, search_q]}},
          {"$group": {
              "_id": {"ip_address": "$ip_address"},
              'hosts': {"$addToSet": "$hostname"},
              "total_up": {"$sum": "$up_size"},
-             "total_down": {"$sum": "$down_size"}
+             "total_down": {"$sum": "$down_size"},
+             "prefix": {"$max": "$prefix"},
+             "country_code": {"$max": "$country_code"},
+             "country_name": {"$max": "$country_name"}
          }},
          {"$sort": {"total": -1}}
          ])
@@ -177,7 +169,10 @@ def get_nntp_proxy_size_ip_data(mask: Dict[str, Any], search: str, name: str, ra
             'ip_address': x['_id']['ip_address'],
             'size_down': x['total_down'],
             'size_up': x['total_up'],
-            'hosts': ", ".join(sorted(x['hosts']))
+            'hosts': ", ".join(sorted(x['hosts'])),
+            '_prefix': x['prefix'],
+            '_country_code': x['country_code'],
+            '_country_name': x['country_name']
         }
         # print(row)
         data.add_data_row(row)
@@ -0,0 +1,94 @@
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class QueryCache:
+    # how long a result may be shown, by period: the shorter the period, the sooner new events show up
+    PERIOD_TTL: Dict[str, float] = {
+        'hour': 10,
+        '24hour': 30,
+        'today': 30,
+        'yesterday': 600,
+        'week': 120,
+        'month': 300,
+        'custom': 60,
+    }
+    DEFAULT_TTL: float = 30
+    MAX_ENTRIES: int = 500
+    MAX_BYTES: int = 64 * 1024 * 1024
+    WATERMARK_POLL: float = 2
+
+    def __init__(self, watermarks: Callable[[], Dict[str, datetime.datetime]], max_entries: int = MAX_ENTRIES,
+                 max_bytes: int = MAX_BYTES) -> None:
+        # watermarks() returns the newest timestamp the collector wrote per source
+        self._watermarks = watermarks
+        self._max_entries: int = max_entries
+        self._max_bytes: int = max_bytes
+        self._lock = threading.Lock()
+        # key -> (result, expiry, source, watermark when computed, end of the period)
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes: int = 0
+        # the watermarks are read outside the lock of the entries, by one thread at a time
+        self._poll_lock = threading.Lock()
+        self._current: Dict[str, datetime.datetime] = {}
+        self._polled: float = 0
+        self._hits: int = 0
+        self._misses: int = 0
+
+    def watermark(self, source: Optional[str]) -> Optional[datetime.datetime]:
+        now = time.monotonic()
+        if now - self._polled > self.WATERMARK_POLL and self._poll_lock.acquire(blocking=False):
+            # the others go on with the watermarks they have, which can only be older
+            try:
+                self._polled = now
+                try:
+                    self._current = self._watermarks()
+                except Exception:
+                    # without a watermark the entries only expire
+                    self._current = {}
+            finally:
+                self._poll_lock.release()
+        return self._current.get(source, None)
+
+    def _remove(self, key: Tuple) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry[0])
+
+    def get(self, key: Tuple, source: Optional[str]) -> Optional[str]:
+        current = self.watermark(source)
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                result, expiry, source, watermark, end = entry
+                # new events only matter when they can be inside the period
+                moved = current is not None and (watermark is None or (current > watermark and end > watermark))
+                if time.monotonic() < expiry and not moved:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return result
+                self._remove(key)
+            self._misses += 1
+            return None
+
+    def put(self, key: Tuple, result: str, period: str, source: str, end: datetime.datetime,
+            watermark: Optional[datetime.datetime]) -> None:
+        # watermark is the one from before the query ran, events written meanwhile make the result outdated
+        if len(result) > self._max_bytes:
+            return
+        if end.tzinfo is not None:
+            end = end.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, time.monotonic() + self.PERIOD_TTL.get(period, self.DEFAULT_TTL), source,
+                                  watermark, end)
+            self._bytes += len(result)
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self._hits, 'misses': self._misses}
@@ -2,12 +2,11 @@ import datetime
 import os.path
 import re
 import sys
-import pymongo
 import pytz
 import tzlocal
 
 from typing import List, Dict, Any, Optional, Tuple, Union
-from functions import match_ip_address, get_mongo_connection, format_time, get_period_mask
+from functions import match_ip_address, aggregate, format_time, get_first_seen, get_period_mask
 from data_set import Data_set
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -23,12 +22,11 @@ def get_search_mask_ssh(search: str) -> Optional[Dict[str, Any]]:
 def get_ssh_user_time_data(search: str, mask: Dict[str, Any], raw: bool, time_mask: str,
                            intervals: List[Union[int, str, Tuple[int, int]]]) -> Data_set:
     local_tz: str = str(tzlocal.get_localzone())
-    col = get_mongo_connection()
     search_q = get_search_mask_ssh(search)
     orig_time_mask = time_mask.capitalize()
     if time_mask == 'day':
         time_mask = 'dayOfMonth'
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "auth_ssh"}, mask, search_q]}},
          {"$group": {"_id": {"username": "$username", "type": "$type",
                              "time": {"$" + time_mask: {"date": "$timestamp", "timezone": local_tz}},
@@ -62,7 +60,6 @@ def get_ssh_user_time_data(search: str, mask: Dict[str, Any], raw: bool, time_ma
 
 def get_ssh_user_data(search: str, mask: Dict[str, Any]) -> Data_set:
     local_tz: str = str(tzlocal.get_localzone())
-    col = get_mongo_connection()
     search_q = get_search_mask_ssh(search)
     q = [{"$match": {"$and": [{"name": "auth_ssh"}, mask, search_q]}},
          {"$group": {"_id": {"username": "$username", "type": "$type"}, "total": {"$sum": 1},
@@ -74,7 +71,7 @@ def get_ssh_user_data(search: str, mask: Dict[str, Any]) -> Data_set:
          ]
     data = Data_set('type', 'username', 'count')
     data.set_keys(['Username', 'Type', 'Count', 'IPs', "Hosts", "Timestamps"])
-    res = col.aggregate(q)
+    res = aggregate(q)
     for x in res:
         row = {
             'username': x['_id']['username'],
@@ -89,13 +86,15 @@ def get_ssh_user_data(search: str, mask: Dict[str, Any]) -> Data_set:
 
 
 def get_ssh_ip_data(search: str, mask: Dict[str, Any], name: str) -> Data_set:
-    col = get_mongo_connection()
     search_q = get_search_mask_ssh(search)
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "auth_ssh"}, mask, search_q]}},
          {"$group": {"_id": {"ip_address": "$ip_address", "type": "$type"}, "total": {"$sum": 1},
                      "users": {"$addToSet": "$username"},
-                     "hosts": {"$addToSet": "$host"}}},
+                     "hosts": {"$addToSet": "$host"},
+                     "prefix": {"$max": "$prefix"},
+                     "country_code": {"$max": "$country_code"},
+                     "country_name": {"$max": "$country_name"}}},
          {"$sort": {"total": -1}}
          ])
     name_to_field = { 'ip_prefixes': 'prefix', 'ip_countries': 'country', 'ip_addresses': 'ip_address'}
@@ -108,7 +107,10 @@ def get_ssh_ip_data(search: str, mask: Dict[str, Any], name: str) -> Data_set:
             'count': x['total'],
             'type': x['_id']['type'],
             'users': ", ".join(sorted(x['users'])),
-            'hosts': ", ".join(sorted(x['hosts']))
+            'hosts': ", ".join(sorted(x['hosts'])),
+            '_prefix': x['prefix'],
+            '_country_code': x['country_code'],
+            '_country_name': x['country_name']
         }
         data.add_data_row(row)
     if name == 'ip_prefixes':
@@ -125,13 +127,12 @@ def get_ssh_ip_data(search: str, mask: Dict[str, Any], name: str) -> Data_set:
 def get_ssh_time_ips_data(search: str, mask: Dict[str, Any], raw: bool, time_mask: str,
                           intervals: List[Union[int, str, Tuple[int, int]]]) -> Data_set:
     local_tz: str = str(tzlocal.get_localzone())
-    col = get_mongo_connection()
     search_q = get_search_mask_ssh(search)
     orig_time_mask = time_mask.capitalize()
     if time_mask == 'day':
         time_mask = 'dayOfMonth'
 
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "auth_ssh"}, mask, search_q]}},
          {"$group": {"_id": {"ip_address": "$ip_address", "type": "$type",
                              "time": {"$" + time_mask: {"date": "$timestamp", "timezone": local_tz}},
@@ -164,20 +165,8 @@ def get_ssh_time_ips_data(search: str, mask: Dict[str, Any], raw: bool, time_mas
 
 
 def get_ssh_new_ips_data(search: str, mask: Dict[str, Any], start_time: datetime.datetime) -> Data_set:
-    col: pymongo.collection.Collection = get_mongo_connection()
     search_q = get_search_mask_ssh(search)
-    ips: Dict[str, Tuple[int, datetime.datetime]] = {}
-    res = col.aggregate(
-        [{"$match": {"$and": [{"name": "auth_ssh"}, {"type": "connect"}]}},
-         {"$group": {"_id": {"ip_address": "$ip_address"}, "total": {"$sum": 1},
-                     "oldest": {"$min": "$timestamp"}}},
-         {"$sort": {"total": -1}}
-         ])
-    for x in res:
-        ip: str = x['_id']['ip_address']
-        if ip not in ips:
-            ips[ip] = (x['total'], pytz.UTC.localize(x['oldest']))
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "auth_ssh"}, {"type": "connect"}, mask, search_q]}},
          {"$group": {
              "_id": {"ip_address": "$ip_address"},
@@ -186,8 +175,11 @@ def get_ssh_new_ips_data(search: str, mask: Dict[str, Any], start_time: datetime
              'hosts': {"$addToSet": "$host"}}},
          {"$sort": {"total": -1}}
          ])
+    rows = list(res)
+    ips = {k[0]: v for k, v in get_first_seen('auth_ssh', ('ip_address',),
+                                               [(x['_id'].get('ip_address', None),) for x in rows]).items()}
     new_ips: Dict[str, Tuple[int, str, str]] = {}
-    for x in res:
+    for x in rows:
         ip1: str = x['_id']['ip_address']
         ts: int = x['total']
         ty: str = ", ".join(x['types'])
@@ -210,24 +202,8 @@ def get_ssh_new_ips_data(search: str, mask: Dict[str, Any], start_time: datetime
 
 
 def get_ssh_new_user_data(search: str, mask: Dict[str, Any], start_time: datetime.datetime) -> Data_set:
-    col = get_mongo_connection()
     search_q = get_search_mask_ssh(search)
-    users: Dict[str, Dict[str, Tuple[int, datetime.datetime]]] = {}
-    res = col.aggregate(
-        [{"$match": {"$and": [{"name": "auth_ssh"}, {"type": "connect"}]}},
-         {"$group": {"_id": {"username": "$username", "ip_address": "$ip_address"}, "total": {"$sum": 1},
-                     "oldest": {"$min": "$timestamp"}}},
-         {"$sort": {"total": -1}}
-         ])
-    for x in res:
-        username: str = x['_id']['username']
-        ip: str = x['_id']['ip_address']
-        total: int = x['total']
-        oldest = pytz.UTC.localize(x['oldest'])
-        if username not in users:
-            users[username] = {}
-        users[username][ip] = (total, oldest)
-    res = col.aggregate(
+    res = aggregate(
         [{"$match": {"$and": [{"name": "auth_ssh"}, {"type": "connect"}, mask, search_q]}},
          {"$group": {
              "_id": {"username": "$username", "ip_address": "$ip_address"},
@@ -236,8 +212,14 @@ def get_ssh_new_user_data(search: str, mask: Dict[str, Any], start_time: datetim
              'types': {"$addToSet": "$type"}}},
          {"$sort": {"total": -1}}
          ])
+    rows = list(res)
+    users: Dict[str, Dict[str, Tuple[int, datetime.datetime]]] = {}
+    for (username, ip), seen in get_first_seen('auth_ssh', ('username', 'ip_address'),
+                                               [(x['_id'].get('username', None), x['_id'].get('ip_address', None))
+                                                for x in rows]).items():
+        users.setdefault(username, {})[ip] = seen
     new_users: Dict[str, Dict[str, Tuple[int, str, str]]] = {}
-    for x in res:
+    for x in rows:
         u1: str = x['_id']['username']
         ip1: str = x['_id']['ip_address']
         ts: int = x['total']
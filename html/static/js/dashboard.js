@@ -76,118 +76,159 @@ function load_graph(canvas_id, type, name, period, to,from, title, host)
         cache: false,
         contentType: "application/json;charset=UTF-8",
     }).done(function(data) {
-        var res = JSON.parse(data);
-        var baroptions= {
-            graphTitle: title,
-            graphTitleFontSize: 16,
-            canvasBorders: true,
-            canvasBordersWidth: 1,
-            animation : false,
-            responsive: true,
-            legend: false,
-            highLight: true,
-            fmtXLabel: "text",
-            fmtYLabel: "number",
-            fmtV3: "number",
+        draw_graph(canvas_id, title, JSON.parse(data));
+    });
+    return false;
+}
+
+function draw_graph(canvas_id, title, res)
+{
+    if (!res.success) {
+        return;
+    }
+    var baroptions= {
+        graphTitle: title,
+        graphTitleFontSize: 16,
+        canvasBorders: true,
+        canvasBordersWidth: 1,
+        animation : false,
+        responsive: true,
+        legend: false,
+        highLight: true,
+        fmtXLabel: "text",
+        fmtYLabel: "number",
+        fmtV3: "number",
 
-            rotateLabels: "smart",
-            annotateLabel: "<%=v2+': '+v1+' '+v3%>",
-            annotateDisplay: true,
-            yAxisUnitFontSize: 16,
-            inGraphDataShow : true,
-            spaceBetweenBar : 4,
-            scaleFontColor: "#ddd",
-            graphTitleFontColor: "#bbb",
-            inGraphDataFontColor:"#ccc",
-            forceScale:"steps",
-            scaleSteps : 10,
-        };
-        var pieoptions = baroptions;
-        var stacked_baroptions= {
-            graphTitle: title,
-            graphTitleFontSize: 16,
-            canvasBorders: true,
-            canvasBordersWidth: 1,
-            barDatasetSpacing: 0,
-            barValueSpacing:0,
-            rotateLabels: "smart",
-            spaceBetweenBar : 4,
-            animation : false,
-            responsive: true,
-            legend: false,
-            highLight: true,
-            xScaleLabelsMinimumWidth: 10,
-            fmtXLabel: "text",
-            fmtYLabel: "number",
-            fmtV3: "number",
-            annotateLabel: "<%=v2+': '+v1+' '+v3%>",
-            annotateDisplay: true,
-            inGraphDataShow : true,
-            inGraphDataFontColor: "#ccc",
-            yAxisMinimumInterval:1,
-            forceGraphMin : 0,
-            graphMin:0,
-            forceScale:"steps",
-            scaleSteps : 10,
-            scaleStepWidth : 1,
-            yAxisUnitFontSize: 16,
-            scaleFontColor: "#ddd",
-            graphTitleFontColor: "#bbb",
-        };
+        rotateLabels: "smart",
+        annotateLabel: "<%=v2+': '+v1+' '+v3%>",
+        annotateDisplay: true,
+        yAxisUnitFontSize: 16,
+        inGraphDataShow : true,
+        spaceBetweenBar : 4,
+        scaleFontColor: "#ddd",
+        graphTitleFontColor: "#bbb",
+        inGraphDataFontColor:"#ccc",
+        forceScale:"steps",
+        scaleSteps : 10,
+    };
+    var pieoptions = baroptions;
+    var stacked_baroptions= {
+        graphTitle: title,
+        graphTitleFontSize: 16,
+        canvasBorders: true,
+        canvasBordersWidth: 1,
+        barDatasetSpacing: 0,
+        barValueSpacing:0,
+        rotateLabels: "smart",
+        spaceBetweenBar : 4,
+        animation : false,
+        responsive: true,
+        legend: false,
+        highLight: true,
+        xScaleLabelsMinimumWidth: 10,
+        fmtXLabel: "text",
+        fmtYLabel: "number",
+        fmtV3: "number",
+        annotateLabel: "<%=v2+': '+v1+' '+v3%>",
+        annotateDisplay: true,
+        inGraphDataShow : true,
+        inGraphDataFontColor: "#ccc",
+        yAxisMinimumInterval:1,
+        forceGraphMin : 0,
+        graphMin:0,
+        forceScale:"steps",
+        scaleSteps : 10,
+        scaleStepWidth : 1,
+        yAxisUnitFontSize: 16,
+        scaleFontColor: "#ddd",
+        graphTitleFontColor: "#bbb",
+    };
 //        console.log(res)
-        if (res.labels.length == 0 || res.data.length == 0 || res.fields.length == 0) {
-        // for an empty graph
-            var data_sets = {
-                labels : [''],
-                datasets: [{ data: [0]}]
-            }
-            new Chart(document.getElementById(canvas_id).getContext("2d")).Pie(data_sets, pieoptions);
+    if (res.labels.length == 0 || res.data.length == 0 || res.fields.length == 0) {
+    // for an empty graph
+        var data_sets = {
+            labels : [''],
+            datasets: [{ data: [0]}]
+        }
+        new Chart(document.getElementById(canvas_id).getContext("2d")).Pie(data_sets, pieoptions);
+    } else {
+        var data_sets = [];
+        for (var i = 0; i < res.data.length; i++) {
+            data_sets.push( {
+                fillColor: colours[i % colours.length],
+                strokeColor: colours[i % colours.length],
+                data: res.data[i],
+                title: res.labels[i]
+            });
+        }
+        var data = {
+            labels: res.fields,
+            datasets: data_sets
+        }
+        if (res.data.length == 1) {
+             baroptions.annotateLabel = "<%=v2+': '+v3%>"
+             if (data.datasets[0].data.length > 10) {
+                 baroptions['inGraphDataShow'] = false;
+             }
+             new Chart(document.getElementById(canvas_id).getContext("2d")).Bar(data, baroptions);
         } else {
-            var data_sets = [];
-            for (var i = 0; i < res.data.length; i++) {
-                data_sets.push( {
-                    fillColor: colours[i % colours.length],
-                    strokeColor: colours[i % colours.length],
-                    data: res.data[i],
-                    title: res.labels[i]
-                });
-            }
-            var data = {
-                labels: res.fields,
-                datasets: data_sets
-            }
-            if (res.data.length == 1) {
-                 baroptions.annotateLabel = "<%=v2+': '+v3%>"
-                 if (data.datasets[0].data.length > 10) {
-                     baroptions['inGraphDataShow'] = false;
-                 }
-                 new Chart(document.getElementById(canvas_id).getContext("2d")).Bar(data, baroptions);
-            } else {
-                 if (data.datasets.length > 10) {
-                     stacked_baroptions['inGraphDataShow'] = false;
-                 }
-                 new Chart(document.getElementById(canvas_id).getContext("2d")).StackedBar(data, stacked_baroptions);
-            }
+             if (data.datasets.length > 10) {
+                 stacked_baroptions['inGraphDataShow'] = false;
+             }
+             new Chart(document.getElementById(canvas_id).getContext("2d")).StackedBar(data, stacked_baroptions);
         }
-    });
-    return false;
+    }
 }
 
 function load_all_graphs()
 {
     var host = $("#host_selector").find(":selected").val()
     let {period, from, to} = get_period()
+    var panels = [];
+    var canvases = [];
     $("canvas").each(function() {
         var checkbox_index = $(this).attr('data-type') + "_" + $(this).attr('data-name');
         var checkbox_val= $("#checkbox_" + checkbox_index)[0].checked;
         var canvas_id = $(this).attr('id');
         if (checkbox_val) {
-            load_graph(canvas_id, $(this).attr("data-type"), $(this).attr("data-name"), period, to, from,
-                       $(this).attr("data-title"), host);
+            panels.push({'type': $(this).attr("data-type"), 'period': period, 'name': $(this).attr("data-name"),
+                         'raw': true, 'to': to, 'from': from, 'host': host});
+            canvases.push([canvas_id, $(this).attr("data-title")]);
         } else {
             $("#"+canvas_id).parent("div").hide();
         }
     });
+    if (panels.length == 0) {
+        return;
+    }
+    // one request for all panels, every line of the response is a panel that is ready
+    fetch(script_root + '/data_batch/', {
+        method: 'POST',
+        cache: 'no-store',
+        headers: {'Content-Type': 'application/json;charset=UTF-8'},
+        body: JSON.stringify({'panels': panels})
+    }).then(function(response) {
+        var reader = response.body.getReader();
+        var decoder = new TextDecoder();
+        var buffer = '';
+        function read() {
+            return reader.read().then(function(chunk) {
+                buffer += decoder.decode(chunk.value || new Uint8Array(), {stream: !chunk.done});
+                var lines = buffer.split("\n");
+                buffer = lines.pop();
+                for (var i = 0; i < lines.length; i++) {
+                    if (lines[i] != '') {
+                        var panel = JSON.parse(lines[i]);
+                        draw_graph(canvases[panel.index][0], canvases[panel.index][1], panel.result);
+                    }
+                }
+                if (!chunk.done) {
+                    return read();
+                }
+            });
+        }
+        return read();
+    });
 }
 
 
@@ -0,0 +1,210 @@
+import bz2
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+from typing import IO, Any, Dict, List, MutableMapping, Optional, Tuple
+
+from pymongo.errors import PyMongoError
+
+from catchup import START_METHOD
+from config import Config
+from enrichment import Enricher
+from multi_matcher import MultiMatcher
+from output import Outputs
+from parsers import RegexParser
+
+# Imported files
+# {
+#     '<sha1 of the uncompressed content>': {
+#         'path': '/var/log/auth.log.2.gz',
+#         'name': 'auth_ssh',
+#         'lines': 12345,
+#         'matched': 678,
+#         'time': 1621087741.3265584
+#     }
+# }
+
+# a file that fails is logged and left out, the others are still imported
+_IMPORT_ERRORS = (OSError, EOFError, ValueError, PyMongoError)
+
+
+class ImportedFiles:
+    def __init__(self, filename: str) -> None:
+        self._filename: str = filename
+        self._imported: Dict[str, Dict[str, Any]] = {}
+
+    def load(self) -> None:
+        try:
+            with open(self._filename, "r") as infile:
+                self._imported = json.load(infile)
+        except (FileNotFoundError, OSError, ValueError):
+            logging.debug("No imported files found in: {}".format(self._filename))
+            self._imported = {}
+
+    def save(self) -> None:
+        try:
+            with open(self._filename, 'w') as outfile:
+                json.dump(self._imported, outfile)
+        except OSError as exc:
+            logging.warning("Cannot write file {}: {}".format(self._filename, str(exc)))
+
+    def __contains__(self, fingerprint: str) -> bool:
+        return fingerprint in self._imported
+
+    def fingerprints(self) -> List[str]:
+        return list(self._imported)
+
+    def add(self, fingerprint: str, info: Dict[str, Any]) -> None:
+        self._imported[fingerprint] = info
+
+
+def open_log(path: str):
+    with open(path, 'rb') as f:
+        magic = f.read(3)
+    if magic[:2] == b'\x1f\x8b':
+        return gzip.open(path, 'rb')
+    elif magic == b'BZh':
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _read_fingerprinted(path: str, chunk_size: int) -> Tuple[str, IO[bytes]]:
+    # the fingerprint is taken from the uncompressed content, so a rotated file is recognised again after it got
+    # compressed; all of it, a file that grew or changed after its start is a different one. A compressed file is
+    # kept uncompressed in a temporary file while hashing, so it is only decompressed once
+    digest = hashlib.sha1()
+    copy: Optional[IO[bytes]] = None
+    try:
+        with open_log(path) as f:
+            if isinstance(f, (gzip.GzipFile, bz2.BZ2File)):
+                copy = tempfile.TemporaryFile()
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                if copy is not None:
+                    copy.write(chunk)
+        if copy is None:
+            return digest.hexdigest(), open(path, 'rb')
+        copy.seek(0)
+        return digest.hexdigest(), copy
+    except BaseException:
+        if copy is not None:
+            copy.close()
+        raise
+
+
+def _import_file(job: Tuple[str, str, List[Tuple], Dict[str, Any]], claims: MutableMapping[str, str]) \
+        -> Tuple[Optional[str], int, int]:
+    path, name, specs, output_config = job
+    fingerprint, content = _read_fingerprinted(path, Importer.FINGERPRINT_CHUNK_SIZE)
+    with content:
+        # claimed before anything is written, by the first of the files with the same content; imported files are
+        # claimed from the start. None when another one has it
+        if claims.setdefault(fingerprint, path) != path:
+            return None, 0, 0
+        matcher = MultiMatcher([RegexParser(regex, emit, transform, notify, None, None, name, enrich)
+                                for regex, emit, transform, notify, enrich in specs])
+        output_conn = Outputs().connect(output_config)
+        lines: int = 0
+        matched: int = 0
+        for raw in content:
+            lines += 1
+            if not matcher.prefilter_bytes(raw, 0, len(raw)):
+                continue
+            line = raw.decode('utf-8', 'replace')
+            if line.endswith('\r\n'):
+                line = line[:-2] + '\n'
+            for p, m in matcher.match(line):
+                output_conn.write(p.filter_output(p.emit(m, name)))
+                matched += 1
+    output_conn.flush()
+    # the output keeps what it could not write, the file must not be recorded as imported then
+    if not output_conn.empty():
+        raise ValueError("{} documents could not be written".format(output_conn.size()))
+    return fingerprint, lines, matched
+
+
+class Importer:
+    BATCH_SIZE: int = 5000
+    FINGERPRINT_CHUNK_SIZE: int = 1024 * 1024
+    _rotation_suffix = re.compile(r'(?:[.-]\d+)*(?:\.(?:gz|bz2))?$')
+
+    def __init__(self, config: Config, outputs: Outputs, imported_file: str, workers: int = 1) -> None:
+        self._config: Config = config
+        self._outputs: Outputs = outputs
+        self._imported: ImportedFiles = ImportedFiles(imported_file)
+        self._workers: int = workers
+
+    def _find_source(self, path: str) -> Optional[str]:
+        base_name: str = self._rotation_suffix.sub('', os.path.basename(path))
+        candidates = [x for x in self._config.get_files() if os.path.basename(x) == base_name]
+        for x in candidates:
+            if os.path.dirname(x) == os.path.dirname(os.path.abspath(path)):
+                return x
+        return candidates[0] if candidates else None
+
+    def _make_job(self, path: str, source: Optional[str]) -> Optional[Tuple[str, str, List[Tuple], Dict[str, Any]]]:
+        if source is None:
+            source = self._find_source(path)
+        if source is None or self._config.get_filter(source) is None:
+            logging.warning("No configuration found for {}".format(path))
+            return None
+        output_config = self._outputs.get_output(self._config.get_output(source))
+        if output_config is None:
+            logging.warning("No output found for {}".format(path))
+            return None
+        output_config = dict(output_config, buffer_size=max(self.BATCH_SIZE, output_config.get('buffer_size', 1)))
+        # the spool belongs to the collector, workers sharing its directory would write and remove the same segments;
+        # an import that cannot be written fails and is tried again the next time instead
+        output_config.pop('spool_directory', None)
+        name: str = self._config.get_name(source)
+        # nothing is notified about old log lines
+        enricher = Enricher.from_config(self._config.get_enrich(source))
+        enrich = enricher.lookups if enricher is not None else None
+        specs = [(x['regex'], x['emit'], x['transform'], [], enrich) for x in self._config.get_filter(source)]
+        return path, name, specs, output_config
+
+    def import_files(self, files: List[str], source: Optional[str] = None) -> None:
+        self._imported.load()
+        jobs = []
+        for path in dict.fromkeys(os.path.abspath(x) for x in files):
+            job = self._make_job(path, source)
+            if job is not None:
+                jobs.append(job)
+
+        def done(path: str, name: str, fingerprint: Optional[str], lines: int, matched: int) -> None:
+            if fingerprint is None:
+                logging.info("Skipping {}, already imported".format(path))
+                return
+            logging.info("Imported {} as {}: {} lines, {} matched".format(path, name, lines, matched))
+            self._imported.add(fingerprint, {'path': path, 'name': name, 'lines': lines, 'matched': matched,
+                                             'time': time.time()})
+            self._imported.save()
+
+        if self._workers <= 1 or len(jobs) <= 1:
+            claims: Dict[str, str] = {x: '' for x in self._imported.fingerprints()}
+            for job in jobs:
+                try:
+                    done(job[0], job[1], *_import_file(job, claims))
+                except _IMPORT_ERRORS as e:
+                    logging.warning("Cannot import {}: {}".format(job[0], e))
+            return
+        # one file per process, so decompressing, hashing and parsing run in parallel; the workers claim the
+        # fingerprints in one shared dict
+        context = multiprocessing.get_context(START_METHOD)
+        with context.Manager() as manager, context.Pool(min(self._workers, len(jobs))) as pool:
+            shared_claims = manager.dict({x: '' for x in self._imported.fingerprints()})
+            results = [(job, pool.apply_async(_import_file, (job, shared_claims))) for job in jobs]
+            for job, result in results:
+                try:
+                    done(job[0], job[1], *result.get())
+                except _IMPORT_ERRORS as e:
+                    logging.warning("Cannot import {}: {}".format(job[0], e))
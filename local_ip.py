@@ -3,21 +3,28 @@ import json
 import logging
 import typing
 
+from prefix_set import PrefixSet
+
+# what ipaddress counts as private, checked along with the configured ranges
+PRIVATE_NETWORKS: typing.List[str] = [
+    '0.0.0.0/8', '10.0.0.0/8', '127.0.0.0/8', '169.254.0.0/16', '172.16.0.0/12', '192.0.0.0/29', '192.0.0.170/31',
+    '192.0.2.0/24', '192.168.0.0/16', '198.18.0.0/15', '198.51.100.0/24', '203.0.113.0/24', '240.0.0.0/4',
+    '255.255.255.255/32', '::1/128', '::/128', '::ffff:0:0/96', '100::/64', '2001::/23', '2001:2::/48',
+    '2001:db8::/32', '2001:10::/28', 'fc00::/7', 'fe80::/10'
+]
+
 
 class Local_Addresses:
     def __init__(self) -> None:
         self._ranges: typing.List[typing.Union[ipaddress.IPv4Network, ipaddress.IPv6Network]] = []
+        self._prefixes: PrefixSet = PrefixSet(PRIVATE_NETWORKS)
 
     def load_ranges(self, ranges: typing.List[typing.Union[ipaddress.IPv4Network, ipaddress.IPv6Network]]) -> None:
         self._ranges = ranges
+        self._prefixes = PrefixSet(PRIVATE_NETWORKS + ranges)
 
     def is_local(self, address: str) -> bool:
-        if ipaddress.ip_address(address).is_private:
-            return True
-        for i in self._ranges:
-            if ipaddress.ip_address(address) in i:
-                return True
-        return False
+        return address in self._prefixes
 
     def load_local_addresses(self, filename: str) -> None:
         try:
@@ -27,7 +34,7 @@ class Local_Addresses:
             self.load_ranges(ranges)
         except json.decoder.JSONDecodeError:
             logging.warning("Incorrect JSON file format: {}".format(filename))
-            self._ranges = []
+            self.load_ranges([])
         except (FileNotFoundError, PermissionError):
             logging.warning("Cannot find open file: {}".format(filename))
 
@@ -3,6 +3,7 @@ import os
 import threading
 import time
 import logging
+from typing import Optional
 
 from watchdog.observers import Observer
 from log_analyser_version import get_version
@@ -22,15 +23,16 @@ class LogObserver:
         self._cleanup_interval: int = cleanup_interval
         self._state_dump_timeout: int = state_dump_timeout
         self._notify_cleanup_handler = notify_cleanup_handler
+        self._last_state: Optional[str] = None
 
     def add(self, filepath: str, file_pos: int, parsers, file_inode: int, device: int, output_conn, name,
-            retention: int) -> None:
+            retention: int, workers: int = 1) -> None:
         directory: str = os.path.dirname(filepath)
         if directory not in self._event_handlers:
             self._event_handlers[directory] = LogHandler()
 
         self._event_handlers[directory].add_file(filepath, file_pos, parsers, file_inode, device, output_conn, name,
-                                                 retention)
+                                                 retention, workers)
 
     def start(self) -> None:
         logging.info('Starting log collector log_analyser_version.py {}'.format(get_version()))
@@ -39,8 +41,8 @@ class LogObserver:
         self._observer.start()
         self._start_cleanup_threat()
         while True:
-            self.dump_state()
             self.flush_output()
+            self.dump_state()
             time.sleep(self._state_dump_timeout)
 
     def stop(self) -> None:
@@ -58,10 +60,19 @@ class LogObserver:
         current_state = []
         for eh in self._event_handlers.values():
             current_state += eh.dump_state()
+        state: str = json.dumps(current_state)
+        if state == self._last_state:
+            return
+        logging.debug(state)
+        # a crash while writing must leave the previous state intact
+        tmp_file: str = self._state_file + '.tmp'
         try:
-            logging.debug(json.dumps(current_state))
-            with open(self._state_file, 'w') as outfile:
-                json.dump(current_state, outfile)
+            with open(tmp_file, 'w') as outfile:
+                outfile.write(state)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(tmp_file, self._state_file)
+            self._last_state = state
         except OSError as exc:
             logging.warning("Cannot write file {}: {}".format(self._state_file, str(exc)))
 
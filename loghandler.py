@@ -26,13 +26,14 @@ class LogHandler(FileSystemEventHandler):
 
     def add_file(self, filename: str, pos: int = 0, parsers=None, inode: Optional[int] = None,
                  dev: Optional[int] = None, output_conn=None, name: Optional[str] = None,
-                 retention: Optional[int] = None) -> None:
-        self._file_list[filename] = FileHandler(filename, pos, parsers, inode, dev, output_conn, name, retention)
+                 retention: Optional[int] = None, workers: int = 1) -> None:
+        self._file_list[filename] = FileHandler(filename, pos, parsers, inode, dev, output_conn, name, retention,
+                                                workers)
 
     def match(self, event: FileModifiedEvent) -> FileHandler:
         try:
             for filename in self._file_list:
-                if not event.is_directory and filename == event.src_path:
+                if self._file_list[filename].handles(event):
                     return self._file_list[filename]
         except AttributeError as e:
             logging.debug(str(e))
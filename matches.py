@@ -1,21 +1,27 @@
 import functools
 import logging
-import ipaddress
+from collections import OrderedDict
 from typing import Any, Tuple, Dict
 from outputters.output_abstract import AbstractOutput
 
+FALSE_CACHE_SIZE: int = 100000
+
 
 def false_only_cache(fn):
-    cache: Dict[int, bool] = {}
+    # the arguments themselves are the key, a bare hash could mix up two values
+    cache: OrderedDict = OrderedDict()
 
     @functools.wraps(fn)
     def wrapper(*args: Tuple[Any, ...], **kwargs: Dict[str, Any]) -> bool:
-        key = hash(args + tuple(sorted(kwargs.items())))
+        key = args + tuple(sorted(kwargs.items()))
         if key in cache:
+            cache.move_to_end(key)
             return cache[key]
         result: bool = fn(*args, **kwargs)
         if not result:
             cache[key] = result
+            if len(cache) > FALSE_CACHE_SIZE:
+                cache.popitem(last=False)
         return result
 
     return wrapper
@@ -26,46 +32,26 @@ def _is_new(col: AbstractOutput, value: str, field: str, name: str) -> bool:
     return res
 
 
-def apache_is_new(col: AbstractOutput, field: str, value: str) -> bool:
-    if field in ['ip_address', 'username']:
-        return _is_new(col, value, field, 'apache_access')
-    else:
-        logging.info('Unknown field {}:'.format(field))
-        return False
+# the fields the new condition can be used on, per source
+new_fields: Dict[str, Tuple[str, ...]] = {
+    'auth_ssh': ('ip_address', 'username'),
+    'apache_access': ('ip_address', 'username'),
+    'nntp_proxy': ('ip_address', 'dest_address'),
+}
 
 
-def ssh_is_new(col: AbstractOutput, field: str, value: str) -> bool:
-    if field in ['ip_address', 'username']:
-        return _is_new(col, value, field, 'auth_ssh')
-    else:
-        logging.info('Unknown field {}:'.format(field))
+def is_new_field(source: str, field: str) -> bool:
+    if source not in new_fields:
+        logging.info('Unknown source {}:'.format(source))
         return False
-
-
-def nntp_is_new(col: AbstractOutput, field: str, value: str) -> bool:
-    if field in ['ip_address', 'dest_address']:
-        return _is_new(col, value, field, 'nntp_proxy')
-    else:
+    if field not in new_fields[source]:
         logging.info('Unknown field {}:'.format(field))
         return False
+    return True
 
 
 @false_only_cache
 def is_new(col: AbstractOutput, source: str, field: str, value: str) -> bool:
-    if source == "auth_ssh":
-        return ssh_is_new(col, field, value)
-    elif source == 'apache_access':
-        return apache_is_new(col, field, value)
-    elif source == 'nntp_proxy':
-        return nntp_is_new(col, field, value)
-    else:
-        logging.info('Unknown source {}:'.format(source))
-        return False
-
-
-def address_in_prefix(address,prefix):
-    try:
-        return ipaddress.ip_address(address) in ipaddress.ip_network(prefix)
-    except Exception:
+    if not is_new_field(source, field):
         return False
-
+    return _is_new(col, value, field, source)
@@ -0,0 +1,175 @@
+import logging
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from parsers import RegexParser
+from regex_tokens import tokenize
+
+
+class MultiMatcher:
+    def __init__(self, parsers: List[RegexParser]) -> None:
+        self._parsers: List[RegexParser] = parsers
+        self._combined: Optional[re.Pattern] = None
+        self._group_map: Dict[int, Tuple[int, List[int]]] = {}
+        if len(self._parsers) > 1:
+            try:
+                self._build()
+            except (ValueError, re.error) as e:
+                logging.debug("Not combining patterns: {}".format(e))
+                self._combined = None
+                self._group_map = {}
+
+    def __iter__(self):
+        return iter(self._parsers)
+
+    def __len__(self) -> int:
+        return len(self._parsers)
+
+    @property
+    def parsers(self) -> List[RegexParser]:
+        return self._parsers
+
+    def _build(self) -> None:
+        items: List[Tuple[int, List[str], List[int]]] = []
+        for idx, parser in enumerate(self._parsers):
+            tokens = tokenize(parser.pattern)
+            counts = [re.compile(t).groups for t in tokens]
+            if sum(counts) != parser.compiled_pattern.groups:
+                raise ValueError('could not split {}'.format(parser.pattern))
+            items.append((idx, tokens, counts))
+        self._next_group: int = 1
+        group_map: Dict[int, Tuple[int, List[int]]] = {}
+        pattern: str = self._build_node([(idx, tokens, counts, []) for idx, tokens, counts in items], group_map)
+        self._combined = re.compile(pattern)
+        self._group_map = group_map
+
+    def _build_node(self, items: List[Tuple[int, List[str], List[int], List[int]]],
+                    group_map: Dict[int, Tuple[int, List[int]]]) -> str:
+        # emits the longest common token prefix of the items, then branches on the next token
+        out: str = ''
+        depth: int = 0
+        while all(len(tokens) > depth for _, tokens, _, _ in items) and \
+                all(tokens[depth] == items[0][1][depth] for _, tokens, _, _ in items):
+            out += items[0][1][depth]
+            new_groups: List[int] = list(range(self._next_group, self._next_group + items[0][2][depth]))
+            self._next_group += len(new_groups)
+            for _, _, _, groups in items:
+                groups.extend(new_groups)
+            depth += 1
+        if all(len(tokens) == depth for _, tokens, _, _ in items):
+            # leaf: an empty marker group tells which parser matched, identical patterns only need one
+            group_map[self._next_group] = (items[0][0], items[0][3])
+            self._next_group += 1
+            return out + '()'
+
+        branches: Dict[Optional[str], List[Tuple[int, List[str], List[int], List[int]]]] = {}
+        for idx, tokens, counts, groups in items:
+            key = tokens[depth] if len(tokens) > depth else None
+            branches.setdefault(key, []).append((idx, tokens[depth:], counts[depth:], list(groups)))
+        alternatives: List[str] = [self._build_node(branch, group_map) for branch in branches.values()]
+        return out + '(?:' + '|'.join(alternatives) + ')'
+
+    def prefilter_bytes(self, data: bytearray, start: int, end: int) -> bool:
+        for p in self._parsers:
+            if p.prefilter_bytes(data, start, end):
+                return True
+        return False
+
+    def match(self, line: str) -> List[Tuple[RegexParser, List[str]]]:
+        candidates = [p for p in self._parsers if p.prefilter(line)]
+        if not candidates:
+            return []
+        if self._combined is None or len(candidates) == 1:
+            res = []
+            for p in candidates:
+                m = p.match(line)
+                if m:
+                    res.append((p, m))
+            return res
+
+        hit = self._combined.search(line)
+        if hit is None:
+            return []
+        # the combined scan found the leftmost match, so no parser can match before this position; the
+        # parser that matched has its groups right here, all others are searched from this position on
+        idx, groups = self._group_map[hit.lastindex]
+        pos: int = hit.start()
+        res = []
+        for i, p in enumerate(self._parsers):
+            if i == idx:
+                m = [hit.group(g) for g in groups]
+            elif p in candidates:
+                m = p.match(line, pos)
+            else:
+                continue
+            if m:
+                res.append((p, m))
+        return res
+
+
+if __name__ == "__main__":
+    ts = "Dec  1 23:17:58"
+    benchmark_filters = [
+        "(%SYSLOG_TIMESTAMP:timestamp) (%NAME:host).*: Accepted (%STR:access) for (%NAME:username) from (%IP:addr) "
+        "port (%NUM:port) (%WORD:protocol)",
+        "(%SYSLOG_TIMESTAMP:timestamp) (%NAME:host).*: Failed (%STR:access) for (?:invalid user )?(%NAME:username) "
+        "from (%IP:addr) port (%NUM:port) (%NAME:protocol)",
+        "(%SYSLOG_TIMESTAMP:timestamp) (%NAME:host).*: Disconnected from user (%NAME:username) (%IP:addr) port "
+        "(%NUM:port)",
+        "(%SYSLOG_TIMESTAMP:timestamp) (%NAME:host).*: Invalid user (%NAME:username) from (%IP:addr) port (%NUM:port)",
+        "(%SYSLOG_TIMESTAMP:timestamp) (%NAME:host).*: Connection closed by (%IP:addr) port (%NUM:port)",
+        "(%SYSLOG_TIMESTAMP:timestamp) (%NAME:host).*: Received disconnect from (%IP:addr) port (%NUM:port)",
+        "(%SYSLOG_TIMESTAMP:timestamp) (%NAME:host).*: session opened for user (%NAME:username) by",
+        "(%SYSLOG_TIMESTAMP:timestamp) (%NAME:host).*: session closed for user (%NAME:username)",
+        "(%SYSLOG_TIMESTAMP:timestamp) (%NAME:host) sudo: +(%NAME:username) : TTY=(%STR:tty) ; PWD=(%STR:pwd)",
+        "(%SYSLOG_TIMESTAMP:timestamp) (%NAME:host).*: Did not receive identification string from (%IP:addr)",
+        "(%SYSLOG_TIMESTAMP:timestamp) (%NAME:host).*: Bad protocol version identification .* from (%IP:addr)",
+        "(%SYSLOG_TIMESTAMP:timestamp) (%NAME:host).*: maximum authentication attempts exceeded for (%NAME:username)",
+        "(%SYSLOG_TIMESTAMP:timestamp) (%NAME:host).*: PAM (%NUM:count) more authentication failures",
+    ]
+    benchmark_lines = [
+        ts + " host CRON[1234]: pam_unix(cron:session): session opened for user root by (uid=0)",
+        ts + " host systemd[1]: Started Session 42 of user bob.",
+        ts + " host kernel: [12345.678] IN=eth0 OUT= MAC=00:11:22 SRC=1.2.3.4 DST=5.6.7.8 LEN=40",
+        ts + " host systemd-logind[567]: New session 42 of user bob.",
+        ts + " host sshd[4321]: Accepted publickey for bob from 10.0.0.1 port 51234 ssh2",
+        ts + " host sshd[4321]: Failed password for invalid user admin from 1.2.3.4 port 4444 ssh2",
+        ts + " host dbus-daemon[890]: [system] Successfully activated service 'org.freedesktop.nm_dispatcher'",
+        ts + " host systemd[1]: Starting Daily apt download activities...",
+    ] * 5000
+    benchmark_parsers = [RegexParser(x, {}, {}, [], None, None, 'auth_ssh') for x in benchmark_filters]
+
+    def run_search() -> int:
+        # the loop before the matcher, every pattern searched on every line
+        count = 0
+        for line in benchmark_lines:
+            for parser in benchmark_parsers:
+                res = parser.compiled_pattern.search(line)
+                if res is not None:
+                    res.groups()
+                    count += 1
+        return count
+
+    def run_prefiltered() -> int:
+        count = 0
+        for line in benchmark_lines:
+            for parser in benchmark_parsers:
+                if parser.match(line):
+                    count += 1
+        return count
+
+    matcher = MultiMatcher(benchmark_parsers)
+
+    def run_matcher() -> int:
+        count = 0
+        for line in benchmark_lines:
+            count += len(matcher.match(line))
+        return count
+
+    for bench_name, bench_fn in [('search loop', run_search), ('prefiltered loop', run_prefiltered),
+                                ('multi matcher', run_matcher)]:
+        start_time = time.perf_counter()
+        matched = bench_fn()
+        elapsed = time.perf_counter() - start_time
+        print("{:16s}: {:10.0f} lines/s ({} matches)".format(bench_name, len(benchmark_lines) / elapsed, matched))
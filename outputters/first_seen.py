@@ -0,0 +1,191 @@
+import datetime
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne, database
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+# per source, the combinations of fields the 'new' panels look up, with the events they count
+FIRST_SEEN_VIEWS: Dict[str, List[Tuple[Tuple[str, ...], Dict[str, Any]]]] = {
+    'auth_ssh': [(('ip_address',), {'type': 'connect'}), (('username', 'ip_address'), {'type': 'connect'})],
+    'apache_access': [(('ip_address',), {})],
+    'nntp_proxy': [(('ip_address',), {})],
+}
+# each view is split at the _id its build claimed it with: the build counts the events before it, the outputs that
+# write the events (the collector and the importer alike) count the ones from there on. Events written before the
+# view is claimed are left to the build, so nothing is counted twice whichever runs first
+
+
+def first_seen_name(collection_name: str) -> str:
+    return "{}_first_seen".format(collection_name)
+
+
+def first_seen_id(source: str, fields: Tuple[str, ...], values: Tuple) -> Dict[str, Any]:
+    # the field order is part of the _id, so it is always built here
+    _id: Dict[str, Any] = {'name': source, 'fields': ",".join(fields)}
+    _id.update(zip(fields, values))
+    return _id
+
+
+def _meta_id(source: str, fields: Tuple[str, ...]) -> str:
+    return "built:{}:{}".format(source, ",".join(fields))
+
+
+def is_built(db: database.Database, collection_name: str, source: str, fields: Tuple[str, ...]) -> bool:
+    meta = db[first_seen_name(collection_name)].find_one({'_id': _meta_id(source, fields)})
+    return meta is not None and meta.get('state', None) == 'done'
+
+
+class FirstSeen:
+    # seconds without a heartbeat before a build is taken to be dead
+    BUILD_LEASE: int = 600
+    HEARTBEAT_INTERVAL: int = 60
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (source, fields, values) -> [(_id, timestamp)] of the committed events
+        self._pending: Dict[Tuple, List[Tuple[Optional[ObjectId], datetime.datetime]]] = {}
+        # (source, fields) -> the _id the build of the view was claimed with, once it is
+        self._bounds: Dict[Tuple[str, Tuple[str, ...]], ObjectId] = {}
+        self._indexed: bool = False
+
+    def add(self, doc: Dict[str, Any]) -> None:
+        source = doc.get('name', None)
+        ts = doc.get('timestamp', None)
+        if source not in FIRST_SEEN_VIEWS or not isinstance(ts, datetime.datetime):
+            return
+        with self._lock:
+            for fields, condition in FIRST_SEEN_VIEWS[source]:
+                if any(doc.get(k, None) != v for k, v in condition.items()):
+                    continue
+                values = tuple(doc.get(x, None) for x in fields)
+                if None in values:
+                    continue
+                self._pending.setdefault((source, fields, values), []).append((doc.get('_id', None), ts))
+
+    def _load_bounds(self, target) -> None:
+        # a claimed view keeps its bound, only the others are looked up again
+        missing = {_meta_id(source, fields): (source, fields) for source, views in FIRST_SEEN_VIEWS.items()
+                   for fields, _ in views if (source, fields) not in self._bounds}
+        if not missing:
+            return
+        for meta in target.find({'_id': {'$in': list(missing)}}):
+            if meta.get('before', None) is not None:
+                self._bounds[missing[meta['_id']]] = meta['before']
+
+    def flush(self, db: database.Database, collection_name: str) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        target = db[first_seen_name(collection_name)]
+        try:
+            self._load_bounds(target)
+            updates = []
+            for (source, fields, values), seen in pending.items():
+                bound = self._bounds.get((source, fields), None)
+                if bound is None:
+                    # not claimed yet, the build will count them
+                    continue
+                times = [ts for _id, ts in seen if _id is None or _id >= bound]
+                if not times:
+                    continue
+                _id = first_seen_id(source, fields, values)
+                updates.append(UpdateOne({'_id': _id},
+                                         {'$inc': {'total': len(times)}, '$min': {'first_seen': min(times)},
+                                          '$max': {'last_seen': max(times)}, '$setOnInsert': dict(_id)},
+                                         upsert=True))
+            if not self._indexed:
+                # the panels look values up by _id, the cleanup by last_seen
+                target.create_index([('name', ASCENDING), ('last_seen', ASCENDING)], name='la_name_last_seen',
+                                    background=True)
+                self._indexed = True
+            if updates:
+                target.bulk_write(updates, ordered=False)
+        except Exception:
+            with self._lock:
+                for key, seen in pending.items():
+                    self._pending.setdefault(key, []).extend(seen)
+            raise
+
+    @staticmethod
+    def _claim(target, meta_id: str) -> Optional[ObjectId]:
+        # the first output to insert the meta document builds the view, up to the _id of now; one that stopped
+        # without finishing is taken over once its heartbeat is older than the lease, with the same bound
+        now = datetime.datetime.utcnow()
+        before = ObjectId.from_datetime(now)
+        try:
+            target.insert_one({'_id': meta_id, 'state': 'building', 'before': before, 'started': now,
+                               'heartbeat': now})
+            return before
+        except DuplicateKeyError:
+            pass
+        meta = target.find_one_and_update(
+            {'_id': meta_id, 'state': 'building',
+             'heartbeat': {'$lt': now - datetime.timedelta(seconds=FirstSeen.BUILD_LEASE)}},
+            {'$set': {'started': now, 'heartbeat': now}})
+        if meta is None:
+            return None
+        logging.info("Taking over the stale build {} started at {}".format(meta_id, meta.get('started', None)))
+        return meta.get('before', before)
+
+    @staticmethod
+    def _heartbeat(target, meta_id: str, stop: threading.Event) -> None:
+        while not stop.wait(FirstSeen.HEARTBEAT_INTERVAL):
+            try:
+                target.update_one({'_id': meta_id, 'state': 'building'},
+                                  {'$set': {'heartbeat': datetime.datetime.utcnow()}})
+            except PyMongoError as e:
+                logging.info("Cannot renew the build {}: {}".format(meta_id, e))
+
+    @staticmethod
+    def build(db: database.Database, col, collection_name: str) -> bool:
+        # counts what was written before the view was claimed, once; the counts go to built_total and are set
+        # rather than added, so a build that is taken over can run again from the start. True when every view is done
+        target = db[first_seen_name(collection_name)]
+        done = True
+        for source, views in FIRST_SEEN_VIEWS.items():
+            for fields, condition in views:
+                meta_id = _meta_id(source, fields)
+                before = FirstSeen._claim(target, meta_id)
+                if before is None:
+                    meta = target.find_one({'_id': meta_id})
+                    done = done and meta is not None and meta.get('state', None) == 'done'
+                    continue
+                logging.info("Building the first seen index of {} for {}".format(",".join(fields), source))
+                stop = threading.Event()
+                heartbeat = threading.Thread(target=FirstSeen._heartbeat, args=(target, meta_id, stop),
+                                             name="first-seen-heartbeat")
+                heartbeat.daemon = True
+                heartbeat.start()
+                try:
+                    group_id: Dict[str, Any] = {'name': '$name', 'fields': {'$literal': ",".join(fields)}}
+                    group_id.update((x, '$' + x) for x in fields)
+                    match = [{'name': source}, {'_id': {'$lt': before}}] + \
+                            [{x: {'$exists': True}} for x in fields] + [{k: v} for k, v in condition.items()]
+                    col.aggregate([
+                        {'$match': {'$and': match}},
+                        {'$group': {'_id': group_id, 'built_total': {'$sum': 1}, 'first_seen': {'$min': '$timestamp'},
+                                    'last_seen': {'$max': '$timestamp'}}},
+                        {'$addFields': dict({'name': '$_id.name', 'fields': '$_id.fields'},
+                                            **{x: '$_id.' + x for x in fields})},
+                        {'$merge': {'into': target.name, 'on': '_id', 'whenNotMatched': 'insert', 'whenMatched': [
+                            {'$set': {'built_total': '$$new.built_total',
+                                      'first_seen': {'$min': ['$first_seen', '$$new.first_seen']},
+                                      'last_seen': {'$max': ['$last_seen', '$$new.last_seen']}}}]}}
+                    ], allowDiskUse=True)
+                    target.update_one({'_id': meta_id}, {'$set': {'state': 'done'}})
+                except PyMongoError:
+                    # the next attempt claims it again
+                    target.delete_one({'_id': meta_id, 'state': 'building'})
+                    raise
+                finally:
+                    stop.set()
+        return done
+
+    def cleanup(self, db: database.Database, collection_name: str, name: str, upper_limit: datetime.datetime) -> None:
+        # values that were not seen within the retention are forgotten with their events
+        db[first_seen_name(collection_name)].delete_many({"$and": [{"name": name},
+                                                                   {"last_seen": {"$lte": upper_limit}}]})
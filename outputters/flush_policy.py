@@ -0,0 +1,59 @@
+import logging
+from typing import Any, Dict, Optional
+
+
+class FlushPolicy:
+    DEFAULT_BUFFER_BYTES: int = 16 * 1024 * 1024
+    DEFAULT_TARGET_COMMIT_LATENCY: float = 0.1
+
+    def __init__(self, max_size: int, min_size: int, max_bytes: int, max_latency: Optional[float],
+                 target_commit_latency: float) -> None:
+        self._max_size: int = max(1, max_size)
+        self._min_size: int = max(1, min(min_size, self._max_size))
+        self._max_bytes: int = max_bytes
+        self._max_latency: Optional[float] = max_latency
+        self._target_commit_latency: float = target_commit_latency
+        self._batch_size: int = self._min_size
+
+    @staticmethod
+    def from_config(config: Dict[str, Any], default_buffer_size: int) -> 'FlushPolicy':
+        max_size: int = int(config.get('buffer_size', default_buffer_size))
+        flush_interval = config.get('flush_interval', None)
+        return FlushPolicy(max_size, int(config.get('min_buffer_size', max_size)),
+                           int(config.get('buffer_bytes', FlushPolicy.DEFAULT_BUFFER_BYTES)),
+                           float(flush_interval) if flush_interval is not None else None,
+                           float(config.get('target_commit_latency', FlushPolicy.DEFAULT_TARGET_COMMIT_LATENCY)))
+
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size
+
+    @property
+    def max_latency(self) -> Optional[float]:
+        return self._max_latency
+
+    def should_flush(self, count: int, size: int, age: float) -> bool:
+        if count > self._batch_size or size >= self._max_bytes:
+            return True
+        return self._max_latency is not None and count > 0 and age >= self._max_latency
+
+    def record_commit(self, count: int, latency: float) -> None:
+        # bigger batches while the database keeps up, smaller ones as soon as commits get slow
+        old_size: int = self._batch_size
+        if latency > self._target_commit_latency:
+            self._batch_size = max(self._min_size, self._batch_size // 2)
+        elif count >= self._batch_size:
+            self._batch_size = min(self._max_size, self._batch_size * 2)
+        if old_size != self._batch_size:
+            logging.debug("Batch size {} -> {} after committing {} in {:.3f}s".format(old_size, self._batch_size,
+                                                                                      count, latency))
+
+    def values(self) -> Dict[str, Any]:
+        return {
+            'batch_size': self._batch_size,
+            'min_buffer_size': self._min_size,
+            'buffer_size': self._max_size,
+            'buffer_bytes': self._max_bytes,
+            'flush_interval': self._max_latency,
+            'target_commit_latency': self._target_commit_latency,
+        }
@@ -0,0 +1,128 @@
+import logging
+import os
+import threading
+import weakref
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import MongoClient, monitoring
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, event, item: str, value: int = 1) -> None:
+        address: str = "{}:{}".format(*event.address)
+        with self._lock:
+            stats = self._stats.setdefault(address, {'created': 0, 'closed': 0, 'checked_out': 0,
+                                                     'in_use': 0, 'checkout_failed': 0, 'cleared': 0})
+            stats[item] += value
+
+    def values(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {k: dict(v, open=v['created'] - v['closed']) for k, v in self._stats.items()}
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        self._count(event, 'cleared')
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_created(self, event) -> None:
+        self._count(event, 'created')
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        self._count(event, 'closed')
+
+    def connection_check_out_started(self, event) -> None:
+        pass
+
+    def connection_check_out_failed(self, event) -> None:
+        self._count(event, 'checkout_failed')
+
+    def connection_checked_out(self, event) -> None:
+        self._count(event, 'checked_out')
+        self._count(event, 'in_use')
+
+    def connection_checked_in(self, event) -> None:
+        self._count(event, 'in_use', -1)
+
+
+class MongoClientRegistry:
+    # one pooled client per server and credentials, shared by the outputs, the notifiers and the web ui
+    _lock = threading.Lock()
+    _clients: Dict[Tuple, Tuple[MongoClient, PoolStats]] = {}
+    # the objects using a client, a reconnect of the same owner is not another user and owners that are gone drop out
+    _users: Dict[Tuple, weakref.WeakSet] = {}
+    _pid: int = os.getpid()
+
+    @staticmethod
+    def _key(config: Dict[str, Any]) -> Tuple:
+        hostname = config['hostname'] if config['hostname'] != "" else None
+        port = config['port'] if config['port'] != "" else None
+        if config.get('username', '') != '' and config.get('password', '') != '':
+            return hostname, port, config['username'], config['password'], config['auth_db']
+        return hostname, port, None, None, None
+
+    @classmethod
+    def get(cls, config: Dict[str, Any], owner: Any) -> MongoClient:
+        key = cls._key(config)
+        with cls._lock:
+            if cls._pid != os.getpid():
+                cls._reset()
+            if key not in cls._clients:
+                hostname, port, username, password, auth_db = key
+                stats = PoolStats()
+                if username is not None:
+                    client = MongoClient(username=username, password=password, authSource=auth_db, host=hostname,
+                                         port=port, event_listeners=[stats])
+                else:
+                    client = MongoClient(host=hostname, port=port, event_listeners=[stats])
+                logging.debug("Created Mongo client for {}:{}".format(hostname, port))
+                cls._clients[key] = (client, stats)
+                cls._users[key] = weakref.WeakSet()
+            cls._users[key].add(owner)
+            return cls._clients[key][0]
+
+    @classmethod
+    def _reset(cls) -> None:
+        # a client must not be used in a forked child, the child builds its own on first use
+        cls._clients = {}
+        cls._users = {}
+        cls._pid = os.getpid()
+
+    @classmethod
+    def after_fork(cls) -> None:
+        cls._lock = threading.Lock()
+        cls._reset()
+
+    @classmethod
+    def close_all(cls) -> None:
+        with cls._lock:
+            for client, _ in cls._clients.values():
+                client.close()
+            cls._reset()
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        with cls._lock:
+            return {"{}@{}:{}".format(key[2] or '', key[0], key[1]): {'users': len(cls._users[key]),
+                                                                       'pool': stats.values()}
+                    for key, (client, stats) in cls._clients.items()}
+
+    @classmethod
+    def client_stats(cls, config: Dict[str, Any]) -> Optional[Dict[str, Dict[str, int]]]:
+        with cls._lock:
+            entry = cls._clients.get(cls._key(config))
+        return entry[1].values() if entry is not None else None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=MongoClientRegistry.after_fork)
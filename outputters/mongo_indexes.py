@@ -0,0 +1,74 @@
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, IndexModel, collection
+from pymongo.errors import PyMongoError
+
+import matches
+
+IndexKeys = List[Tuple[str, int]]
+
+# indexes created by the collector are named with this prefix, anything else in the collection is left alone
+INDEX_PREFIX: str = 'la_'
+TTL_PREFIX: str = 'ttl_'
+
+
+def declared_indexes(extra: Optional[Dict[str, List[List[Any]]]] = None) -> Dict[str, IndexKeys]:
+    # the dashboard and the retention cleanup select on name and a time range,
+    # the new condition on name and the field that has to be new
+    indexes: Dict[str, IndexKeys] = {INDEX_PREFIX + 'name_timestamp': [('name', ASCENDING), ('timestamp', ASCENDING)]}
+    for field in sorted(set(x for fields in matches.new_fields.values() for x in fields)):
+        indexes[INDEX_PREFIX + 'name_' + field] = [('name', ASCENDING), (field, ASCENDING)]
+    for name, keys in (extra or {}).items():
+        indexes[INDEX_PREFIX + name] = [(str(key), int(direction)) for key, direction in keys]
+    return indexes
+
+
+def reconcile(col: collection.Collection, declared: Dict[str, IndexKeys]) -> None:
+    # an index created from the shell has its directions as floats
+    existing: Dict[str, IndexKeys] = {x['name']: [(k, int(v) if isinstance(v, (int, float)) else v)
+                                                  for k, v in x['key'].items()] for x in col.list_indexes()}
+    missing: List[IndexModel] = []
+    for name, keys in declared.items():
+        if name in existing and existing[name] == keys:
+            continue
+        if name in existing:
+            logging.info("Index {} on {} changed, creating it again".format(name, col.full_name))
+            col.drop_index(name)
+        elif keys in existing.values():
+            # the same keys already are indexed under another name
+            continue
+        missing.append(IndexModel(keys, name=name, background=True))
+    for name in existing:
+        if name.startswith(INDEX_PREFIX) and name not in declared:
+            logging.info("Dropping index {} on {}, it is not declared anymore".format(name, col.full_name))
+            col.drop_index(name)
+    if missing:
+        logging.info("Creating indexes {} on {}".format(", ".join(x.document['name'] for x in missing), col.full_name))
+        try:
+            col.create_indexes(missing)
+        except PyMongoError as e:
+            logging.warning("Missing indexes on {}, queries will scan the collection: {}".format(col.full_name, e))
+
+
+def index_usage(col: collection.Collection, declared: Dict[str, IndexKeys]) -> Dict[str, int]:
+    usage: Dict[str, int] = {x['name']: int(x['accesses']['ops']) for x in col.aggregate([{"$indexStats": {}}])}
+    for name in declared:
+        if name not in usage:
+            logging.warning("Index {} is missing on {}".format(name, col.full_name))
+        elif usage[name] == 0:
+            logging.info("Index {} on {} has not been used yet".format(name, col.full_name))
+    return usage
+
+
+def ensure_ttl(col: collection.Collection, name: str, seconds: int) -> None:
+    # one TTL index per source, so every source keeps its own retention in a shared collection
+    index_name: str = TTL_PREFIX + name
+    existing = {x['name']: x for x in col.list_indexes()}
+    if index_name not in existing:
+        logging.info("Creating TTL index {} on {}".format(index_name, col.full_name))
+        col.create_index([('timestamp', ASCENDING)], name=index_name, expireAfterSeconds=seconds,
+                         partialFilterExpression={'name': name}, background=True)
+    elif existing[index_name].get('expireAfterSeconds', None) != seconds:
+        logging.info("Changing TTL index {} on {} to {}s".format(index_name, col.full_name, seconds))
+        col.database.command('collMod', col.name, index={'name': index_name, 'expireAfterSeconds': seconds})
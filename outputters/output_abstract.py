@@ -1,26 +1,65 @@
 import logging
+import queue
 import threading
+import time
 from abc import ABC
-from typing import Dict, Any, List
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple, Deque
 from config_checker import Config_Checker
+from outputters.flush_policy import FlushPolicy
 
 
 class AbstractOutput(ABC):
     _config_items = {
         'buffer_size': Config_Checker.OPTIONAL,
+        'min_buffer_size': Config_Checker.OPTIONAL,
+        'buffer_bytes': Config_Checker.OPTIONAL,
+        'flush_interval': Config_Checker.OPTIONAL,
+        'target_commit_latency': Config_Checker.OPTIONAL,
+        'async_writer': Config_Checker.OPTIONAL,
+        'queue_size': Config_Checker.OPTIONAL,
         'name': Config_Checker.MANDATORY,
         'type': Config_Checker.MANDATORY
     }
     DEFAULT_BUFFER_SIZE = 1
+    DEFAULT_QUEUE_SIZE = 10000
 
     def __init__(self, config: Dict[str, Any]) -> None:
         logging.debug("Configuring output {} of type {}".format(config['name'], config['type']))
         Config_Checker.config_validate(self._config_items, config)
         self._name: str = config['name']
         self._type: str = config['type']
-        self._buffer_size: int = config.get('buffer_size', self.DEFAULT_BUFFER_SIZE)
         self._buffer: List[Dict[str, Any]] = []
+        self._buffer_marks: List[Optional[Tuple[Any, Any]]] = []
+        # per source, the positions of everything written but not committed yet, oldest first
+        self._unacked: Dict[Any, Deque[Any]] = {}
+        self._marks_lock = threading.Lock()
+        self._buffer_bytes: int = 0
+        self._buffer_start: float = 0
         self._lock = threading.Lock()
+        # the writer path and the flush timer both commit, the policy and the statistics are updated by one at a time
+        self._commit_lock = threading.Lock()
+        # the async writer takes whatever is queued, unless the batches are limited explicitly
+        self._policy: FlushPolicy = FlushPolicy.from_config(
+            config, int(config.get('queue_size', self.DEFAULT_QUEUE_SIZE)) if config.get('async_writer', False)
+            else self.DEFAULT_BUFFER_SIZE)
+        self._commit_count: int = 0
+        self._commit_time: float = 0
+        self._max_commit_latency: float = 0
+        self._last_commit_latency: float = 0
+        # with an async writer, write() only queues the data and a thread of its own commits it
+        self._queue: Optional[queue.Queue] = None
+        self._writer: Optional[threading.Thread] = None
+        self._flush_timer: Optional[threading.Thread] = None
+        if config.get('async_writer', False):
+            self._queue = queue.Queue(int(config.get('queue_size', self.DEFAULT_QUEUE_SIZE)))
+            self._writer = threading.Thread(target=self._write_queue, name="writer-{}".format(self._name))
+            self._writer.daemon = True
+            self._writer.start()
+        elif self._policy.max_latency is not None:
+            self._flush_timer = threading.Thread(target=self._flush_on_time, name="flush-{}".format(self._name))
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
 
     @property
     def type(self) -> str:
@@ -30,14 +69,93 @@ class AbstractOutput(ABC):
     def name(self) -> str:
         return self._name
 
-    def write(self, data: Dict[str, Any]) -> None:
+    def write(self, data: Dict[str, Any], mark: Optional[Tuple[Any, Any]] = None) -> None:
+        if mark is not None:
+            with self._marks_lock:
+                self._unacked.setdefault(mark[0], deque()).append(mark[1])
+        if self._queue is not None:
+            # blocks while the queue is full, so parsing can't run away from the database
+            self._queue.put((data, mark))
+            return
         with self._lock:
+            if not self._buffer:
+                self._buffer_start = time.monotonic()
             self._buffer.append(data)
-            buf_len = self.size()
-        if buf_len > self._buffer_size:
-            self.commit()
+            self._buffer_marks.append(mark)
+            self._buffer_bytes += self._estimate_size(data)
+            flush = self._policy.should_flush(self.size(), self._buffer_bytes, time.monotonic() - self._buffer_start)
+        if flush:
+            self._timed_commit()
         pass
 
+    @staticmethod
+    def _estimate_size(data: Dict[str, Any]) -> int:
+        return sum(len(key) + (len(val) if type(val) == str else 8) for key, val in data.items())
+
+    def _flush_on_time(self) -> None:
+        while True:
+            time.sleep(self._policy.max_latency / 2)
+            with self._lock:
+                flush = self._policy.should_flush(self.size(), self._buffer_bytes,
+                                                  time.monotonic() - self._buffer_start)
+            if flush:
+                try:
+                    self._timed_commit()
+                except Exception as e:
+                    logging.warning("Flushing {} failed: {}".format(self._name, e))
+
+    def _timed_commit(self) -> None:
+        with self._commit_lock:
+            with self._lock:
+                count: int = self.size()
+            start_time = time.perf_counter()
+            self.commit()
+            latency = time.perf_counter() - start_time
+            self._policy.record_commit(count, latency)
+            self._commit_count += 1
+            self._commit_time += latency
+            self._last_commit_latency = latency
+            self._max_commit_latency = max(self._max_commit_latency, latency)
+
+    def _write_queue(self) -> None:
+        while True:
+            items: List[Tuple[Dict[str, Any], Optional[Tuple[Any, Any]]]] = [self._queue.get()]
+            # everything that piled up during the last commit goes into the next one
+            try:
+                while len(items) < self._policy.batch_size:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                with self._lock:
+                    self._buffer.extend(data for data, _ in items)
+                    self._buffer_marks.extend(mark for _, mark in items)
+                self._timed_commit()
+            except Exception as e:
+                logging.warning("Writing to {} failed: {}".format(self._name, e))
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def flush(self) -> None:
+        if self._queue is not None:
+            self._queue.join()
+        # the flush timer commits from its own thread
+        with self._commit_lock:
+            self.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'queue_size': self._queue.maxsize if self._queue is not None else 0,
+            'buffered': self.size(),
+            'commits': self._commit_count,
+            'avg_commit_latency': self._commit_time / self._commit_count if self._commit_count else 0,
+            'last_commit_latency': self._last_commit_latency,
+            'max_commit_latency': self._max_commit_latency,
+            'flush_policy': self._policy.values(),
+        }
+
     def empty(self) -> bool:
         return len(self._buffer) == 0
 
@@ -45,7 +163,21 @@ class AbstractOutput(ABC):
         return len(self._buffer)
 
     def clear_buffer(self) -> None:
+        # called once the buffer is committed, so everything in it is acknowledged
+        marks = [x for x in self._buffer_marks if x is not None]
         self._buffer = []
+        self._buffer_marks = []
+        self._buffer_bytes = 0
+        if marks:
+            with self._marks_lock:
+                for source, _ in marks:
+                    self._unacked[source].popleft()
+
+    def checkpoint(self, source: Any) -> Optional[Any]:
+        # the position of the oldest data from source that is not committed yet, None if all of it is
+        with self._marks_lock:
+            unacked = self._unacked.get(source, None)
+            return unacked[0] if unacked else None
 
     def buffer(self):
         for elem in self._buffer:
@@ -66,5 +198,13 @@ class AbstractOutput(ABC):
     def is_new(self, source: str, field: str, value: str) -> bool:
         return True
 
+    def watch_new(self, source: str, field: str) -> None:
+        # field of source will be checked with is_new
+        pass
+
+    def start_builds(self) -> None:
+        # work on the stored data that only the long-running collector does, not the importer
+        pass
+
     def __hash__(self):
         return hash(self._name + self._type)
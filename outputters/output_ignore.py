@@ -1,4 +1,4 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 from output import AbstractOutput
 
 
@@ -6,7 +6,7 @@ class IgnoreOutput(AbstractOutput):
     def __init__(self, config: Dict[str, str]) -> None:
         super().__init__(config)
 
-    def write(self, data: Dict[str, Any]) -> None:
+    def write(self, data: Dict[str, Any], mark: Optional[Tuple[Any, Any]] = None) -> None:
         pass
 
     def commit(self) -> None:
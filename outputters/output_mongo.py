@@ -1,14 +1,30 @@
 import datetime
 import logging
+import threading
+import time
 
-from pymongo import MongoClient, collection
-from typing import Dict, Any, Optional
+from bson import ObjectId
+from pymongo import collection, database
+from pymongo.errors import BulkWriteError, PyMongoError
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple, Union
 from config_checker import Config_Checker
 import outputters.output_abstract
+from outputters.first_seen import FirstSeen
+from outputters.mongo_clients import MongoClientRegistry
+from outputters.mongo_indexes import IndexKeys, declared_indexes, ensure_ttl, index_usage, reconcile
+from outputters.partitions import PartitionedCollection
+from outputters.rollups import Rollups
+from outputters.spool import Spool, SpoolFull
+from seen_index import SeenIndex
 
 import matches
 
 
+def watermark_name(collection_name: str) -> str:
+    # the newest timestamp written per source, readers use it to tell whether their results are outdated
+    return "{}_watermark".format(collection_name)
+
+
 class MongoConnector:
     _config_items = {
         'hostname': Config_Checker.MANDATORY,
@@ -18,28 +34,46 @@ class MongoConnector:
         'auth_db': Config_Checker.MANDATORY,
         'database': Config_Checker.MANDATORY,
         'collection': Config_Checker.MANDATORY,
+        'partition': Config_Checker.OPTIONAL,
     }
 
-    def __init__(self, config: Dict[str, str]) -> None:
+    def __init__(self, config: Dict[str, str],
+                 on_create: Optional[Callable[[collection.Collection], None]] = None, owner: Any = None) -> None:
         Config_Checker.config_validate(self._config_items, config)
         self._config = config
-        hostname = self._config['hostname'] if self._config['hostname'] != "" else None
-        port = self._config['port'] if self._config['port'] != "" else None
-        if 'username' in self._config and 'password' in self._config and \
-                (self._config['username'] != '' and self._config['password'] != ''):
-            self._mongo = MongoClient(username=self._config['username'], password=self._config['password'],
-                                      authSource=self._config['auth_db'], host=hostname, port=port)
-        else:
-            self._mongo = MongoClient(host=hostname, port=port)
+        self._mongo = MongoClientRegistry.get(self._config, owner if owner is not None else self)
         self._db = self._mongo[self._config['database']]
-        self._collection = self._db[self._config['collection']]
+        # with partitions per day or month the collection is a facade over all of them
+        if self._config.get('partition', 'none') in PartitionedCollection.MODES:
+            self._collection = PartitionedCollection(self._db, self._config['collection'], self._config['partition'],
+                                                     on_create)
+        else:
+            self._collection = self._db[self._config['collection']]
 
-    def get_collection(self) -> collection.Collection:
+    def get_collection(self) -> Union[collection.Collection, PartitionedCollection]:
         return self._collection
 
+    def get_database(self) -> database.Database:
+        return self._db
+
 
 class MongoOutput(outputters.output_abstract.AbstractOutput):
-    _config_items = {'buffer_size': Config_Checker.OPTIONAL, 'name': Config_Checker.MANDATORY}
+    _config_items = {'buffer_size': Config_Checker.OPTIONAL, 'name': Config_Checker.MANDATORY,
+                     'spool_directory': Config_Checker.OPTIONAL, 'spool_size': Config_Checker.OPTIONAL,
+                     'spool_segment_size': Config_Checker.OPTIONAL, 'seen_index': Config_Checker.OPTIONAL,
+                     'seen_index_memory': Config_Checker.OPTIONAL, 'manage_indexes': Config_Checker.OPTIONAL,
+                     'indexes': Config_Checker.OPTIONAL, 'partition': Config_Checker.OPTIONAL,
+                     'rollups': Config_Checker.OPTIONAL, 'first_seen': Config_Checker.OPTIONAL}
+    SPOOL_MIN_BACKOFF: float = 1
+    SPOOL_MAX_BACKOFF: float = 60
+    # how long a commit waits for room in a full spool, the writer is held up meanwhile
+    SPOOL_FULL_WAIT: float = 10
+    FIRST_SEEN_RETRY: float = 300
+    PARTITION_MODES = ('none', 'day', 'month', 'ttl')
+    # outputs of several files can share a collection and a source, the cleanup is done once for all of them
+    CLEANUP_INTERVAL: float = 30 * 60
+    _cleaned: Dict[Tuple[str, str], float] = {}
+    _retentions: Dict[str, Dict[str, int]] = {}
 
     def __init__(self, config: Dict[str, Any]) -> None:
         super().__init__(config)
@@ -48,34 +82,282 @@ class MongoOutput(outputters.output_abstract.AbstractOutput):
         self._mongo = None
         self._db: Optional[MongoConnector] = None
         self._collection: Optional[collection] = None
+        # batches that can't be written go to disk and are written later by the drain thread
+        self._spool: Optional[Spool] = None
+        self._spool_event = threading.Event()
+        self._spool_drainer: Optional[threading.Thread] = None
+        if config.get('spool_directory', None):
+            self._spool = Spool(config['spool_directory'], int(config.get('spool_size', Spool.DEFAULT_MAX_SIZE)),
+                                int(config.get('spool_segment_size', Spool.DEFAULT_SEGMENT_SIZE)))
+        # compound indexes for the queries of the dashboard, the cleanup and the new condition
+        self._indexes: Optional[Dict[str, IndexKeys]] = None
+        if config.get('manage_indexes', True):
+            self._indexes = declared_indexes(config.get('indexes', None))
+        self._indexes_checked: bool = False
+        # counts per minute and hour for the dashboard, written along with the events
+        self._rollups: Optional[Rollups] = Rollups() if config.get('rollups', False) else None
+        # first and last time and count per address and user, so the new panels don't scan the whole history
+        self._first_seen: Optional[FirstSeen] = FirstSeen() if config.get('first_seen', False) else None
+        self._first_seen_builder: Optional[threading.Thread] = None
+        self._watermarks: Dict[str, datetime.datetime] = {}
+        self._partition: str = config.get('partition', 'none')
+        if self._partition not in self.PARTITION_MODES:
+            raise ValueError("Unknown partition mode {}".format(self._partition))
+        # the values the new condition has seen, kept in memory instead of counting in the database for every line
+        self._seen: Optional[SeenIndex] = None
+        if config.get('seen_index', True):
+            self._seen = SeenIndex(self._seen_values, int(config.get('seen_index_memory', SeenIndex.DEFAULT_MEMORY)))
+
+    def write(self, data: Dict[str, Any], mark: Optional[Tuple[Any, Any]] = None) -> None:
+        if self._seen is not None:
+            self._seen.add(data)
+        ts = data.get('timestamp', None)
+        if isinstance(ts, datetime.datetime) and data.get('name', None) is not None:
+            with self._marks_lock:
+                if data['name'] not in self._watermarks or ts > self._watermarks[data['name']]:
+                    self._watermarks[data['name']] = ts
+        super().write(data, mark)
+
+    def _seen_values(self, source: str, field: str) -> Iterable[Tuple[Any, Optional[datetime.datetime]]]:
+        if self._db is None or self._collection is None:
+            raise ValueError('Not connected to Database')
+        # distinct() is limited to 16MB of results, a $group is not
+        for doc in self._collection.aggregate([{"$match": {"name": source, field: {"$exists": True}}},
+                                               {"$group": {"_id": "$" + field, "last_seen": {"$max": "$timestamp"}}}],
+                                              allowDiskUse=True):
+            yield doc['_id'], doc.get('last_seen', None)
+
+    def _commit_spooled(self) -> None:
+        with self._lock:
+            if self.empty():
+                return
+            docs = list(self.buffer())
+            if self._spool.empty():
+                try:
+                    if self._db is None or self._collection is None:
+                        raise ValueError('Not connected to Database')
+                    self._collection.insert_many(docs)
+                    self._committed(docs)
+                    self.clear_buffer()
+                    return
+                except Exception as e:
+                    logging.warning("Spooling {} documents: {}".format(len(docs), str(e)))
+            # while anything is spooled, new data goes behind it to keep the order; with the _id set now the
+            # first seen index can place it against the bound of its build
+            for doc in docs:
+                doc.setdefault('_id', ObjectId())
+            self._spool_event.set()
+            try:
+                self._spool.append(docs, self.SPOOL_FULL_WAIT)
+            except SpoolFull as e:
+                # kept in the buffer and not acknowledged, so the state keeps pointing at it as well
+                logging.error("{}, keeping {} documents of {} unacknowledged".format(str(e), len(docs), self._name))
+                return
+            except OSError as e:
+                logging.warning("Cannot spool data: {}".format(str(e)))
+                return
+            self._committed(docs)
+            self.clear_buffer()
+        self._spool_event.set()
+
+    def _committed(self, docs: List[Dict[str, Any]]) -> None:
+        # counted once the events are in the database or the spool, a failed insert is retried and must not count twice
+        if self._rollups is not None:
+            for doc in docs:
+                self._rollups.add(doc)
+        if self._first_seen is not None:
+            for doc in docs:
+                self._first_seen.add(doc)
+
+    def _insert_segment(self, docs) -> None:
+        try:
+            self._collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # documents from a batch that was partially written before
+            errors = [x for x in e.details.get('writeErrors', []) if x.get('code') != 11000]
+            if errors or e.details.get('writeConcernErrors'):
+                raise
+
+    def _drain_spool(self) -> None:
+        backoff: float = self.SPOOL_MIN_BACKOFF
+        while True:
+            self._spool_event.wait()
+            self._spool_event.clear()
+            while True:
+                segment = self._spool.oldest()
+                if segment is None:
+                    break
+                try:
+                    if self._collection is None:
+                        raise ValueError('Not connected to Database')
+                    docs = self._spool.read(segment)
+                    if docs:
+                        self._insert_segment(docs)
+                    self._spool.remove(segment)
+                    backoff = self.SPOOL_MIN_BACKOFF
+                except Exception as e:
+                    logging.warning("Cannot write spooled data, retrying in {}s: {}".format(backoff, str(e)))
+                    time.sleep(backoff)
+                    backoff = min(self.SPOOL_MAX_BACKOFF, backoff * 2)
+
+    def _write_watermarks(self) -> None:
+        with self._marks_lock:
+            watermarks, self._watermarks = self._watermarks, {}
+        try:
+            col = self._db.get_database()[watermark_name(self._config['collection'])]
+            for name, ts in watermarks.items():
+                col.update_one({'_id': name}, {'$max': {'timestamp': ts}}, upsert=True)
+        except Exception as e:
+            logging.info("Cannot write the watermark of {}: {}".format(self._name, str(e)))
+            with self._marks_lock:
+                for name, ts in watermarks.items():
+                    if name not in self._watermarks or ts > self._watermarks[name]:
+                        self._watermarks[name] = ts
 
     def commit(self) -> None:
+        self._commit_buffer()
+        if self._watermarks and self.empty() and self._db is not None:
+            self._write_watermarks()
+        if self._rollups is not None and self._db is not None:
+            try:
+                self._rollups.flush(self._db.get_database(), self._config['collection'])
+            except Exception as e:
+                logging.warning("Cannot write rollups of {}: {}".format(self._name, str(e)))
+        if self._first_seen is not None and self._db is not None:
+            try:
+                self._first_seen.flush(self._db.get_database(), self._config['collection'])
+            except Exception as e:
+                logging.warning("Cannot write the first seen index of {}: {}".format(self._name, str(e)))
+
+    def _commit_buffer(self) -> None:
         if self.empty():
             return
+        if self._spool is not None:
+            self._commit_spooled()
+            return
         try:
             if self._db is None or self._collection is None:
                 raise ValueError('Not connected to Database')
             with self._lock:
-                self._collection.insert_many(self.buffer())
+                # another thread may have committed it meanwhile
+                if self.empty():
+                    return
+                docs = list(self.buffer())
+                self._collection.insert_many(docs)
+                self._committed(docs)
                 self.clear_buffer()
         except Exception as e:
             logging.warning(str(e))
             self.connect()
 
+    def _check_indexes(self, col: collection.Collection) -> None:
+        try:
+            reconcile(col, self._indexes)
+        except PyMongoError as e:
+            logging.warning("Cannot check the indexes of {}: {}".format(col.full_name, e))
+
     def connect(self) -> None:
-        self._db = MongoConnector(self._config)
+        self._db = MongoConnector(self._config, self._check_indexes if self._indexes is not None else None, self)
         self._collection = self._db.get_collection()
+        # only once, connect() is called again after every failed commit, partitions are checked when they are created
+        if self._indexes is not None and not self._indexes_checked and \
+                not isinstance(self._collection, PartitionedCollection):
+            try:
+                reconcile(self._collection, self._indexes)
+                self._indexes_checked = True
+            except PyMongoError as e:
+                logging.warning("Cannot check the indexes of {}: {}".format(self._name, e))
+        if self._seen is not None:
+            self._seen.start()
+        if self._spool is not None and self._spool_drainer is None:
+            self._spool_drainer = threading.Thread(target=self._drain_spool, name="spool-{}".format(self._name))
+            self._spool_drainer.daemon = True
+            self._spool_drainer.start()
+            self._spool_event.set()
+
+    def start_builds(self) -> None:
+        if self._first_seen is not None and self._first_seen_builder is None:
+            self._first_seen_builder = threading.Thread(target=self._build_first_seen,
+                                                        name="first-seen-{}".format(self._name))
+            self._first_seen_builder.daemon = True
+            self._first_seen_builder.start()
+
+    def _build_first_seen(self) -> None:
+        # tried again until every view is done, a build another collector stopped is taken over then
+        while True:
+            try:
+                if FirstSeen.build(self._db.get_database(), self._collection, self._config['collection']):
+                    return
+            except PyMongoError as e:
+                logging.warning("Cannot build the first seen index of {}: {}".format(self._name, e))
+            time.sleep(self.FIRST_SEEN_RETRY)
 
     def cleanup(self, name: str, retention: int) -> None:
         if self._db is None or self._collection is None:
             raise ValueError('Not connected to Database')
-        upper_limit = datetime.datetime.now() - datetime.timedelta(days=retention)
-        self._collection.delete_many({"$and": [{"name": name}, {"timestamp": {"$lte": upper_limit}}]})
+        key = (self._collection.full_name, name)
+        now = time.monotonic()
+        if key in self._cleaned and now - self._cleaned[key] < self.CLEANUP_INTERVAL:
+            return
+        self._cleaned[key] = now
+        self._retentions.setdefault(self._collection.full_name, {})[name] = retention
+        if self._partition == 'ttl':
+            # the server removes expired documents by itself
+            ensure_ttl(self._collection, name, int(retention) * 24 * 60 * 60)
+        elif isinstance(self._collection, PartitionedCollection):
+            utc_now = datetime.datetime.utcnow()
+            limits = {k: utc_now - datetime.timedelta(days=v)
+                      for k, v in self._retentions[self._collection.full_name].items()}
+            self._collection.expire(name, limits[name], limits)
+        else:
+            upper_limit = datetime.datetime.now() - datetime.timedelta(days=retention)
+            self._collection.delete_many({"$and": [{"name": name}, {"timestamp": {"$lte": upper_limit}}]})
+        if self._rollups is not None:
+            self._rollups.cleanup(self._db.get_database(), self._config['collection'], name,
+                                  datetime.datetime.utcnow() - datetime.timedelta(days=retention))
+        if self._first_seen is not None:
+            self._first_seen.cleanup(self._db.get_database(), self._config['collection'], name,
+                                     datetime.datetime.utcnow() - datetime.timedelta(days=retention))
+        if self._seen is not None:
+            self._seen.prune(name, datetime.datetime.utcnow() - datetime.timedelta(days=retention))
+        index_col = self._collection.newest() if isinstance(self._collection, PartitionedCollection) \
+            else self._collection
+        if self._indexes is not None and index_col is not None:
+            try:
+                logging.debug("Index usage of {}: {}".format(index_col.full_name, index_usage(index_col,
+                                                                                           self._indexes)))
+            except PyMongoError as e:
+                logging.info("Cannot read the index usage of {}: {}".format(self._name, e))
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats['pool'] = MongoClientRegistry.client_stats(self._config)
+        if self._spool is not None:
+            stats['spooled_bytes'] = self._spool.size()
+        if self._seen is not None:
+            stats['seen_index'] = self._seen.stats()
+        return stats
 
     def count(self, condition: Dict[str, Any]) -> int:
         if self._db is None or self._collection is None:
             raise ValueError('Not connected to Database')
         return int(self._collection.count_documents(condition))
 
+    def watch_new(self, source: str, field: str) -> None:
+        if self._seen is not None and matches.is_new_field(source, field):
+            self._seen.watch(source, field)
+
     def is_new(self, source: str, field: str, value: str) -> bool:
-        return matches.is_new(self, source, field, value)
\ No newline at end of file
+        if self._seen is None:
+            return matches.is_new(self, source, field, value)
+        if not matches.is_new_field(source, field):
+            return False
+        res = self._seen.is_new(source, field, value)
+        if res is not None:
+            return res
+        # while the seen values are loaded the database is asked
+        try:
+            return matches.is_new(self, source, field, value)
+        except Exception as e:
+            logging.warning("Cannot count the values of {} for {}: {}".format(field, source, e))
+            return False
\ No newline at end of file
@@ -0,0 +1,166 @@
+import datetime
+import logging
+import re
+import threading
+import time
+from itertools import groupby
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import collection, database
+
+Partition = Tuple[datetime.datetime, datetime.datetime, str]
+
+
+def _utc(ts: datetime.datetime) -> datetime.datetime:
+    # naive timestamps are stored as UTC by pymongo
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def time_range(query: Dict[str, Any], field: str = 'timestamp') \
+        -> Tuple[Optional[datetime.datetime], Optional[datetime.datetime]]:
+    # the bounds a query puts on field, only following $and so no matching document can be outside them
+    lower: Optional[datetime.datetime] = None
+    upper: Optional[datetime.datetime] = None
+    for key, value in query.items():
+        if key == '$and':
+            for sub in value:
+                sub_lower, sub_upper = time_range(sub, field)
+                if sub_lower is not None and (lower is None or sub_lower > lower):
+                    lower = sub_lower
+                if sub_upper is not None and (upper is None or sub_upper < upper):
+                    upper = sub_upper
+        elif key == field and type(value) == dict:
+            for op, ts in value.items():
+                if not isinstance(ts, datetime.datetime):
+                    continue
+                ts = _utc(ts)
+                if op in ('$gte', '$gt') and (lower is None or ts > lower):
+                    lower = ts
+                elif op in ('$lte', '$lt') and (upper is None or ts < upper):
+                    upper = ts
+    return lower, upper
+
+
+class PartitionedCollection:
+    # one collection per day or per month, named <collection>_YYYYMMDD or <collection>_YYYYMM
+    MODES: Dict[str, str] = {'day': '%Y%m%d', 'month': '%Y%m'}
+    LIST_INTERVAL: float = 60
+
+    def __init__(self, db: database.Database, name: str, mode: str,
+                 on_create: Optional[Callable[[collection.Collection], None]] = None) -> None:
+        if mode not in self.MODES:
+            raise ValueError("Unknown partition mode {}".format(mode))
+        self._db = db
+        self._name: str = name
+        self._mode: str = mode
+        self._format: str = self.MODES[mode]
+        self._regex = re.compile(r'^{}_(\d{{{}}})$'.format(re.escape(name), 8 if mode == 'day' else 6))
+        self._on_create = on_create
+        self._lock = threading.Lock()
+        self._known: Dict[str, bool] = {}
+        self._partitions: List[Partition] = []
+        self._listed: float = 0
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def full_name(self) -> str:
+        return "{}.{}_*".format(self._db.name, self._name)
+
+    def _bounds(self, start: datetime.datetime) -> Partition:
+        if self._mode == 'day':
+            end = start + datetime.timedelta(days=1)
+        else:
+            end = (start + datetime.timedelta(days=32)).replace(day=1)
+        return start, end, "{}_{}".format(self._name, start.strftime(self._format))
+
+    def partition_name(self, ts: Any) -> str:
+        if not isinstance(ts, datetime.datetime):
+            ts = datetime.datetime.utcnow()
+        ts = _utc(ts)
+        return "{}_{}".format(self._name, ts.strftime(self._format))
+
+    def partitions(self, refresh: bool = False) -> List[Partition]:
+        with self._lock:
+            if refresh or time.monotonic() - self._listed > self.LIST_INTERVAL:
+                partitions = []
+                for name in self._db.list_collection_names(filter={"name": {"$regex": self._regex.pattern}}):
+                    m = self._regex.match(name)
+                    if m:
+                        partitions.append(self._bounds(datetime.datetime.strptime(m.group(1), self._format)))
+                self._partitions = sorted(partitions)
+                self._listed = time.monotonic()
+            return self._partitions
+
+    def select(self, query: Dict[str, Any]) -> List[str]:
+        lower, upper = time_range(query)
+        return [name for start, end, name in self.partitions()
+                if (lower is None or end > lower) and (upper is None or start <= upper)]
+
+    def _collection(self, name: str) -> collection.Collection:
+        col = self._db[name]
+        if name not in self._known:
+            # indexes are checked once per partition
+            if self._on_create is not None:
+                self._on_create(col)
+            self._known[name] = True
+            self._listed = 0
+        return col
+
+    def insert_many(self, docs: Iterable[Dict[str, Any]], ordered: bool = True) -> None:
+        # consecutive documents of the same partition go in one batch, so the order is kept
+        for name, group in groupby(docs, key=lambda x: self.partition_name(x.get('timestamp', None))):
+            self._collection(name).insert_many(list(group), ordered=ordered)
+
+    def insert_one(self, doc: Dict[str, Any]) -> None:
+        self._collection(self.partition_name(doc.get('timestamp', None))).insert_one(doc)
+
+    def count_documents(self, query: Dict[str, Any]) -> int:
+        return sum(self._db[name].count_documents(query) for name in self.select(query))
+
+    def distinct(self, field: str, query: Optional[Dict[str, Any]] = None) -> List[Any]:
+        values: List[Any] = []
+        for name in self.select(query or {}):
+            values.extend(x for x in self._db[name].distinct(field, query) if x not in values)
+        return values
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs):
+        # the partitions are read as one by appending them to the first one
+        match: Dict[str, Any] = pipeline[0].get('$match', {}) if pipeline else {}
+        names = self.select(match)
+        if not names:
+            return iter([])
+        head = [pipeline[0]] if match else []
+        union = [{"$unionWith": {"coll": name, "pipeline": head}} for name in names[1:]]
+        return self._db[names[0]].aggregate(head + union + pipeline[len(head):], **kwargs)
+
+    def delete_many(self, query: Dict[str, Any]) -> None:
+        for name in self.select(query):
+            self._db[name].delete_many(query)
+
+    def newest(self) -> Optional[collection.Collection]:
+        partitions = self.partitions()
+        return self._db[partitions[-1][2]] if partitions else None
+
+    def expire(self, name: str, limit: datetime.datetime, limits: Dict[str, datetime.datetime]) -> None:
+        # limits holds the limit of every source known to write here, a partition is dropped once
+        # everything in it is past the limit of its source, otherwise only the expired part of name is deleted
+        limit = _utc(limit)
+        for start, end, partition in self.partitions(refresh=True):
+            if start >= limit:
+                break
+            col = self._db[partition]
+            sources = col.distinct('name')
+            if all(x in limits and end <= _utc(limits[x]) for x in sources):
+                logging.info("Dropping partition {}".format(partition))
+                col.drop()
+                continue
+            if end <= limit:
+                col.delete_many({"name": name})
+            else:
+                col.delete_many({"$and": [{"name": name}, {"timestamp": {"$lte": limit}}]})
+        self._listed = 0
@@ -0,0 +1,226 @@
+import datetime
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, UpdateOne, database
+
+# per source and granularity the fields a bucket is counted by and the fields that are summed, only what the panels
+# group and filter on; the minute buckets only serve the time lines of a day and keep less, so a bucket holds far
+# fewer documents than the events it counts; the enriched fields follow from the address and add no buckets
+ROLLUP_VIEWS: Dict[str, Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]]] = {
+    'auth_ssh': {
+        'minute': (('ip_address', 'username', 'type', 'host', 'hostname'), ()),
+        'hour': (('ip_address', 'username', 'type', 'host', 'hostname', 'prefix', 'country_code', 'country_name'), ()),
+    },
+    'apache_access': {
+        'minute': (('ip_address', 'code', 'hostname'), ('size',)),
+        'hour': (('ip_address', 'username', 'code', 'http_command', 'protocol', 'protocol_version', 'hostname',
+                  'prefix', 'country_code', 'country_name'), ('size',)),
+    },
+    'nntp_proxy': {
+        'minute': (('ip_address', 'hostname'), ('up_size', 'down_size')),
+        'hour': (('ip_address', 'hostname', 'dest_port', 'prefix', 'country_code', 'country_name'),
+                 ('up_size', 'down_size')),
+    },
+}
+GRANULARITIES: Dict[str, int] = {'minute': 60, 'hour': 3600}
+META: str = 'meta'
+
+
+def rollup_name(collection_name: str, granularity: str) -> str:
+    return "{}_rollup_{}".format(collection_name, granularity)
+
+
+def bucket(ts: datetime.datetime, seconds: int) -> datetime.datetime:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return ts - datetime.timedelta(seconds=(ts.minute * 60 + ts.second) % seconds, microseconds=ts.microsecond)
+
+
+class Rollups:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (granularity, source, bucket, values) -> [count, sums...]
+        self._pending: Dict[Tuple, List[Any]] = {}
+        self._started: Dict[str, datetime.datetime] = {}
+        self._indexed: bool = False
+        self._recorded: set = set()
+
+    def add(self, doc: Dict[str, Any]) -> None:
+        source = doc.get('name', None)
+        ts = doc.get('timestamp', None)
+        if source not in ROLLUP_VIEWS or not isinstance(ts, datetime.datetime):
+            return
+        with self._lock:
+            if source not in self._started:
+                # the first hour is only partly counted, the rollups can be used from the next one on
+                self._started[source] = bucket(ts, 3600) + datetime.timedelta(hours=1)
+            for granularity, seconds in GRANULARITIES.items():
+                dims, sums = ROLLUP_VIEWS[source][granularity]
+                values = tuple(doc.get(x, None) for x in dims)
+                acc = self._pending.setdefault((granularity, source, bucket(ts, seconds), values),
+                                               [0] + [0] * len(sums))
+                acc[0] += 1
+                for i, field in enumerate(sums):
+                    value = doc.get(field, None)
+                    if type(value) in (int, float):
+                        acc[i + 1] += value
+
+    def _updates(self, pending: Dict[Tuple, List[Any]]) -> Dict[str, List[UpdateOne]]:
+        updates: Dict[str, List[UpdateOne]] = {x: [] for x in GRANULARITIES}
+        for (granularity, source, ts, values), acc in pending.items():
+            dims, sums = ROLLUP_VIEWS[source][granularity]
+            key = dict(zip(dims, values))
+            inc = {'count': acc[0]}
+            inc.update((field, acc[i + 1]) for i, field in enumerate(sums))
+            # a field the events don't have stays missing, so $addToSet leaves it out like it does for the events
+            fields = dict(name=source, timestamp=ts, **{k: v for k, v in key.items() if v is not None})
+            updates[granularity].append(UpdateOne({'_id': dict(name=source, timestamp=ts, **key)},
+                                                  {'$inc': inc, '$setOnInsert': fields}, upsert=True))
+        return updates
+
+    def flush(self, db: database.Database, collection_name: str) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            started = {k: v for k, v in self._started.items() if k not in self._recorded}
+        if not pending:
+            return
+        try:
+            if not self._indexed:
+                for granularity in GRANULARITIES:
+                    db[rollup_name(collection_name, granularity)].create_index(
+                        [('name', ASCENDING), ('timestamp', ASCENDING)], name='la_name_timestamp', background=True)
+                self._indexed = True
+            for granularity, updates in self._updates(pending).items():
+                if updates:
+                    db[rollup_name(collection_name, granularity)].bulk_write(updates, ordered=False)
+            # only the first start is kept, the rollups cover everything from there on
+            meta = db[rollup_name(collection_name, META)]
+            for source, since in started.items():
+                meta.update_one({'_id': source}, {'$setOnInsert': {'since': since}}, upsert=True)
+                self._recorded.add(source)
+        except Exception:
+            # counted again with the next flush
+            with self._lock:
+                for key, acc in pending.items():
+                    current = self._pending.setdefault(key, [0] * len(acc))
+                    for i, value in enumerate(acc):
+                        current[i] += value
+            raise
+
+    def cleanup(self, db: database.Database, collection_name: str, name: str, upper_limit: datetime.datetime) -> None:
+        for granularity in GRANULARITIES:
+            db[rollup_name(collection_name, granularity)].delete_many(
+                {"$and": [{"name": name}, {"timestamp": {"$lte": upper_limit}}]})
+
+
+def rollup_since(db: database.Database, collection_name: str, source: str) -> Optional[datetime.datetime]:
+    meta = db[rollup_name(collection_name, META)].find_one({'_id': source})
+    return meta['since'] if meta is not None else None
+
+
+class NotRollable(Exception):
+    pass
+
+
+# date parts a bucket still has, with the finest granularity that keeps them right
+_DATE_OPS: Dict[str, str] = {'$minute': 'minute', '$hour': 'hour', '$dayOfMonth': 'hour', '$dayOfWeek': 'hour',
+                             '$dayOfYear': 'hour', '$week': 'hour', '$isoWeek': 'hour', '$month': 'hour',
+                             '$year': 'hour', '$dateToString': 'hour'}
+_MATCH_OPS = ('$gte', '$gt', '$lte', '$lt', '$eq', '$ne', '$in', '$nin', '$regex', '$options')
+_EXPR_OPS = ('$addToSet', '$sum', '$max')
+
+
+class _Rewriter:
+    # turns a pipeline over the events into the same pipeline over rollup documents, where every
+    # document stands for 'count' events that share the fields of the view
+    def __init__(self, source: str) -> None:
+        self._views = ROLLUP_VIEWS[source]
+        self._fields = set().union(*(dims for dims, _ in self._views.values())) | {'name'}
+        self._sums = set().union(*(sums for _, sums in self._views.values()))
+        self.used: set = set()
+        self.granularity: str = 'hour'
+
+    def _field(self, name: str, date: bool = False) -> None:
+        if date and name == 'timestamp':
+            return
+        if name not in self._fields:
+            raise NotRollable(name)
+        self.used.add(name)
+
+    def granularities(self) -> List[str]:
+        # the coarsest first, the finer ones for periods that don't start or end on a whole bucket
+        return [g for g in ('hour', 'minute') if (g == 'minute' or self.granularity == 'hour') and
+                self.used - {'name'} <= set(self._views[g][0])]
+
+    def match(self, query: Dict[str, Any]) -> Dict[str, Any]:
+        if type(query) != dict:
+            raise NotRollable(str(query))
+        for key, value in query.items():
+            if key in ('$and', '$or'):
+                for sub in value:
+                    self.match(sub)
+            elif key.startswith('$'):
+                raise NotRollable(key)
+            elif key != 'timestamp':
+                self._field(key)
+                if type(value) == dict and any(x not in _MATCH_OPS for x in value):
+                    raise NotRollable(key)
+        return query
+
+    def expr(self, expr: Any, date: bool = False) -> Any:
+        if type(expr) == str:
+            if expr.startswith('$'):
+                self._field(expr[1:], date)
+            return expr
+        if type(expr) == list:
+            return [self.expr(x, date) for x in expr]
+        if type(expr) != dict:
+            return expr
+        result: Dict[str, Any] = {}
+        for key, value in expr.items():
+            if key == '$sum':
+                if value == 1:
+                    value = '$count'
+                elif type(value) != str or value[1:] not in self._sums:
+                    raise NotRollable(key)
+            elif key in _DATE_OPS:
+                if key == '$dateToString' and '%S' in value.get('format', ''):
+                    raise NotRollable(key)
+                if _DATE_OPS[key] == 'minute' or (key == '$dateToString' and '%M' in value.get('format', '')):
+                    self.granularity = 'minute'
+                value = self.expr(value, True)
+            elif key.startswith('$') and key not in _EXPR_OPS:
+                raise NotRollable(key)
+            else:
+                value = self.expr(value, date)
+            result[key] = value
+        return result
+
+
+def rewrite(pipeline: List[Dict[str, Any]], source: str) -> Optional[Tuple[List[Dict[str, Any]], List[str]]]:
+    # the pipeline for the rollups and the granularities that keep what it uses, None if the result would not be
+    # the same
+    if source not in ROLLUP_VIEWS:
+        return None
+    rewriter = _Rewriter(source)
+    result: List[Dict[str, Any]] = []
+    try:
+        for stage in pipeline:
+            if '$match' in stage:
+                result.append({'$match': rewriter.match(stage['$match'])})
+            elif '$group' in stage:
+                result.append({'$group': rewriter.expr(stage['$group'])})
+            elif '$sort' in stage:
+                result.append(stage)
+            else:
+                raise NotRollable(str(list(stage)))
+    except NotRollable as e:
+        logging.debug("No rollup for {}: {}".format(source, e))
+        return None
+    granularities = rewriter.granularities()
+    if not granularities:
+        logging.debug("No rollup for {}: the buckets don't keep {}".format(source, ", ".join(sorted(rewriter.used))))
+        return None
+    return result, granularities
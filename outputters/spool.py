@@ -0,0 +1,110 @@
+import logging
+import os
+import re
+import struct
+import threading
+from typing import Any, Dict, List, Optional
+
+import bson
+from bson.errors import InvalidBSON
+
+
+class SpoolFull(Exception):
+    pass
+
+
+class Spool:
+    DEFAULT_MAX_SIZE: int = 1024 * 1024 * 1024
+    DEFAULT_SEGMENT_SIZE: int = 16 * 1024 * 1024
+    _segment_regex = re.compile(r'^spool-(\d+)\.bson$')
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE,
+                 segment_size: int = DEFAULT_SEGMENT_SIZE) -> None:
+        self._directory: str = directory
+        self._max_size: int = max_size
+        self._segment_size: int = segment_size
+        self._lock = threading.Lock()
+        # signalled whenever a replayed segment is removed and there is room again
+        self._room = threading.Condition(self._lock)
+        os.makedirs(self._directory, exist_ok=True)
+        self._segments: List[int] = sorted(int(m.group(1)) for m in
+                                           (self._segment_regex.match(x) for x in os.listdir(self._directory)) if m)
+        self._sizes: Dict[int, int] = {x: os.path.getsize(self._path(x)) for x in self._segments}
+        # appends go to the last segment, unless it is being replayed
+        self._writable: bool = False
+        if self._segments:
+            logging.info("Found {} spooled bytes in {}".format(self.size(), self._directory))
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self._directory, "spool-{:012d}.bson".format(segment))
+
+    def size(self) -> int:
+        return sum(self._sizes.values())
+
+    def empty(self) -> bool:
+        with self._lock:
+            return not self._segments
+
+    def _has_room(self, size: int) -> bool:
+        # a batch larger than the whole spool still fits into an empty one
+        return not self._segments or self.size() + size <= self._max_size
+
+    def append(self, docs: List[Dict[str, Any]], timeout: Optional[float] = None) -> None:
+        data = b''.join(bson.encode(doc) for doc in docs)
+        with self._lock:
+            # nothing spooled is ever dropped, when it is full the caller has to keep its data
+            if not self._room.wait_for(lambda: self._has_room(len(data)), timeout):
+                raise SpoolFull("Spool {} is full with {} bytes".format(self._directory, self.size()))
+            if not self._segments or not self._writable or self._sizes[self._segments[-1]] >= self._segment_size:
+                segment = self._segments[-1] + 1 if self._segments else 0
+                self._segments.append(segment)
+                self._sizes[segment] = 0
+                self._writable = True
+            segment = self._segments[-1]
+            with open(self._path(segment), 'ab') as f:
+                f.write(data)
+                f.flush()
+                # one sync for the whole batch
+                os.fsync(f.fileno())
+            self._sizes[segment] += len(data)
+
+    def _remove(self, segment: int) -> None:
+        try:
+            os.unlink(self._path(segment))
+        except OSError as e:
+            logging.warning("Cannot remove spool segment {}: {}".format(self._path(segment), e))
+
+    def oldest(self) -> Optional[int]:
+        with self._lock:
+            if not self._segments:
+                return None
+            if len(self._segments) == 1:
+                # nothing is appended to a segment once it is being replayed
+                self._writable = False
+            return self._segments[0]
+
+    def read(self, segment: int) -> List[Dict[str, Any]]:
+        with open(self._path(segment), 'rb') as f:
+            data = f.read()
+        docs: List[Dict[str, Any]] = []
+        pos: int = 0
+        while pos + 4 <= len(data):
+            length: int = struct.unpack_from('<i', data, pos)[0]
+            if length < 5 or pos + length > len(data):
+                # an incomplete write at the end, the batch was never confirmed
+                break
+            try:
+                docs.append(bson.decode(data[pos:pos + length]))
+            except InvalidBSON as e:
+                logging.warning("Invalid data in spool segment {}: {}".format(self._path(segment), e))
+                break
+            pos += length
+        return docs
+
+    def remove(self, segment: int) -> None:
+        with self._lock:
+            if segment in self._segments:
+                self._segments.remove(segment)
+                del self._sizes[segment]
+                self._remove(segment)
+                self._room.notify_all()
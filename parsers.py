@@ -1,21 +1,18 @@
-import ipaddress
 import json
 import logging
-import operator
 import re
-import dateutil.parser
 from datetime import datetime
 
-from matches import address_in_prefix
+from regex_tokens import required_literals
+from emit_plan import EmitPlan
+from enrichment import Enricher, country
 from outputters.output_abstract import AbstractOutput
-from util import DataSet, dns_translate, get_flag
+from util import dns_translate
 from time_parsers import parse_apache_timestamp, parse_syslog_timestamp, parse_iso_timestamp
 from abc import ABC
+from conditions import Compiled, compile_conditions, match_conditions, new_fields
 from dateutil.tz import tzoffset
-from local_ip import is_local_address
-from typing import List, Tuple, Dict, Union, Any
-
-data_conversion = DataSet()
+from typing import List, Optional, Tuple, Dict, Union, Any
 
 
 class LogParser(ABC):
@@ -33,6 +30,8 @@ class LogParser(ABC):
 
 
 class RegexParser(LogParser):
+    MAX_LITERALS: int = 3
+    MIN_LITERAL_LENGTH: int = 2
     _ip4_regex = '\\d+\\.\\d+\\.\\d+\\.\\d+'
     _ip6_regex = '(?:[a-fA-F0-9]{0,4}:){0,7}(?:[a-fA-F0-9]{0,4})'
     _patterns = {
@@ -63,21 +62,72 @@ class RegexParser(LogParser):
     }
 
     def __init__(self, reg_ex: str, format_str: Dict[str, str], transform: Dict[str, str], notify,
-                 notifiers, output: AbstractOutput, log_name) -> None:
+                 notifiers, output: AbstractOutput, log_name, enrich: Optional[Tuple[str, ...]] = None) -> None:
         super().__init__()
+        self._reg_ex: str = reg_ex
         self._pattern, self._filters = self.parse_regexp(reg_ex)
         # print(self._pattern)
         self._compiled_pattern = re.compile(self._pattern)
+        self._literals: List[str] = self._select_literals(required_literals(self._pattern))
+        self._literal_bytes: List[bytes] = [x.encode('utf-8') for x in self._literals]
         self._format_str: Dict[str, str] = format_str
         self._transform: Dict[str, str] = transform
         self._notify = notify
         self._notifiers = notifiers
         self._output: AbstractOutput = output
         self._log_name: str = log_name
+        # keys starting with ! are only kept when a notifier may want them
+        self._emit_plan: EmitPlan = EmitPlan(format_str, transform, self._filters,
+                                             any(x != {} for x in (notify or [])))
+        # geo, ASN and prefix fields added to every document, so the dashboard can group on them
+        self._enricher: Optional[Enricher] = Enricher(enrich) if enrich else None
+        # the conditions of every notifier are compiled once, with the cheap checks first
+        self._notify_conditions: List[Tuple[str, Compiled]] = [
+            (x['name'], compile_conditions(x['condition'], self._is_new)) for x in (notify or []) if x != {}]
+        # the output can load what it has seen of those fields before the first line is checked
+        if self._output is not None:
+            for field in sorted(set().union(*(new_fields(x['condition']) for x in (notify or []) if x != {}))):
+                self._output.watch_new(self._log_name, field)
 
     def __str__(self) -> str:
         return "{} : {}".format(self._pattern, self._format_str)
 
+    @property
+    def pattern(self) -> str:
+        return self._pattern
+
+    @property
+    def compiled_pattern(self) -> re.Pattern:
+        return self._compiled_pattern
+
+    @property
+    def spec(self) -> Tuple[str, Dict[str, str], Dict[str, str], Any, Optional[Tuple[str, ...]]]:
+        # what is needed to build the same parser in another process, without notifiers and output
+        return self._reg_ex, self._format_str, self._transform, self._notify, \
+            self._enricher.lookups if self._enricher is not None else None
+
+    @property
+    def literals(self) -> List[str]:
+        return self._literals
+
+    def _select_literals(self, literals: List[str]) -> List[str]:
+        # the longest strings are the rarest, checking a few of them is enough to throw out most lines
+        literals = sorted(set(x for x in literals if len(x) >= self.MIN_LITERAL_LENGTH), key=len, reverse=True)
+        return literals[:self.MAX_LITERALS]
+
+    def prefilter(self, line: str) -> bool:
+        for literal in self._literals:
+            if literal not in line:
+                return False
+        return True
+
+    def prefilter_bytes(self, data: bytearray, start: int, end: int) -> bool:
+        # same check on the raw line, so lines no parser wants are never decoded
+        for literal in self._literal_bytes:
+            if data.find(literal, start, end) < 0:
+                return False
+        return True
+
     def _find_pattern(self, pattern: str) -> Tuple[str, object]:
         if pattern in self._patterns:
             return self._patterns[pattern]
@@ -128,194 +178,59 @@ class RegexParser(LogParser):
                 logging.info('error {}'.format(e))
         return out, filters
 
-    def match(self, line: str) -> List[str]:
-        res = self._compiled_pattern.search(line)
+    def match(self, line: str, pos: int = 0) -> List[str]:
+        if not self.prefilter(line):
+            return []
+        res = self._compiled_pattern.search(line, pos)
         if res is None:
             return []
         #print(res.groups())
         return list(res.groups())
 
     def emit(self, matches: List[str], name: str) -> Dict[str, Union[datetime, int, str, float, bool]]:
-        res = {}
-        values = {}
-        for idx, val in self._filters.items():
-            try:
-                values[idx] = val[1](matches[val[0]])
-            except TypeError:
-                logging.info('Error: {} is not a {}'.format(matches[val[0]], val[1]))
+        output = self._emit_plan.emit(matches, name)
+        if self._enricher is not None:
+            self._enricher.enrich(output)
+        return output
 
-        for idx, val in self._format_str.items():
-            try:
-                val = self.parameter_expand(val)
-                rv = val.format(**values)
-                res[idx] = self._transform_value(rv, idx)
-            except KeyError:
-                continue
-        res['name'] = name
-        #print(res)
-        return res
+    def filter_output(self, output_dict: Dict[str, Any]) -> Dict[str, Any]:
+        # notify adds fields to its dict, so the written one needs to be a copy
+        if not self._emit_plan.keep_hidden:
+            return output_dict
+        return {key: val for key, val in output_dict.items() if not key.startswith('!')}
 
     def notify(self, output_dict: List[str], name: str) -> None:
-        # res = self.emit(matches, name)
-        for notifier in self._notify:
-            if notifier != {}:
-                if self._match_notify_conditions(output_dict, notifier['condition']):
-                    try:
-                        notifier = self._notifiers.get_notify(notifier['name'])
-                        handler = notifier['handler']
-                        if handler.do_convert_dns() and 'remote_host' not in output_dict:
-                            rv = dns_translate(output_dict['ip_address'])
-                            if rv:
-                                output_dict['remote_host'] = rv
-                        if handler.do_find_country() and 'country' not in output_dict:
-                            country_code, country_name = get_flag(output_dict['ip_address'])
-                            if country_name != '':
-                                output_dict['country'] = "{} ({})".format(country_name, country_code)
-                        formatting = handler.format
-                        if formatting == "text":
-                            msg = "".join(["{}: {}\n".format(x, y) for x, y in output_dict.items()])
-                        elif formatting == "json":
-                            msg = json.dumps({x: str(y) for x, y in output_dict.items()})
-                        else:
-                            raise ValueError("Unknown format {}".format(formatting))
-
-                        handler.send_msg(msg, self._log_name)
-                    except (KeyError, ValueError) as e:
-                        logging.warning("Can't send message: {}".format(str(e)))
-        return None
-
-    @staticmethod
-    def _get_operator(element: str) -> Tuple[str, Any]:
-        if element.startswith("<="):
-            val = element[2:]
-            op = operator.le
-        elif element.startswith(">="):
-            val = element[2:]
-            op = operator.ge
-        elif element.startswith(">"):
-            val = element[1:]
-            op = operator.gt
-        elif element.startswith("<"):
-            op = operator.lt
-            val = element[1:]
-        elif element.startswith("="):
-            val = element[1:]
-            op = operator.eq
-        elif element.startswith("!"):
-            val = element[1:]
-            op = operator.ne
-        else:
-            raise ValueError("Unknown operator: {}".format(element))
-        return val, op
-
-    def _compare(self, element: str, clause: Union[str, int]) -> bool:
-        val, op = self._get_operator(element)
-        try:
-            val = val.strip()
-            v = ipaddress.ip_address(val)
-            c = ipaddress.ip_network(clause)
-            if op == operator.ne:
-                return v not in c
-            elif op == operator.eq:
-                return v in c
-            else:
-                raise ValueError("Can't compare ipaddress")
-        except ValueError:
-            # not an IP address
-            pass
-        if (type(val) == int or val.isnumeric()) and (type(clause) == int or clause.isnumeric()):
-            return op(int(clause), int(val))
-        else:
-            return op(clause, val)
-
-    @staticmethod
-    def _compare_regex(elem: str, clause: Union[str, int]) -> bool:
-        return re.match(elem[1:], str(clause)) is not None
-
-    def _match_condition(self, elem: str, name: str, clause: str, matched_clause: str, res2: bool) -> bool:
-        if type(elem) == dict:
-            for k, v in elem.items():
-                if k.lower() == 'in':
-                    if type(v) == list:
-                        v = [str(t) for t in v]
-                        res2 = res2 and matched_clause in v
-                    elif address_in_prefix(matched_clause, v):
-                        res2 = res2 and True
+        for notifier_name, conditions in self._notify_conditions:
+            if match_conditions(conditions, output_dict):
+                try:
+                    notifier = self._notifiers.get_notify(notifier_name)
+                    handler = notifier['handler']
+                    if handler.do_convert_dns() and 'remote_host' not in output_dict:
+                        rv = dns_translate(output_dict['ip_address'])
+                        if rv:
+                            output_dict['remote_host'] = rv
+                    if handler.do_find_country() and 'country' not in output_dict:
+                        country_code, country_name = output_dict.get('country_code', None), \
+                            output_dict.get('country_name', '')
+                        if country_code is None:
+                            country_code, country_name = country(output_dict['ip_address'])
+                        if country_name != '':
+                            output_dict['country'] = "{} ({})".format(country_name, country_code)
+                    formatting = handler.format
+                    if formatting == "text":
+                        msg = "".join(["{}: {}\n".format(x, y) for x, y in output_dict.items()])
+                    elif formatting == "json":
+                        msg = json.dumps({x: str(y) for x, y in output_dict.items()})
                     else:
-                        logging.info("in expects a list or an IP address range")
-                        res2 = False
-                else:
-                    logging.info("Unknown operator {}".format(k))
-        elif elem == 'new':
-            if self._output.is_new(name, clause, matched_clause):
-                res2 = res2 and True
-            else:
-                res2 = False
-        elif elem == 'all' or elem == 'any':
-            res2 = res2 and True
-        elif elem == 'local':
-            try:
-                res2 = res2 and is_local_address(matched_clause)
-            except ValueError:
-                # only for IP addresses
-                res2 = False
-        elif elem == 'nonlocal':
-            try:
-                res2 = res2 and not is_local_address(matched_clause)
-            except ValueError:
-                # only for IP addresses
-                res2 = False
-        elif elem[0] in "=!<>":
-            res2 = res2 and self._compare(elem, matched_clause)
-        elif elem[0] in "~":
-            res2 = res2 and self._compare_regex(elem, matched_clause)
-        else:
-            res2 = False
-        return res2
-
-    def _match_notify_conditions(self, matches: Dict[str, str], conditions: List[Dict[str, List[str]]]) -> bool:
-        res: bool = False
-        for condition in conditions:
-            res2 = len(condition) > 0
-            for clause in condition:
-                if clause in matches:
-                    if type(condition[clause]) != list:
-                        condition[clause] = [condition[clause]]
-                    for elem in condition[clause]:
-                        res2 = self._match_condition(elem, matches['name'], clause, matches[clause], res2)
-            res = res or res2
-            if res:
-                return True
-        return False
+                        raise ValueError("Unknown format {}".format(formatting))
 
-    def _transform_value(self, rv: str, idx: str) -> Union[datetime, int, str, float, bool]:
-        if idx in self._transform:
-            if self._transform[idx] == 'date':
-                return dateutil.parser.isoparse(rv)
-            elif self._transform[idx] == 'int':
-                return int(rv)
-            elif self._transform[idx] == 'str':
-                return str(rv)
-            elif self._transform[idx] == 'float':
-                return float(rv)
-            elif self._transform[idx] == 'bool':
-                if rv.lower() == 'true':
-                    return True
-                elif rv.lower() == 'false':
-                    return False
-                else:
-                    raise ValueError("Unknown value {}".format(rv))
-            else:
-                raise ValueError("Unknown transform {}".format(self._transform[idx]))
-        return rv
+                    handler.send_msg(msg, self._log_name)
+                except (KeyError, ValueError) as e:
+                    logging.warning("Can't send message: {}".format(str(e)))
+        return None
 
-    @staticmethod
-    def parameter_expand(val: str) -> str:
-        matches = re.findall(r"([$]\w+)", val)
-        for m in matches:
-            val = val.replace(m, data_conversion.get(m, '-'))
-        # print(val)
-        return val
+    def _is_new(self, source: str, field: str, value: Any) -> bool:
+        return self._output.is_new(source, field, value)
 
 
 if __name__ == "__main__":
@@ -327,5 +242,5 @@ if __name__ == "__main__":
           'name': 'apache_access'}
     conds = [{'ip_address': ['new', "local"]}]  # , {'username': 'new'}]
 
-    xx = r._match_notify_conditions(rs, conds)
+    xx = match_conditions(compile_conditions(conds, r._is_new), rs)
     # print(xx)
@@ -0,0 +1,140 @@
+import ipaddress
+import socket
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+Network = Union[str, ipaddress.IPv4Network, ipaddress.IPv6Network]
+CACHE_SIZE: int = 4096
+
+
+def address_key(address: str) -> Tuple[int, int]:
+    # the version and the address as a number, without building an ip_address object
+    try:
+        if ':' in address:
+            return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+    except (OSError, TypeError):
+        raise ValueError("Not an IP address: {}".format(address))
+
+
+def _bounds(network: Network) -> Tuple[int, int, int]:
+    if isinstance(network, str):
+        # address/length is read directly, large lists would spend most of their loading time in ipaddress
+        address, _, length = network.strip().partition('/')
+        if length == '' or length.isdigit():
+            version, key = address_key(address)
+            bits = 32 if version == 4 else 128
+            prefix_len = int(length) if length else bits
+            if prefix_len > bits:
+                raise ValueError("Invalid prefix length: {}".format(network))
+            host = (1 << (bits - prefix_len)) - 1
+            return version, key & ~host, key | host
+    if not isinstance(network, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+        network = ipaddress.ip_network(str(network).strip(), strict=False)
+    return network.version, int(network.network_address), int(network.broadcast_address)
+
+
+class PrefixSet:
+    # the networks as sorted, merged intervals per IP version, an address is found with one bisect
+    def __init__(self, networks: Iterable[Network] = (), strict: bool = True) -> None:
+        intervals: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+        # without strict, what isn't a network is left out and counted
+        self.skipped: int = 0
+        for network in networks:
+            try:
+                version, start, end = _bounds(network)
+            except ValueError:
+                if strict:
+                    raise
+                self.skipped += 1
+                continue
+            intervals[version].append((start, end))
+        self._starts: Dict[int, List[int]] = {}
+        self._ends: Dict[int, List[int]] = {}
+        for version, ranges in intervals.items():
+            starts: List[int] = []
+            ends: List[int] = []
+            for start, end in sorted(ranges):
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self._starts[version] = starts
+            self._ends[version] = ends
+
+    def __len__(self) -> int:
+        return len(self._starts[4]) + len(self._starts[6])
+
+    def __contains__(self, address: str) -> bool:
+        version, key = address_key(address)
+        i = bisect_right(self._starts[version], key) - 1
+        return i >= 0 and key <= self._ends[version][i]
+
+
+class PrefixMap:
+    # the networks cut into disjoint intervals that each carry the value of the most specific network
+    # covering them, so a lookup is one bisect as well; of two equal networks the first one counts
+    def __init__(self, networks: Iterable[Tuple[Network, Any]] = ()) -> None:
+        by_version: Dict[int, List[Tuple[int, int, int, Any]]] = {4: [], 6: []}
+        for order, (network, value) in enumerate(networks):
+            try:
+                version, start, end = _bounds(network)
+            except ValueError:
+                continue
+            by_version[version].append((start, -end, order, value))
+        self._starts: Dict[int, List[int]] = {}
+        self._segments: Dict[int, List[Tuple[int, Any]]] = {}
+        for version, entries in by_version.items():
+            self._starts[version], self._segments[version] = self._flatten(entries)
+
+    @staticmethod
+    def _flatten(entries: List[Tuple[int, int, int, Any]]) -> Tuple[List[int], List[Tuple[int, Any]]]:
+        # networks are either nested or apart, sorted outer before inner they are walked with a stack
+        starts: List[int] = []
+        segments: List[Tuple[int, Any]] = []
+        stack: List[Tuple[int, int, Any]] = []
+        pos: int = 0
+        for start, neg_end, _order, value in sorted(entries, key=lambda x: x[:3]):
+            end = -neg_end
+            while stack and stack[-1][1] < start:
+                top = stack.pop()
+                if pos <= top[1]:
+                    starts.append(pos)
+                    segments.append((top[1], top[2]))
+                pos = top[1] + 1
+            if stack and stack[-1][0] == start and stack[-1][1] == end:
+                continue
+            if stack and pos < start:
+                starts.append(pos)
+                segments.append((start - 1, stack[-1][2]))
+            stack.append((start, end, value))
+            pos = start
+        while stack:
+            top = stack.pop()
+            if pos <= top[1]:
+                starts.append(pos)
+                segments.append((top[1], top[2]))
+            pos = top[1] + 1
+        return starts, segments
+
+    def get(self, address: str, default: Any = None) -> Any:
+        version, key = address_key(address)
+        i = bisect_right(self._starts[version], key) - 1
+        if i >= 0 and key <= self._segments[version][i][0]:
+            return self._segments[version][i][1]
+        return default
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def prefix_set(networks: Union[str, Tuple[str, ...]]) -> PrefixSet:
+    # prefixes from the configuration are compiled once
+    return PrefixSet([networks] if type(networks) == str else networks)
+
+
+def address_in_prefix(address: str, prefix: str) -> bool:
+    try:
+        return address.strip() in prefix_set(prefix.strip())
+    except (ValueError, AttributeError):
+        return False
@@ -0,0 +1,117 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+_quantifier_regex = re.compile(r'(?:[*+?]|{\d+(?:,\d*)?}|{,\d+})[?+]?')
+_long_escapes: Dict[str, int] = {'x': 2, 'u': 4, 'U': 8}
+_metachars: str = '.^$'
+
+
+def _skip_class(pattern: str, pos: int) -> int:
+    pos += 1
+    if pattern[pos:pos + 1] == '^':
+        pos += 1
+    if pattern[pos:pos + 1] == ']':
+        pos += 1
+    while pos < len(pattern) and pattern[pos] != ']':
+        pos += 2 if pattern[pos] == '\\' else 1
+    if pos >= len(pattern):
+        raise ValueError('missing closing bracket')
+    return pos + 1
+
+
+def _split_atoms(pattern: str) -> List[Tuple[str, str]]:
+    # split a regex into top level atoms and their quantifiers
+    tokens: List[Tuple[str, str]] = []
+    pos: int = 0
+    while pos < len(pattern):
+        start: int = pos
+        c: str = pattern[pos]
+        if c == '\\':
+            pos += 2
+            esc: str = pattern[pos - 1:pos]
+            if esc.isdigit():
+                raise ValueError('back reference or octal escape in {}'.format(pattern))
+            if esc in _long_escapes:
+                pos += _long_escapes[esc]
+            elif esc == 'N':
+                pos = pattern.index('}', pos) + 1
+        elif c == '[':
+            pos = _skip_class(pattern, pos)
+        elif c == '(':
+            if pattern.startswith('(?P=', pos):
+                raise ValueError('back reference in {}'.format(pattern))
+            depth: int = 0
+            while True:
+                if pos >= len(pattern):
+                    raise ValueError('missing closing parenthesis')
+                if pattern[pos] == '\\':
+                    pos += 2
+                    continue
+                if pattern[pos] == '[':
+                    pos = _skip_class(pattern, pos)
+                    continue
+                if pattern[pos] == '(':
+                    depth += 1
+                elif pattern[pos] == ')':
+                    depth -= 1
+                    if depth == 0:
+                        pos += 1
+                        break
+                pos += 1
+        elif c == '|':
+            # top level alternatives can't be split up, grouped they stay one alternative when spliced in
+            return [('(?:' + pattern + ')', '')]
+        else:
+            pos += 1
+        q = _quantifier_regex.match(pattern, pos)
+        if q is not None:
+            tokens.append((pattern[start:pos], q.group()))
+            pos = q.end()
+        else:
+            tokens.append((pattern[start:pos], ''))
+    return tokens
+
+
+def tokenize(pattern: str) -> List[str]:
+    return [atom + quantifier for atom, quantifier in _split_atoms(pattern)]
+
+
+def _literal_char(atom: str) -> Optional[str]:
+    if len(atom) == 1 and atom not in _metachars:
+        return atom
+    if len(atom) == 2 and atom[0] == '\\' and not atom[1].isalnum():
+        return atom[1]
+    if atom[:1] == '[' and atom[1:2] != '^':
+        # a class with a single character like [(] or [.]
+        inner = atom[1:-1]
+        if len(inner) == 1 and inner not in '\\]':
+            return inner
+        if len(inner) == 2 and inner[0] == '\\' and not inner[1].isalnum():
+            return inner[1]
+    return None
+
+
+def required_literals(pattern: str) -> List[str]:
+    # the fixed strings any match of the pattern must contain, taken from the top level of the regex only
+    try:
+        if re.compile(pattern).flags & re.IGNORECASE:
+            return []
+        tokens = _split_atoms(pattern)
+    except (ValueError, re.error):
+        return []
+    literals: List[str] = []
+    run: str = ''
+    for atom, quantifier in tokens:
+        c = _literal_char(atom)
+        if c is not None and quantifier == '':
+            run += c
+            continue
+        if c is not None and (quantifier[0] == '+' or re.match(r'{[1-9]', quantifier)):
+            # the character is there at least once, but what follows may be more of the same
+            run += c
+        if run:
+            literals.append(run)
+        run = ''
+    if run:
+        literals.append(run)
+    return literals
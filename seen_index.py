@@ -0,0 +1,254 @@
+import datetime
+import hashlib
+import logging
+import math
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self._capacity: int = max(1, capacity)
+        self._bits: int = max(8, int(-self._capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self._hashes: int = max(1, round(self._bits / self._capacity * math.log(2)))
+        self._data = bytearray((self._bits + 7) // 8)
+        self._count: int = 0
+
+    def _positions(self, value: str) -> Iterable[int]:
+        # two hashes from one digest, combined into as many as needed
+        digest = hashlib.blake2b(value.encode('utf-8', 'replace'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self._bits for i in range(self._hashes))
+
+    def add(self, value: str) -> None:
+        for pos in self._positions(value):
+            self._data[pos >> 3] |= 1 << (pos & 7)
+        self._count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self._data[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def full(self) -> bool:
+        return self._count >= self._capacity
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def memory(self) -> int:
+        return len(self._data)
+
+
+def _utc(ts: datetime.datetime) -> datetime.datetime:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+class SeenValues:
+    # bytes per value in a dict of short strings and when they were last seen, including the hash table overhead
+    ENTRY_SIZE: int = 150
+    ERROR_RATE: float = 0.001
+
+    def __init__(self) -> None:
+        # value -> last seen, as naive UTC like the database returns it; values without a time never expire
+        self._values: Optional[Dict[str, datetime.datetime]] = {}
+        self._memory: int = 0
+        # a chain of filters that double in size, so the error rate stays put as values keep coming
+        self._filters: List[BloomFilter] = []
+
+    def add(self, value: str, seen: Optional[datetime.datetime]) -> None:
+        seen = datetime.datetime.max if seen is None else _utc(seen)
+        if self._values is not None:
+            last = self._values.get(value, None)
+            if last is None:
+                self._values[value] = seen
+                self._memory += len(value) + self.ENTRY_SIZE
+            elif seen > last:
+                self._values[value] = seen
+        elif value not in self:
+            if self._filters[-1].full():
+                self._filters.append(BloomFilter(self._filters[-1].capacity * 2, self.ERROR_RATE))
+            self._filters[-1].add(value)
+
+    def __contains__(self, value: str) -> bool:
+        if self._values is not None:
+            return value in self._values
+        return any(value in f for f in self._filters)
+
+    def exact(self) -> bool:
+        return self._values is not None
+
+    def count(self) -> int:
+        if self._values is not None:
+            return len(self._values)
+        return sum(f.count for f in self._filters)
+
+    def memory(self) -> int:
+        if self._values is not None:
+            return self._memory
+        return sum(f.memory() for f in self._filters)
+
+    def prune(self, upper_limit: datetime.datetime) -> bool:
+        # forgets the values last seen up to upper_limit, a bloom filter can't and has to be loaded again
+        if self._values is None:
+            return False
+        expired = [k for k, v in self._values.items() if v <= upper_limit]
+        for value in expired:
+            del self._values[value]
+            self._memory -= len(value) + self.ENTRY_SIZE
+        return True
+
+    def to_bloom(self) -> None:
+        if self._values is None:
+            return
+        bloom = BloomFilter(len(self._values) * 2, self.ERROR_RATE)
+        for value in self._values:
+            bloom.add(value)
+        self._filters = [bloom]
+        self._values = None
+
+
+class SeenIndex:
+    DEFAULT_MEMORY: int = 64 * 1024 * 1024
+    LOAD_BATCH_SIZE: int = 10000
+    RETRY_INTERVAL: float = 60
+
+    def __init__(self, load: Callable[[str, str], Iterable[Tuple[Any, Optional[datetime.datetime]]]],
+                 max_memory: int = DEFAULT_MEMORY) -> None:
+        # load(source, field) returns every value of field already stored for source, with when it was last seen
+        self._load = load
+        self._max_memory: int = max_memory
+        self._lock = threading.Lock()
+        self._index: Dict[Tuple[str, str], SeenValues] = {}
+        self._fields: Dict[str, List[str]] = {}
+        # the values are loaded by a thread of their own, until then is_new has no answer for them
+        self._ready: Set[Tuple[str, str]] = set()
+        # sets being loaded, they get everything written meanwhile as well
+        self._loading: Dict[Tuple[str, str], SeenValues] = {}
+        self._queued: Set[Tuple[str, str]] = set()
+        self._queue: queue.Queue = queue.Queue()
+        self._loader: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._loader is None:
+            self._loader = threading.Thread(target=self._load_queued, name="seen-index")
+            self._loader.daemon = True
+            self._loader.start()
+
+    def watch(self, source: str, field: str) -> None:
+        key = (source, field)
+        with self._lock:
+            if key in self._index:
+                return
+            self._index[key] = SeenValues()
+            self._fields.setdefault(source, []).append(field)
+        self._enqueue(key)
+
+    def _enqueue(self, key: Tuple[str, str]) -> None:
+        with self._lock:
+            if key in self._queued:
+                return
+            self._queued.add(key)
+            # from now on, also while a failed load waits for its retry, what is written goes into the new set too
+            self._loading.setdefault(key, SeenValues())
+        self._queue.put(key)
+
+    def _load_queued(self) -> None:
+        while True:
+            key = self._queue.get()
+            try:
+                self._warm(key)
+            except Exception as e:
+                logging.warning("Cannot load the seen values of {} for {}, retrying in {}s: {}".format(
+                    key[1], key[0], self.RETRY_INTERVAL, e))
+                with self._lock:
+                    self._queued.discard(key)
+                threading.Timer(self.RETRY_INTERVAL, self._enqueue, (key,)).start()
+
+    def _warm(self, key: Tuple[str, str]) -> None:
+        with self._lock:
+            values = self._loading[key]
+        batch: List[Tuple[Any, Optional[datetime.datetime]]] = []
+        for item in self._load(*key):
+            batch.append(item)
+            if len(batch) >= self.LOAD_BATCH_SIZE:
+                self._add_loaded(values, batch)
+                batch = []
+        self._add_loaded(values, batch)
+        with self._lock:
+            # replaces what answered while this was loaded, if anything
+            self._index[key] = values
+            del self._loading[key]
+            self._queued.discard(key)
+            self._ready.add(key)
+            self._check_memory()
+        logging.debug("Loaded {} values of {} for {}".format(values.count(), key[1], key[0]))
+
+    def _add_loaded(self, values: SeenValues, batch: List[Tuple[Any, Optional[datetime.datetime]]]) -> None:
+        with self._lock:
+            for value, seen in batch:
+                if value is not None:
+                    values.add(str(value), seen)
+            self._check_memory()
+
+    def is_new(self, source: str, field: str, value: Any) -> Optional[bool]:
+        # None while the values are not loaded yet
+        key = (source, field)
+        with self._lock:
+            if key in self._ready:
+                return str(value) not in self._index[key]
+        self.watch(source, field)
+        return None
+
+    def add(self, data: Dict[str, Any]) -> None:
+        fields = self._fields.get(data.get('name', None), None)
+        if not fields:
+            return
+        seen = data.get('timestamp', None)
+        if not isinstance(seen, datetime.datetime):
+            seen = None
+        with self._lock:
+            for field in fields:
+                value = data.get(field, None)
+                if value is not None:
+                    key = (data['name'], field)
+                    self._index[key].add(str(value), seen)
+                    if key in self._loading:
+                        self._loading[key].add(str(value), seen)
+            self._check_memory()
+
+    def prune(self, source: str, upper_limit: datetime.datetime) -> None:
+        # after old data was removed from the database, the values only it had are new again
+        reload: List[Tuple[str, str]] = []
+        with self._lock:
+            for field in self._fields.get(source, []):
+                key = (source, field)
+                if key in self._ready and not self._index[key].prune(upper_limit):
+                    reload.append(key)
+        for key in reload:
+            # the bloom filter keeps answering until the new one is loaded
+            self._enqueue(key)
+
+    def _check_memory(self) -> None:
+        # the biggest exact sets give way to bloom filters first
+        sets = list(self._index.items()) + list(self._loading.items())
+        while sum(x.memory() for _, x in sets) > self._max_memory:
+            exact = [(k, v) for k, v in sets if v.exact()]
+            if not exact:
+                break
+            key, values = max(exact, key=lambda x: x[1].memory())
+            logging.info("Seen values of {} for {} exceed the memory limit, using a bloom filter".format(key[1], key[0]))
+            values.to_bloom()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"{}.{}".format(*k): {'count': v.count(), 'memory': v.memory(), 'exact': v.exact(),
+                                         'ready': k in self._ready}
+                    for k, v in self._index.items()}
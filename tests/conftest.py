@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the analyser are imported from the top of the repository, as the collector does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,126 @@
+import os
+from typing import Any, Dict, List
+
+import pytest
+from watchdog.events import FileModifiedEvent, FileMovedEvent
+
+from filehandler import FileHandler
+from multi_matcher import MultiMatcher
+from outputters.output_abstract import AbstractOutput
+from parsers import RegexParser
+
+
+class MemoryOutput(AbstractOutput):
+    # keeps what it commits, a failing commit keeps the buffer like the mongo output without a spool
+    def __init__(self) -> None:
+        super().__init__({'buffer_size': 1000, 'name': 'memory', 'type': 'memory'})
+        self.committed: List[Dict[str, Any]] = []
+        self.fail: bool = False
+
+    def connect(self) -> None:
+        pass
+
+    def commit(self) -> None:
+        if self.fail:
+            return
+        with self._lock:
+            self.committed.extend(self.buffer())
+            self.clear_buffer()
+
+
+def write_lines(path: str, numbers, mode: str = 'a') -> None:
+    with open(path, mode) as f:
+        for n in numbers:
+            f.write("line {}\n".format(n))
+
+
+def offset_of(path: str, n: int) -> int:
+    with open(path, 'rb') as f:
+        return f.read().index("line {}\n".format(n).encode())
+
+
+def handler(path: str, output: MemoryOutput, pos: int = 0, inode=None, dev=None) -> FileHandler:
+    if inode is None:
+        stat_info = os.stat(path)
+        inode, dev = stat_info.st_ino, stat_info.st_dev
+    parser = RegexParser("line (%NUM:n)", {"n": "{n}"}, {"n": "int"}, [], None, output, 'test')
+    return FileHandler(path, pos, MultiMatcher([parser]), inode, dev, output, 'test', 1)
+
+
+def numbers(output: MemoryOutput) -> List[int]:
+    return [x['n'] for x in output.committed]
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    path = str(tmp_path / 'test.log')
+    write_lines(path, range(10), 'w')
+    return path
+
+
+def test_checkpoint_after_commit(log_file):
+    output = MemoryOutput()
+    fh = handler(log_file, output)
+    output.flush()
+    assert numbers(output) == list(range(10))
+    assert fh.dump_state()['pos'] == os.path.getsize(log_file)
+
+
+def test_failed_commit_keeps_checkpoint(log_file):
+    output = MemoryOutput()
+    fh = handler(log_file, output)
+    output.flush()
+    committed_size = os.path.getsize(log_file)
+    write_lines(log_file, range(10, 20))
+    output.fail = True
+    fh.on_modified(FileModifiedEvent(log_file))
+    output.flush()
+    # read up to the end, but the state points at the first line that is not committed
+    state = fh.dump_state()
+    assert state['pos'] == committed_size == offset_of(log_file, 10)
+    assert state['inode'] == os.stat(log_file).st_ino
+    output.fail = False
+    output.flush()
+    assert numbers(output) == list(range(20))
+    assert fh.dump_state()['pos'] == os.path.getsize(log_file)
+
+
+def test_restart_after_failed_commit(log_file):
+    output = MemoryOutput()
+    output.fail = True
+    fh = handler(log_file, output)
+    output.flush()
+    state = fh.dump_state()
+    assert state['pos'] == 0
+    # a restart reads everything that was not committed again
+    restarted = MemoryOutput()
+    handler(log_file, restarted, state['pos'], state['inode'], state['device'])
+    restarted.flush()
+    assert numbers(restarted) == list(range(10))
+
+
+def test_restart_after_rotation_resumes_old_inode(log_file):
+    output = MemoryOutput()
+    fh = handler(log_file, output)
+    output.flush()
+    old_inode = os.stat(log_file).st_ino
+    write_lines(log_file, range(10, 15))
+    output.fail = True
+    rotated = log_file + '.1'
+    os.rename(log_file, rotated)
+    write_lines(log_file, range(100, 105), 'w')
+    fh.on_moved(FileMovedEvent(log_file, rotated))
+    output.flush()
+    # the rest of the rotated file is read but not committed, the state stays on the old file
+    state = fh.dump_state()
+    assert state['inode'] == old_inode
+    assert state['pos'] == offset_of(rotated, 10)
+    assert state['path'] == log_file
+    # after a restart the rotated file is found by its inode and read from there, then the new one
+    restarted = MemoryOutput()
+    fh = handler(log_file, restarted, state['pos'], state['inode'], state['device'])
+    restarted.flush()
+    assert numbers(restarted) == list(range(10, 15)) + list(range(100, 105))
+    state = fh.dump_state()
+    assert state['inode'] == os.stat(log_file).st_ino
+    assert state['pos'] == os.path.getsize(log_file)
@@ -0,0 +1,215 @@
+import copy
+import ipaddress
+import logging
+import operator
+import random
+import re
+from typing import Any, Dict, List, Tuple, Union
+
+import pytest
+
+from conditions import compile_conditions, match_conditions
+from local_ip import is_local_address
+from prefix_set import address_in_prefix
+
+SEED = 20231201
+ROUNDS = 3000
+FIELDS = ['ip_address', 'username', 'code', 'port']
+ADDRESSES = ['1.2.3.4', '10.0.0.1', '10.1.2.3', '192.168.1.10', '8.8.8.8', '127.0.0.1', '2001:db8::1', '::1',
+             'fe80::1']
+NETWORKS = ['10.0.0.0/8', '1.2.3.0/24', '192.168.0.0/16', '2001:db8::/32', '0.0.0.0/0']
+WORDS = ['root', 'bob', 'alice', 'admin', '', 'Root', 'bob2']
+NUMBERS = ['0', '22', '200', '302', '404', '4444', '65535']
+
+
+class OldEvaluator:
+    # the notify conditions as RegexParser evaluated them before they were compiled, kept to compare with
+    def __init__(self, new_values: Dict[Tuple[str, str], bool]) -> None:
+        self._new_values = new_values
+
+    def is_new(self, source: str, field: str, value: Any) -> bool:
+        return self._new_values.get((field, str(value)), False)
+
+    @staticmethod
+    def _get_operator(element: str) -> Tuple[str, Any]:
+        if element.startswith("<="):
+            val = element[2:]
+            op = operator.le
+        elif element.startswith(">="):
+            val = element[2:]
+            op = operator.ge
+        elif element.startswith(">"):
+            val = element[1:]
+            op = operator.gt
+        elif element.startswith("<"):
+            op = operator.lt
+            val = element[1:]
+        elif element.startswith("="):
+            val = element[1:]
+            op = operator.eq
+        elif element.startswith("!"):
+            val = element[1:]
+            op = operator.ne
+        else:
+            raise ValueError("Unknown operator: {}".format(element))
+        return val, op
+
+    def _compare(self, element: str, clause: Union[str, int]) -> bool:
+        val, op = self._get_operator(element)
+        try:
+            val = val.strip()
+            v = ipaddress.ip_address(val)
+            c = ipaddress.ip_network(clause)
+            if op == operator.ne:
+                return v not in c
+            elif op == operator.eq:
+                return v in c
+            else:
+                raise ValueError("Can't compare ipaddress")
+        except ValueError:
+            # not an IP address
+            pass
+        if (type(val) == int or val.isnumeric()) and (type(clause) == int or clause.isnumeric()):
+            return op(int(clause), int(val))
+        else:
+            return op(clause, val)
+
+    @staticmethod
+    def _compare_regex(elem: str, clause: Union[str, int]) -> bool:
+        return re.match(elem[1:], str(clause)) is not None
+
+    def _match_condition(self, elem: str, name: str, clause: str, matched_clause: str, res2: bool) -> bool:
+        if type(elem) == dict:
+            for k, v in elem.items():
+                if k.lower() == 'in':
+                    if type(v) == list:
+                        v = [str(t) for t in v]
+                        res2 = res2 and matched_clause in v
+                    elif address_in_prefix(matched_clause, v):
+                        res2 = res2 and True
+                    else:
+                        logging.info("in expects a list or an IP address range")
+                        res2 = False
+                else:
+                    logging.info("Unknown operator {}".format(k))
+        elif elem == 'new':
+            if self.is_new(name, clause, matched_clause):
+                res2 = res2 and True
+            else:
+                res2 = False
+        elif elem == 'all' or elem == 'any':
+            res2 = res2 and True
+        elif elem == 'local':
+            try:
+                res2 = res2 and is_local_address(matched_clause)
+            except ValueError:
+                # only for IP addresses
+                res2 = False
+        elif elem == 'nonlocal':
+            try:
+                res2 = res2 and not is_local_address(matched_clause)
+            except ValueError:
+                # only for IP addresses
+                res2 = False
+        elif elem[0] in "=!<>":
+            res2 = res2 and self._compare(elem, matched_clause)
+        elif elem[0] in "~":
+            res2 = res2 and self._compare_regex(elem, matched_clause)
+        else:
+            res2 = False
+        return res2
+
+    def match(self, matches: Dict[str, str], conditions: List[Dict[str, List[str]]]) -> bool:
+        res: bool = False
+        for condition in conditions:
+            res2 = len(condition) > 0
+            for clause in condition:
+                if clause in matches:
+                    if type(condition[clause]) != list:
+                        condition[clause] = [condition[clause]]
+                    for elem in condition[clause]:
+                        res2 = self._match_condition(elem, matches['name'], clause, matches[clause], res2)
+            res = res or res2
+            if res:
+                return True
+        return False
+
+
+def random_value(rnd: random.Random, field: str) -> Any:
+    if field == 'ip_address':
+        return rnd.choice(ADDRESSES + NETWORKS)
+    if field == 'username':
+        return rnd.choice(WORDS)
+    # transformed to int or left as text
+    value = rnd.choice(NUMBERS)
+    return int(value) if rnd.random() < 0.3 else value
+
+
+def random_element(rnd: random.Random, field: str) -> Any:
+    kind = rnd.randrange(9)
+    if kind == 0:
+        return rnd.choice(['new', 'all', 'any', 'local', 'nonlocal', 'unknown'])
+    if kind == 1:
+        return {'in': rnd.sample(ADDRESSES + WORDS + NUMBERS + [int(x) for x in NUMBERS], rnd.randint(0, 4))}
+    if kind == 2:
+        return {'in': rnd.choice(NETWORKS + ['not a network'])}
+    if kind == 3:
+        return '~' + rnd.choice(['10\\.', '.*8$', 'ro', '[ab]', '2', '.*', '::'])
+    if kind in (4, 5):
+        return rnd.choice(['=', '!']) + rnd.choice([' ', '']) + rnd.choice(ADDRESSES + WORDS + NUMBERS)
+    return rnd.choice(['<', '>', '<=', '>=', '=', '!']) + rnd.choice(NUMBERS if field in ('code', 'port') else
+                                                                         NUMBERS + WORDS)
+
+
+def random_conditions(rnd: random.Random) -> List[Dict[str, Any]]:
+    conditions = []
+    for _ in range(rnd.randint(0, 3)):
+        condition: Dict[str, Any] = {}
+        for field in rnd.sample(FIELDS + ['missing'], rnd.randint(0, 3)):
+            elements = [random_element(rnd, field) for _ in range(rnd.randint(1, 3))]
+            condition[field] = elements if len(elements) > 1 or rnd.random() < 0.5 else elements[0]
+        conditions.append(condition)
+    return conditions
+
+
+def random_doc(rnd: random.Random) -> Dict[str, Any]:
+    doc = {'name': rnd.choice(['auth_ssh', 'apache_access'])}
+    for field in rnd.sample(FIELDS, rnd.randint(1, len(FIELDS))):
+        doc[field] = random_value(rnd, field)
+    return doc
+
+
+def test_compiled_conditions_match_old_evaluator() -> None:
+    rnd = random.Random(SEED)
+    compared = 0
+    for _ in range(ROUNDS):
+        conditions = random_conditions(rnd)
+        new_values = {(f, str(v)): rnd.random() < 0.5 for f in FIELDS for v in ADDRESSES + WORDS + NUMBERS}
+        old = OldEvaluator(new_values)
+        compiled = compile_conditions(copy.deepcopy(conditions), old.is_new)
+        for _ in range(5):
+            doc = random_doc(rnd)
+            try:
+                expected = old.match(doc, copy.deepcopy(conditions))
+            except TypeError:
+                # the old evaluator raised comparing text with a number, the compiled one doesn't match
+                assert not match_conditions(compiled, doc)
+                continue
+            assert match_conditions(compiled, doc) == expected, (conditions, doc)
+            compared += 1
+    assert compared > ROUNDS
+
+
+@pytest.mark.parametrize('conditions, doc, expected', [
+    ([{'ip_address': '=10.0.0.1'}], {'name': 'auth_ssh', 'ip_address': '10.0.0.0/8'}, True),
+    ([{'ip_address': '!10.0.0.1'}], {'name': 'auth_ssh', 'ip_address': '1.2.3.0/24'}, True),
+    ([{'code': '>=400'}], {'name': 'apache_access', 'code': 404}, True),
+    ([{'code': '>=400'}], {'name': 'apache_access', 'code': '302'}, False),
+    ([{}], {'name': 'auth_ssh', 'username': 'root'}, False),
+    ([{'missing': '=x'}], {'name': 'auth_ssh', 'username': 'root'}, True),
+    ([{'username': ['~ro', 'new']}], {'name': 'auth_ssh', 'username': 'root'}, True),
+])
+def test_examples(conditions: List[Dict[str, Any]], doc: Dict[str, Any], expected: bool) -> None:
+    old = OldEvaluator({('username', 'root'): True})
+    assert old.match(doc, copy.deepcopy(conditions)) == expected
+    assert match_conditions(compile_conditions(conditions, old.is_new), doc) == expected
@@ -0,0 +1,90 @@
+import json
+import os
+import re
+from typing import Dict, List
+
+import pytest
+
+from multi_matcher import MultiMatcher
+from parsers import RegexParser
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'loganalyser.config.default')
+TS = "Dec  1 23:17:58"
+LINES = [
+    TS + " host sshd[4321]: Accepted publickey for bob from 10.0.0.1 port 51234 ssh2",
+    TS + " host sshd[4321]: Accepted password for alice from 2001:db8::1 port 22 ssh2",
+    TS + " host sshd[4321]: Failed password for invalid user admin from 1.2.3.4 port 4444 ssh2",
+    TS + " host sshd[4321]: Failed password for root from 1.2.3.4 port 4444 ssh2",
+    TS + " host sshd[4321]: Disconnected from user bob 10.0.0.1 port 51234",
+    TS + " host sshd[4321]: Accepted publickey for bob from 10.0.0.1 port 51234 ssh2: Failed password for "
+         "root from 1.2.3.4 port 4444 ssh2",
+    TS + " host CRON[1234]: pam_unix(cron:session): session opened for user root by (uid=0)",
+    TS + " host systemd[1]: Started Session 42 of user bob.",
+    '1.2.3.4 - - [01/Dec/2023:23:17:58 +0100] "GET /index.html HTTP/1.1" 200 1234',
+    '10.0.0.1 - bob [01/Dec/2023:23:17:58 +0100] "POST /login HTTP/2.0" 302 0',
+    '1.2.3.4 - - [01/Dec/2023:23:17:58 +0100] "GET / HTTP/1.1" 400 -',
+    TS + " news simpleproxy[99]: Connect from 1.2.3.4 (1.2.3.4:5555->news.example.com:119)",
+    TS + " news simpleproxy[99]: Connect from 1.2.3.4 (1.2.3.4:5555->news.example.com:119) closed. Up: 10 "
+         "bytes, Down: 2000 bytes",
+    TS + " news simpleproxy[99]: Connect from 1.2.3.4 (host.example.com:5555->10.0.0.2:563)",
+    "",
+    "garbage",
+]
+
+
+def default_filters() -> Dict[str, List[str]]:
+    # the default configuration is not strict JSON, so only the regexes are taken out of it, per log file
+    with open(DEFAULT_CONFIG, 'r') as infile:
+        text = infile.read()
+    filters: Dict[str, List[str]] = {}
+    for block in re.split(r'"path":\s*"/', text)[1:]:
+        name = json.loads(re.search(r'"name":\s*("(?:[^"\\]|\\.)*")', block).group(1))
+        filters[name] = [json.loads(x) for x in re.findall(r'"regex":\s*("(?:[^"\\]|\\.)*")', block)]
+    return filters
+
+
+def search_each(parsers: List[RegexParser], line: str):
+    res = []
+    for p in parsers:
+        m = p.compiled_pattern.search(line)
+        if m is not None:
+            res.append((p, list(m.groups())))
+    return res
+
+
+def test_default_filters_found():
+    filters = default_filters()
+    assert set(filters) >= {'auth_ssh', 'apache_access', 'nntp_proxy'}
+    assert all(filters.values())
+
+
+@pytest.mark.parametrize('name', sorted(default_filters()))
+def test_same_as_search_per_parser(name):
+    parsers = [RegexParser(x, {}, {}, [], None, None, name) for x in default_filters()[name]]
+    matcher = MultiMatcher(parsers)
+    for line in LINES:
+        assert matcher.match(line) == search_each(parsers, line), line
+
+
+def test_same_as_search_all_default_filters():
+    # all filters in one matcher, so patterns with and without a common prefix are combined
+    parsers = [RegexParser(x, {}, {}, [], None, None, 'all') for filters in default_filters().values()
+               for x in filters]
+    matcher = MultiMatcher(parsers)
+    assert matcher._combined is not None
+    matched = 0
+    for line in LINES:
+        res = matcher.match(line)
+        assert res == search_each(parsers, line), line
+        matched += len(res)
+    assert matched >= 10
+
+
+def test_top_level_alternatives():
+    # the alternatives of the first pattern stay together behind its marker group
+    parsers = [RegexParser(x, {}, {}, [], None, None, 'alt') for x in ['foo (%NUM:a)|bar (%NUM:b)', 'baz (%NUM:c)']]
+    matcher = MultiMatcher(parsers)
+    assert matcher._combined is not None
+    for line in ['foo 1 baz 2', 'bar 3 baz 4', 'baz 5 foo 6', 'baz 7', 'bar 8']:
+        assert matcher.match(line) == search_each(parsers, line), line
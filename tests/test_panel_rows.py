@@ -0,0 +1,84 @@
+import os
+import sys
+from typing import Any, Dict, List
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'html'))
+
+import apache_data
+import nntp_proxy_data
+
+EVENTS = [
+    {'name': 'apache_access', 'ip_address': '1.2.3.4', 'hostname': 'www', 'username': '-', 'code': '200',
+     'size': 100, 'prefix': '1.2.3.0/24', 'country_code': 'nl', 'country_name': 'Netherlands'},
+    {'name': 'apache_access', 'ip_address': '1.2.3.4', 'hostname': 'www', 'username': '-', 'code': '404',
+     'size': 50, 'prefix': '1.2.3.0/24', 'country_code': 'nl', 'country_name': 'Netherlands'},
+    # written before the file was enriched
+    {'name': 'apache_access', 'ip_address': '10.0.0.1', 'hostname': 'www', 'username': 'bob', 'code': '200',
+     'size': 10},
+    {'name': 'nntp_proxy', 'ip_address': '1.2.3.4', 'hostname': 'news', 'port': 5555, 'dest_port': 119,
+     'up_size': 10, 'down_size': 2000, 'prefix': '1.2.3.0/24', 'country_code': 'nl', 'country_name': 'Netherlands'},
+    {'name': 'nntp_proxy', 'ip_address': '10.0.0.1', 'hostname': 'news', 'port': 5556, 'dest_port': 563,
+     'up_size': 5, 'down_size': 50},
+]
+
+
+def _value(expression: Any, doc: Dict[str, Any]) -> Any:
+    if type(expression) == str and expression.startswith('$'):
+        return doc.get(expression[1:], None)
+    if type(expression) == dict:
+        return {k: _value(v, doc) for k, v in expression.items()}
+    return expression
+
+
+def fake_aggregate(pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # the $match of the first stage is only checked for the source, the $group accumulators the panels use are
+    # computed as the database would
+    source = pipeline[0]['$match']['$and'][0]['name']
+    docs = [x for x in EVENTS if x['name'] == source]
+    group = next(x['$group'] for x in pipeline if '$group' in x)
+    rows: Dict[Any, Dict[str, Any]] = {}
+    for doc in docs:
+        _id = _value(group['_id'], doc)
+        row = rows.setdefault(repr(_id), {'_id': _id})
+        for field, accumulator in group.items():
+            if field == '_id':
+                continue
+            (op, expression), = accumulator.items()
+            value = _value(expression, doc)
+            if op == '$sum':
+                row[field] = row.get(field, 0) + (value if type(value) == int else 0)
+            elif op == '$max':
+                if value is not None and (row.get(field, None) is None or value > row[field]):
+                    row[field] = value
+                row.setdefault(field, None)
+            elif op == '$addToSet':
+                row.setdefault(field, [])
+                if value is not None and value not in row[field]:
+                    row[field].append(value)
+            else:
+                raise NotImplementedError(op)
+    return list(rows.values())
+
+
+@pytest.fixture(autouse=True)
+def no_database(monkeypatch):
+    monkeypatch.setattr(apache_data, 'aggregate', fake_aggregate)
+    monkeypatch.setattr(nntp_proxy_data, 'aggregate', fake_aggregate)
+
+
+@pytest.mark.parametrize('panel', [
+    lambda name: apache_data.get_apache_ips_data({}, '', name),
+    lambda name: apache_data.get_apache_size_ip_data({}, '', 'size_prefix' if name == 'ip_prefixes' else 'size_ip',
+                                                     True),
+    lambda name: nntp_proxy_data.get_nntp_proxy_ips_data({}, '', name),
+    lambda name: nntp_proxy_data.get_nntp_proxy_size_ip_data({}, '', 'size_prefix' if name == 'ip_prefixes'
+                                                             else 'size_ip', True),
+])
+def test_address_rows_carry_stored_country(panel):
+    data = panel('ip_addresses')
+    countries = {x['ip_address']: (x['_country_code'], x['_country_name']) for x in data.data}
+    assert countries == {'1.2.3.4': ('nl', 'Netherlands'), '10.0.0.1': (None, None)}
+    # the rows merged per prefix are built from them as well
+    assert len(panel('ip_prefixes').data) == 2
@@ -3,75 +3,127 @@ import time
 import logging
 import datetime
 import dateutil.parser
+import dateutil.tz
 from traceback import print_exc
-from typing import Dict, Pattern, Match, Optional, Sequence
+from typing import Callable, Dict, Pattern, Match, Optional, Sequence
 
 
 class TimestampParsers:
     _months: Dict[str, int] = {"jan": 1, "feb": 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6, 'jul': 7, 'aug': 8,
                                'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12}
+    MAX_CACHE_SIZE: int = 4096
+    CONTEXT_INTERVAL: int = 900
 
     def __init__(self) -> None:
         self._apache_pattern: Pattern[str] = re.compile(r'\[(\d+)/([a-zA-Z]+)/(\d+):(\d+):(\d+):(\d+)\s([+-]?\d+)]')
         self._syslog_pattern: Pattern[str] = re.compile(r'([A-Za-z]+)\s+(\d+)\s+(\d+):(\d+):(\d+)')
+        # many lines share the same second, so the parsed timestamps are kept per token
+        self._syslog_cache: Dict[str, datetime.datetime] = {}
+        self._apache_cache: Dict[str, datetime.datetime] = {}
+        self._iso_cache: Dict[str, datetime.datetime] = {}
+        self._tz_cache: Dict[int, datetime.tzinfo] = {}
+        # syslog timestamps have no year or time zone, they are taken from the clock and only change rarely
+        self._year: int = 0
+        self._local_tz: Optional[datetime.tzinfo] = None
+        self._local_tz_str: str = ''
+        self._context_expires: float = 0
 
-    def parse_syslog_timestamp(self, time_str: str) -> str:
+    def _tzinfo(self, offset: int) -> datetime.tzinfo:
+        try:
+            return self._tz_cache[offset]
+        except KeyError:
+            tz = dateutil.tz.UTC if offset == 0 else dateutil.tz.tzoffset(None, offset)
+            self._tz_cache[offset] = tz
+            return tz
+
+    def _refresh_context(self) -> None:
+        now: float = time.time()
+        if now < self._context_expires:
+            return
+        local_time = time.localtime(now)
+        year: int = local_time.tm_year
+        tz_str: str = time.strftime("%z", local_time)
+        if year != self._year or tz_str != self._local_tz_str:
+            self._syslog_cache.clear()
+            self._year = year
+            self._local_tz_str = tz_str
+            self._local_tz = self._tzinfo(local_time.tm_gmtoff)
+        # every UTC offset in use is a multiple of 15 minutes, so a new year or a DST change falls on a quarter hour
+        self._context_expires = now - now % self.CONTEXT_INTERVAL + self.CONTEXT_INTERVAL
+
+    def _cache_store(self, cache: Dict[str, datetime.datetime], time_str: str, value: datetime.datetime) \
+            -> datetime.datetime:
+        if len(cache) >= self.MAX_CACHE_SIZE:
+            cache.clear()
+        cache[time_str] = value
+        return value
+
+    def _month(self, name: str) -> int:
+        try:
+            return self._months[name.lower()]
+        except KeyError:
+            raise ValueError("Unknown month: {}".format(name.lower()))
+
+    def parse_syslog_datetime(self, time_str: str) -> datetime.datetime:
+        self._refresh_context()
+        try:
+            return self._syslog_cache[time_str]
+        except KeyError:
+            pass
         matches: Optional[Match[str]] = self._syslog_pattern.search(time_str)
+        if matches is None:
+            raise ValueError("Not found: {}".format(time_str))
+        x: Sequence = matches.groups()
+        value = datetime.datetime(self._year, self._month(x[0]), int(x[1]), int(x[2]), int(x[3]), int(x[4]),
+                                  tzinfo=self._local_tz)
+        return self._cache_store(self._syslog_cache, time_str, value)
+
+    def parse_apache_datetime(self, time_str: str) -> datetime.datetime:
         try:
-            if matches is None:
-                raise ValueError("Not found: {}".format(time_str))
-            x: Sequence = matches.groups()
-            if x is None:
-                raise ValueError("Not found: {}".format(time_str))
-            day: int = int(x[1])
-            mnt: str = x[0].lower()
-            if mnt in self._months:
-                mon: int = self._months[mnt]
-            else:
-                raise ValueError("Unknown month: {}".format(mnt))
-            year: int = datetime.datetime.now().year
-            hour: int = int(x[2])
-            mn: int = int(x[3])
-            sec: int = int(x[4])
-            tz: str = time.strftime("%z", time.localtime())
-            time_out_str: str = "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}{:s}".format(year, mon, day, hour, mn, sec,
-                                                                                       tz)
-            dateutil.parser.isoparse(time_out_str)
+            return self._apache_cache[time_str]
+        except KeyError:
+            pass
+        matches: Optional[Match[str]] = self._apache_pattern.search(time_str)
+        if matches is None:
+            raise ValueError("Not found: {}".format(time_str))
+        x: Sequence = matches.groups()
+        tz: int = int(x[6])
+        offset: int = (abs(tz) // 100 * 3600 + abs(tz) % 100 * 60) * (-1 if tz < 0 else 1)
+        value = datetime.datetime(int(x[2]), self._month(x[1]), int(x[0]), int(x[3]), int(x[4]), int(x[5]),
+                                  tzinfo=self._tzinfo(offset))
+        return self._cache_store(self._apache_cache, time_str, value)
+
+    def parse_iso_datetime(self, time_str: str) -> datetime.datetime:
+        try:
+            return self._iso_cache[time_str]
+        except KeyError:
+            pass
+        return self._cache_store(self._iso_cache, time_str, dateutil.parser.isoparse(time_str))
+
+    def parse_syslog_timestamp(self, time_str: str) -> str:
+        try:
+            value = self.parse_syslog_datetime(time_str)
         except ValueError as e:
             # print_exc()
             logging.info("Invalid Syslog Date {} {}".format(time_str, e))
             return ""
-        return time_out_str
+        return "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}{:s}".format(value.year, value.month, value.day, value.hour,
+                                                                     value.minute, value.second, self._local_tz_str)
 
     def parse_apache_timestamp(self, time_str: str) -> str:
-        matches: Optional[Match[str]] = self._apache_pattern.search(time_str)
         try:
-            if matches is None:
-                raise ValueError("Not found: {}".format(time_str))
-            x = matches.groups()
-            if x is None:
-                raise ValueError("Not found: {}".format(time_str))
-            day: int = int(x[0])
-            mnt: str = x[1].lower()
-            if mnt in self._months:
-                mon: int = self._months[mnt]
-            else:
-                raise ValueError("Unknown month: {}".format(mnt))
-            year: int = int(x[2])
-            hour: int = int(x[3])
-            mn: int = int(x[4])
-            sec: int = int(x[5])
-            tz: int = int(x[6])
-            time_out_str = "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}{:+05d}".format(year, mon, day, hour, mn, sec, tz)
-            dateutil.parser.isoparse(time_out_str)
+            value = self.parse_apache_datetime(time_str)
         except ValueError as e:
             logging.info("Invalid Apache Date {} {}".format(time_str, e))
             return ""
-        return time_out_str
+        offset: int = int(value.utcoffset().total_seconds()) // 60
+        tz: int = (abs(offset) // 60 * 100 + abs(offset) % 60) * (-1 if offset < 0 else 1)
+        return "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}{:+05d}".format(value.year, value.month, value.day, value.hour,
+                                                                        value.minute, value.second, tz)
 
     def parse_iso_timestamp(self, time_str: str) -> str:
         try:
-            dateutil.parser.isoparse(time_str)
+            self.parse_iso_datetime(time_str)
         except ValueError as e:
             logging.info("Invalid ISO Date {} {}".format(time_str, e))
             return ""
@@ -83,9 +135,20 @@ _P = TimestampParsers()
 parse_apache_timestamp = _P.parse_apache_timestamp
 parse_syslog_timestamp = _P.parse_syslog_timestamp
 parse_iso_timestamp = _P.parse_iso_timestamp
+parse_apache_datetime = _P.parse_apache_datetime
+parse_syslog_datetime = _P.parse_syslog_datetime
+parse_iso_datetime = _P.parse_iso_datetime
+
+# the string parsers above are validated through these, so a date transform can skip the string
+datetime_parsers: Dict[Callable[[str], str], Callable[[str], datetime.datetime]] = {
+    parse_apache_timestamp: parse_apache_datetime,
+    parse_syslog_timestamp: parse_syslog_datetime,
+    parse_iso_timestamp: parse_iso_datetime,
+}
 
 if __name__ == "__main__":
     print('j', parse_syslog_timestamp("Dec 1 23:17:58 "))
     print('y', parse_apache_timestamp("[04/Dec/2021:00:41:47 +0100]"))
     print('x', parse_iso_timestamp("2021-12-04T03:41:47z"))
     print('x', parse_iso_timestamp("2025-05-25T21:10:29.238524+00:00"))
+    print('d', parse_syslog_datetime("Dec 1 23:17:58 "), parse_apache_datetime("[04/Dec/2021:00:41:47 -0530]"))
@@ -63,6 +63,7 @@ class DataSet:
         '$pid': lambda: str(os.getpid()),
         '$version': lambda: log_analyser_version.get_version(),
     }
+    _dynamic = {'$time', '$date', '$isotime'}
 
     def __init__(self):
         pass
@@ -79,6 +80,10 @@ class DataSet:
         except IndexError:
             return default
 
+    def is_dynamic(self, item) -> bool:
+        # these change on every call, everything else only changes when the host is reconfigured
+        return item in self._dynamic
+
 
 def pid_running(pid_filename: str) -> bool:
     try: